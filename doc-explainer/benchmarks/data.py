@@ -0,0 +1,126 @@
+import json
+import random
+import uuid
+from typing import Any, Dict, List, Tuple
+
+from PIL import Image
+
+VOCABULARY = [
+    "Invoice",
+    "INV-2021-0042",
+    "Total",
+    "1,250.00",
+    "USD",
+    "Date",
+    "2021-03-04",
+    "Acme",
+    "Corp.",
+    "Due",
+    "Amount",
+    "Tax",
+    "VAT",
+    "12%",
+    "Page",
+    "of",
+    "Shipping",
+    "Address",
+    "Reference",
+    "Quantity",
+]
+
+# Letter page at 100 dpi
+PAGE_SIZE = (850, 1100)
+
+
+def make_image(size: Tuple[int, int] = PAGE_SIZE, seed: int = 0) -> Image.Image:
+    """A blank page with a seeded gray level, so that pages hash differently."""
+    level = 200 + random.Random(seed).randint(0, 55)
+    return Image.new("RGB", size, (level, level, level))
+
+
+def make_words(n: int, pages: int = 1, seed: int = 0) -> List[Dict[str, Any]]:
+    """Random OCR words, boxes as [x, y, w, h] in [0, 1000], 1-based pages."""
+    rng = random.Random(seed)
+    words = []
+    for _ in range(n):
+        w, h = rng.randint(10, 90), rng.randint(8, 30)
+        words.append(
+            {
+                "page": rng.randint(1, pages),
+                "text": rng.choice(VOCABULARY),
+                "bbox": [rng.randint(0, 1000 - w), rng.randint(0, 1000 - h), w, h],
+            }
+        )
+    words.sort(key=lambda word: word["page"])
+    return words
+
+
+def make_textract(words: List[Dict[str, Any]]) -> str:
+    """Raw Textract JSON of the words, with the fields a real output carries."""
+    blocks = []
+    for word in words:
+        x, y, w, h = (value / 1000 for value in word["bbox"])
+        blocks.append(
+            {
+                "BlockType": "WORD",
+                "Confidence": 99.1,
+                "Text": word["text"],
+                "TextType": "PRINTED",
+                "Geometry": {
+                    "BoundingBox": {"Width": w, "Height": h, "Left": x, "Top": y},
+                    "Polygon": [
+                        {"X": x, "Y": y},
+                        {"X": x + w, "Y": y},
+                        {"X": x + w, "Y": y + h},
+                        {"X": x, "Y": y + h},
+                    ],
+                },
+                "Id": str(uuid.UUID(int=len(blocks))),
+                "Page": word["page"],
+            }
+        )
+    return json.dumps([{"DocumentMetadata": {"Pages": 1}, "Blocks": blocks}])
+
+
+def make_documents(
+    num_documents: int,
+    questions: int = 5,
+    pages: int = 1,
+    words_per_page: int = 300,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Documents in the layout of the BoundingDocs dataset (`source`, `doc_id`,
+    `doc_images`, `doc_ocr`, `Q&A`). Every answer is one of the OCR words.
+    """
+    rng = random.Random(seed)
+    documents = []
+    for doc_index in range(num_documents):
+        words = make_words(words_per_page * pages, pages, seed=seed + doc_index)
+        qa = {}
+        for q in range(questions):
+            word = rng.choice(words)
+            x, y, w, h = word["bbox"]
+            qa[f"q{q}"] = {
+                "question": f"What is the {word['text']} of document {doc_index}?",
+                "answers": [
+                    {
+                        "value": word["text"],
+                        "page": word["page"],
+                        "location": [[w, h, x, y]],
+                    }
+                ],
+            }
+        documents.append(
+            {
+                "source": f"source-{doc_index % 3}",
+                "doc_id": f"doc-{doc_index}",
+                "doc_images": [
+                    make_image(seed=seed + doc_index * pages + page)
+                    for page in range(pages)
+                ],
+                "doc_ocr": [make_textract(words)],
+                "Q&A": json.dumps(qa),
+            }
+        )
+    return documents
@@ -0,0 +1,178 @@
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# Version of the result file layout, bumped when fields change meaning
+SCHEMA_VERSION = 1
+
+
+class Skipped(Exception):
+    """Raised by a benchmark whose requirements are not available here."""
+
+
+def measure(
+    fn: Callable[[], Any],
+    items: int = 1,
+    repeat: int = 5,
+    warmup: int = 1,
+    min_time: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    Time a function.
+
+    Args:
+        fn: Function to time, called without arguments.
+        items: Number of items (questions, words, boxes...) processed per call,
+            used for the throughput.
+        repeat: Number of timed calls.
+        warmup: Number of untimed calls made first.
+        min_time: Keep calling past `repeat` until this many seconds are spent.
+
+    Returns:
+        Dict with the number of calls, latency statistics per call in
+        milliseconds and the throughput in items per second.
+    """
+    for _ in range(warmup):
+        fn()
+
+    timings: List[float] = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        while len(timings) < repeat or time.perf_counter() - start < min_time:
+            begin = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - begin)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    seconds = np.array(timings)
+    return {
+        "calls": len(timings),
+        "items": items,
+        "latency_ms": {
+            "mean": float(seconds.mean() * 1e3),
+            "median": float(np.median(seconds) * 1e3),
+            "p95": float(np.percentile(seconds, 95) * 1e3),
+            "min": float(seconds.min() * 1e3),
+            "max": float(seconds.max() * 1e3),
+        },
+        "throughput": float(items / np.median(seconds)) if seconds.any() else None,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    """Machine and library versions, stored with the results."""
+    from importlib.metadata import PackageNotFoundError, version
+
+    versions = {}
+    for package in ("doc_explainer", "numpy", "torch", "transformers", "pillow"):
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "commit": _git_commit(),
+        "versions": versions,
+    }
+
+
+class Report:
+    """
+    Results of a benchmark session, written as JSON.
+
+    Every result is identified by its `suite`, `name` and `size`, which is the key
+    used by `compare` to match results across files.
+    """
+
+    def __init__(self):
+        self.created = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.environment = environment()
+        self.results: List[Dict[str, Any]] = []
+
+    def add(
+        self, suite: str, name: str, size: str, params: Dict[str, Any], **result
+    ) -> None:
+        self.results.append(
+            {"suite": suite, "name": name, "size": size, "params": params, **result}
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "schema_version": SCHEMA_VERSION,
+            "created": self.created,
+            "environment": self.environment,
+            "results": self.results,
+        }
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def _key(result: Dict[str, Any]) -> tuple:
+    return result["suite"], result["name"], result["size"]
+
+
+def compare(
+    baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.2
+) -> List[Dict[str, Any]]:
+    """
+    Find the benchmarks whose median latency grew by more than `tolerance`.
+
+    Args:
+        baseline: Result file of the reference run, as loaded from JSON.
+        current: Result file of the new run.
+        tolerance: Allowed relative slowdown (0.2 = 20%).
+
+    Returns:
+        One entry per regression, with the baseline and current medians.
+    """
+    reference = {
+        _key(result): result for result in baseline["results"] if "latency_ms" in result
+    }
+    regressions = []
+    for result in current["results"]:
+        before = reference.get(_key(result))
+        if before is None or "latency_ms" not in result:
+            continue
+        old, new = before["latency_ms"]["median"], result["latency_ms"]["median"]
+        if old > 0 and new > old * (1 + tolerance):
+            regressions.append(
+                {
+                    "suite": result["suite"],
+                    "name": result["name"],
+                    "size": result["size"],
+                    "baseline_ms": old,
+                    "current_ms": new,
+                    "slowdown": new / old,
+                }
+            )
+    return regressions
@@ -0,0 +1,94 @@
+"""
+Run the benchmark suites and write the results as JSON.
+
+Everything runs on CPU without network: the VLM is `FakeVLM` and the box
+regressor `FakeExplainer`, so the numbers measure the code around the models.
+
+    python -m benchmarks.run --output benchmarks.json
+    python -m benchmarks.run --suites fuzzy metrics --sizes small medium
+    python -m benchmarks.run --compare baseline.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import os
+import sys
+import traceback
+
+# src, for the doc_explainer and dataset packages without install
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(ROOT, "src"))
+
+from .harness import Report, Skipped, compare
+from .suites import SIZES, SUITES
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DocExplainer benchmarks")
+    parser.add_argument(
+        "--suites", nargs="+", choices=sorted(SUITES), default=list(SUITES)
+    )
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=list(SIZES))
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds per fake VLM call (0 measures only the code around the model)",
+    )
+    parser.add_argument("--output", type=str, default="benchmarks.json")
+    parser.add_argument(
+        "--compare", type=str, default=None, help="Baseline result file to compare to"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown of the median latency reported as a regression",
+    )
+    return parser.parse_args(argv)
+
+
+def run(args) -> Report:
+    report = Report()
+    options = {"latency": args.latency}
+    for suite in args.suites:
+        for size in args.sizes:
+            try:
+                for name, params, result in SUITES[suite](size, options):
+                    report.add(suite, name, size, params, **result)
+                    print(
+                        f"{suite:>14} {name:<20} {size:<7}"
+                        f" median {result['latency_ms']['median']:10.3f} ms"
+                        f"  {result['throughput']:14.1f} items/s"
+                    )
+            except Skipped as error:
+                report.add(suite, "*", size, {}, skipped=str(error))
+                print(f"{suite:>14} {'*':<20} {size:<7} skipped: {error}")
+            except Exception as error:
+                report.add(suite, "*", size, {}, error=repr(error))
+                traceback.print_exc()
+    return report
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    report.save(args.output)
+    print(f"Results saved to {args.output}")
+
+    if args.compare is None:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, report.to_dict(), args.tolerance)
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression['suite']}/{regression['name']}/{regression['size']}:"
+            f" {regression['baseline_ms']:.3f} ms -> {regression['current_ms']:.3f} ms"
+            f" (x{regression['slowdown']:.2f})"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+import importlib
+import json
+import os
+import random
+import subprocess
+import sys
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+import numpy as np
+
+import doc_explainer
+from doc_explainer import DocExplainer
+from doc_explainer.anls import batch_anls, compute_anls
+from doc_explainer.boxes import WordTable
+from doc_explainer.fuzzy import FuzzyMatcher
+from doc_explainer.metrics import (
+    batch_iou,
+    batch_normalized_center_distance,
+    compute_iou,
+    compute_normalized_center_distance,
+    pairwise_iou,
+)
+from doc_explainer.models.fake import FakeExplainer
+from doc_explainer.models.utils import DEFAULT_BATCH_SIZE
+from doc_explainer.spatial import WordIndex
+
+from .data import VOCABULARY, make_documents, make_image, make_textract, make_words
+from .harness import Skipped, measure
+
+# Every suite runs each of its benchmarks at these sizes
+SIZES = ("small", "medium", "large")
+
+# (name, params, measure() result) of one benchmark at one size
+Result = Tuple[str, Dict[str, Any], Dict[str, Any]]
+
+
+def _boxes(n: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 900, size=(n, 2))
+    wh = rng.uniform(5, 100, size=(n, 2))
+    return np.hstack([xy, xy + wh])
+
+
+def _dataset_module(name: str) -> Any:
+    """
+    Import a module of the `dataset` package (`src/dataset`) of the evaluation scripts.
+
+    Raises:
+        Skipped: If its dependencies are not available.
+    """
+    try:
+        return importlib.import_module(f"dataset.{name}")
+    except ImportError as error:
+        raise Skipped(f"src/dataset is not importable here: {error}") from error
+
+
+def _explainer(latency: float) -> DocExplainer:
+    explainer = DocExplainer("fake", device="cpu", explainer=FakeExplainer())
+    explainer.vlm.latency = latency
+    return explainer
+
+
+def bench_metrics(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    n = {"small": 100, "medium": 10_000, "large": 100_000}[size]
+    b1, b2 = _boxes(n, 0), _boxes(n, 1)
+    pairs_1, pairs_2 = b1.tolist(), b2.tolist()
+
+    def scalar():
+        for x, y in zip(pairs_1, pairs_2):
+            compute_iou(x, y)
+            compute_normalized_center_distance(x, y)
+
+    def batched():
+        batch_iou(b1, b2)
+        batch_normalized_center_distance(b1, b2)
+
+    yield "iou_center_scalar", {"boxes": n}, measure(scalar, items=n, repeat=3)
+    yield "iou_center_batch", {"boxes": n}, measure(batched, items=n)
+
+    m = {"small": 100, "medium": 1_000, "large": 3_000}[size]
+    yield (
+        "pairwise_iou",
+        {"boxes": m},
+        measure(lambda: pairwise_iou(b1[:m], b2[:m]), items=m * m),
+    )
+
+    rng = random.Random(0)
+    answers = [
+        (rng.choice(VOCABULARY) + rng.choice(["", "s", " 1"]), rng.choice(VOCABULARY))
+        for _ in range(n)
+    ]
+
+    def anls_scalar():
+        for prediction, ground_truth in answers:
+            compute_anls(prediction, ground_truth)
+
+    yield "anls_scalar", {"pairs": n}, measure(anls_scalar, items=n, repeat=3)
+    yield "anls_batch", {"pairs": n}, measure(lambda: batch_anls(answers), items=n)
+
+
+def bench_fuzzy(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    n = {"small": 100, "medium": 1_000, "large": 5_000}[size]
+    words = make_words(n, pages=1, seed=0)
+    table = WordTable.from_words(words)
+    rng = random.Random(0)
+    targets = [rng.choice(VOCABULARY) for _ in range(50)]
+    targets += [f"{rng.choice(VOCABULARY)} {rng.choice(VOCABULARY)}" for _ in range(50)]
+
+    yield (
+        "build_matcher",
+        {"words": n},
+        measure(lambda: FuzzyMatcher(table), items=n),
+    )
+    for max_span in (1, 3):
+
+        def match(max_span=max_span):
+            # A new matcher per call, as the eval scripts build one per document
+            matcher = FuzzyMatcher(table)
+            for target in targets:
+                matcher.match(target, page=1, max_span=max_span)
+
+        yield (
+            f"match_span{max_span}",
+            {"words": n, "targets": len(targets), "max_span": max_span},
+            measure(match, items=len(targets), repeat=3),
+        )
+
+
+def bench_ocr(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    n = {"small": 100, "medium": 1_000, "large": 10_000}[size]
+    words = make_words(n, pages=4, seed=0)
+    table = WordTable.from_words(words)
+
+    yield (
+        "word_table",
+        {"words": n},
+        measure(lambda: WordTable.from_words(words), items=n),
+    )
+    yield (
+        "word_index",
+        {"words": n},
+        measure(lambda: WordIndex.from_words(table), items=n),
+    )
+
+    index = WordIndex.from_words(table)
+    queries = _boxes(200, 2).tolist()
+
+    def snap():
+        for query in queries:
+            index.snap(1, query)
+
+    yield (
+        "snap",
+        {"words": n, "queries": len(queries)},
+        measure(snap, items=len(queries)),
+    )
+
+    # Textract parsing lives in the evaluation scripts
+    ocr_processor = _dataset_module("ocr_processor")
+    processor = ocr_processor.OCRProcessor
+    sample = {"doc_ocr": [make_textract(words)]}
+    for streaming in (False, True):
+
+        def parse(streaming=streaming):
+            blocks = processor.extract_blocks_from_ocr(sample, streaming=streaming)
+            processor.extract_word_table(blocks)
+
+        yield (
+            "textract_stream" if streaming else "textract_json",
+            {"words": n, "bytes": len(sample["doc_ocr"][0])},
+            measure(parse, items=n, repeat=3),
+        )
+
+
+def bench_docexplainer(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    latency = options["latency"]
+    explainer = _explainer(latency)
+    page = make_image()
+    questions = [f"What is the {word}?" for word in VOCABULARY]
+
+    def forward(word_index=None):
+        for question in questions:
+            explainer([page], question, word_index=word_index)
+
+    params = {"questions": len(questions), "latency": latency}
+    if size == "small":
+        yield "forward", params, measure(forward, items=len(questions))
+        yield (
+            "forward_batch",
+            {**params, "batch_size": DEFAULT_BATCH_SIZE},
+            measure(
+                lambda: explainer.forward_batch([[page]] * len(questions), questions),
+                items=len(questions),
+            ),
+        )
+        return
+
+    n = {"medium": 1_000, "large": 10_000}[size]
+    word_index = WordIndex.from_words(make_words(n, pages=1, seed=0))
+    yield (
+        "forward_snap",
+        {**params, "words": n},
+        measure(lambda: forward(word_index), items=len(questions)),
+    )
+
+
+def bench_eval_loop(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    """The per-question loop of `01_docexplainer_test.py`, without I/O."""
+    num_documents = {"small": 5, "medium": 20, "large": 100}[size]
+    latency = options["latency"]
+    documents = make_documents(num_documents, questions=5, words_per_page=300)
+    explainer = _explainer(latency)
+
+    def loop():
+        for document in documents:
+            for data in json.loads(document["Q&A"]).values():
+                answer = data["answers"][0]
+                result = explainer(
+                    [document["doc_images"][answer["page"] - 1]], data["question"]
+                )
+                w, h, x, y = answer["location"][0]
+                bbox_gt = [x / 1000, y / 1000, (x + w) / 1000, (y + h) / 1000]
+                compute_iou(result.bbox, bbox_gt)
+                compute_normalized_center_distance(result.bbox, bbox_gt)
+                compute_anls(result.answer, answer["value"])
+
+    questions = num_documents * 5
+    yield (
+        "sequential",
+        {"documents": num_documents, "questions": questions, "latency": latency},
+        measure(loop, items=questions, repeat=3),
+    )
+
+
+def bench_eval_pipeline(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    """`strategies.evaluate` of the evaluation scripts, at several worker counts."""
+    strategies = _dataset_module("strategies")
+    runs = _dataset_module("runs")
+    num_documents = {"small": 5, "medium": 20, "large": 100}[size]
+    latency = options["latency"]
+    documents = make_documents(num_documents, questions=5, words_per_page=300)
+    explainer = _explainer(latency)
+
+    for workers in (1, 4):
+
+        def evaluate(workers=workers):
+            run = runs.EvaluationRun(None, len(documents))
+            strategy = strategies.DocExplainerStrategy(explainer, snap_to_ocr=True)
+            strategies.evaluate(
+                documents,
+                strategy,
+                run,
+                loader_workers=workers,
+                inference_workers=workers,
+                scoring_workers=workers,
+            )
+
+        yield (
+            f"workers{workers}",
+            {
+                "documents": num_documents,
+                "questions": num_documents * 5,
+                "latency": latency,
+                "workers": workers,
+            },
+            measure(evaluate, items=num_documents * 5, repeat=3),
+        )
+
+
+def bench_cpu_precision(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    """
+    Linear layers of a decoder on CPU at each precision of `load_options`.
+
+    The SmolVLM checkpoint is not downloaded here; its matrix products, which
+    dominate CPU latency, are stood in for by a stack of MLP blocks with its
+    hidden size (2048) at the "large" size.
+    """
+    import torch
+    import torch.nn as nn
+
+    from doc_explainer.models.device import quantize
+
+    hidden = {"small": 512, "medium": 1024, "large": 2048}[size]
+    tokens = 16
+    torch.manual_seed(0)
+
+    def blocks() -> nn.Module:
+        return nn.Sequential(
+            *(
+                nn.Sequential(
+                    nn.Linear(hidden, 4 * hidden),
+                    nn.GELU(),
+                    nn.Linear(4 * hidden, hidden),
+                )
+                for _ in range(4)
+            )
+        ).eval()
+
+    inputs = torch.randn(1, tokens, hidden)
+    models = {
+        "float32": (blocks(), inputs),
+        "bf16": (blocks().to(torch.bfloat16), inputs.to(torch.bfloat16)),
+        "int8": (quantize(blocks(), "int8"), inputs),
+    }
+    for name, (model, x) in models.items():
+
+        def forward(model=model, x=x):
+            with torch.inference_mode():
+                model(x)
+
+        yield (
+            name,
+            {"hidden": hidden, "tokens": tokens, "threads": torch.get_num_threads()},
+            measure(forward, items=tokens, repeat=5),
+        )
+
+
+def bench_image_encoding(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    """
+    Payloads of the pages sent to Claude, for documents of one page with 20
+    questions each: re-encoded per question as JPEG (the previous behavior),
+    and through an `EncodedImageCache` (one encoding per page).
+    """
+    from doc_explainer.models.image_cache import EncodedImageCache, encode_page
+
+    num_pages = {"small": 2, "medium": 10, "large": 40}[size]
+    questions = 20
+    pages = [make_image(seed=seed) for seed in range(num_pages)]
+    params = {"pages": num_pages, "questions": questions}
+
+    def per_question():
+        for page in pages:
+            for _ in range(questions):
+                encode_page(page, "jpeg")
+
+    def cached():
+        cache = EncodedImageCache()
+        for page in pages:
+            cache.get_many([page] * questions)
+        cache.close()
+
+    items = num_pages * questions
+    yield "per_question_jpeg", params, measure(per_question, items=items, repeat=3)
+    yield "cached_auto", params, measure(cached, items=items, repeat=3)
+
+
+def bench_resolution(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    """
+    Downscaling of letter pages scanned at 300 dpi to the default budget of each
+    backend, with the image tokens of a page at native resolution and as sent.
+    """
+    from doc_explainer.models.resolution import ResolutionPolicy
+
+    num_pages = {"small": 2, "medium": 8, "large": 32}[size]
+    scans = [make_image(size=(2550, 3300), seed=seed) for seed in range(num_pages)]
+    policy = ResolutionPolicy()
+    for backend in ("qwen2.5-vl-7b", "smolvlm", "claude-sonnet-4"):
+        resize = policy.fit(scans[0], backend)
+
+        def run(resize=resize, backend=backend):
+            # Copies, so that no resized page is reused across repeats
+            for page in scans:
+                policy.apply(page.copy(), resize, backend)
+
+        params = {
+            "pages": num_pages,
+            "size": list(resize.size),
+            "native_tokens": resize.native_tokens,
+            "tokens": resize.tokens,
+        }
+        yield backend, params, measure(run, items=num_pages, repeat=3)
+
+
+def bench_imports(size: str, options: Dict[str, Any]) -> Iterator[Result]:
+    """Start-up time of `import doc_explainer` and its modules, in a fresh interpreter."""
+    if size != "small":
+        return
+    env = dict(
+        os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(doc_explainer.__file__))
+    )
+    statements = {
+        "package": "import doc_explainer",
+        "metrics": "import doc_explainer.metrics, doc_explainer.anls",
+        "docexplainer": "from doc_explainer import DocExplainer",
+    }
+    for name, statement in statements.items():
+
+        def run(statement=statement):
+            subprocess.run([sys.executable, "-c", statement], check=True, env=env)
+
+        yield f"import_{name}", {"statement": statement}, measure(run, repeat=3)
+
+
+SUITES: Dict[str, Callable[[str, Dict[str, Any]], Iterator[Result]]] = {
+    "metrics": bench_metrics,
+    "fuzzy": bench_fuzzy,
+    "ocr": bench_ocr,
+    "docexplainer": bench_docexplainer,
+    "eval_loop": bench_eval_loop,
+    "eval_pipeline": bench_eval_pipeline,
+    "cpu_precision": bench_cpu_precision,
+    "image_encoding": bench_image_encoding,
+    "resolution": bench_resolution,
+    "imports": bench_imports,
+}
@@ -1,26 +1,37 @@
-from datasets import load_dataset
-from tqdm import tqdm
-from collections import defaultdict
-from anls_star import anls_score
-
 import argparse
 import json 
 import sys 
 import os 
 
-# Add project root to path to enable local imports
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.docexplainer.docexplainer import DocExplainer
-from src.docexplainer.metrics import compute_iou, compute_normalized_center_distance, compute_iou_with_threshold
-from src.boundingDocs.utils import compute_mean_metrics
-from src.boundingDocs.utils import METRIC_KEYS, union_boxes, scaledown_bbox
+from doc_explainer.model import DocExplainer
+from doc_explainer.models.device import set_num_threads
+from doc_explainer.models.utils import get_prediction_cache, set_prediction_cache
+from doc_explainer.models.cache import PredictionCache
+from dataset.shards import load_evaluation_dataset
+from dataset.runs import EvaluationRun, add_run_arguments, shard_suffix
+from dataset.subsets import add_subset_arguments, load_subset, subset_suffix
+from dataset.pipeline import add_backend_arguments, add_device_arguments, add_pipeline_arguments, start_api_backend, start_instrumentation, save_instrumentation
+from dataset.strategies import DocExplainerStrategy, evaluate
 
 
 
 def parse_args(): 
     parser = argparse.ArgumentParser() 
     parser.add_argument('--vlm-model', type=str, default="smolvlm", help="Model Name")
+    parser.add_argument('--shards', type=str, default=None, help="Local shards built with shards.py instead of the Hub dataset")
+    parser.add_argument('--ocr-store', type=str, default=None, help="Pre-parsed OCR store built with ocr_store.py")
+    parser.add_argument('--stream-ocr', action='store_true', help="Parse the raw Textract output incrementally to bound memory")
+    parser.add_argument('--prediction-cache', type=str, default=None, help="SQLite file caching the VLM predictions across runs")
+    parser.add_argument('--cache-max-gb', type=float, default=1.0, help="Size bound of the prediction cache")
+    parser.add_argument('--snap-to-ocr', action='store_true', help="Snap predicted boxes to OCR word boundaries")
+    add_run_arguments(parser)
+    add_subset_arguments(parser)
+    add_pipeline_arguments(parser)
+    add_device_arguments(parser)
+    add_backend_arguments(parser)
     args = parser.parse_args()
     
     return args
@@ -28,65 +39,42 @@ def parse_args():
 
 if __name__ == '__main__':
     args = parse_args()
-    dataset = load_dataset("letxbe/BoundingDocs", revision="v2.0", split='test')
+    dataset = load_evaluation_dataset(args)
+    subset = load_subset(args, dataset)
+    collector = start_instrumentation(args)
+    start_api_backend(args)
+    if args.prediction_cache:
+        set_prediction_cache(PredictionCache(args.prediction_cache, max_bytes=int(args.cache_max_gb * 2**30)))
        
-    metrics_per_source = defaultdict(lambda: {key: [] for key in METRIC_KEYS})
-    questions_per_source = defaultdict(int)
-    processed_per_source = defaultdict(int)
-    
     model_name = args.vlm_model 
+    set_num_threads(args.num_threads)
     explainer = DocExplainer(
-         vlm_model_name = model_name
+         vlm_model_name = model_name,
+         device = args.device,
+         quantization = args.quantization,
     )
     
-    for i, document in tqdm(enumerate(dataset), total=len(dataset), desc="Processing Documents"):
-        
-        source = document.get('source')
-        doc_id = document.get('doc_id')
-        images = document.get('doc_images', [])
-
-        qa_data = json.loads(document.get('Q&A'))
-              
-        
-        for index, (q_key, data) in tqdm(enumerate(qa_data.items(), start=1), desc=f'Processing:{source}-{doc_id}', total=len(qa_data)):
-            questions_per_source[source] += 1 
-        
-            question = data.get('rephrased_question', data.get('question', ''))
-            page_idx = data['answers'][0]['page'] - 1 
-            image = images[page_idx]
-
-            result = explainer([image], question)
-            
-            pred_bbox = None
-            pred_answer = None
-            
-            if result: 
-                pred_bbox = result.bbox
-                pred_answer = result.answer
-                
-            if pred_answer is not None and pred_bbox is not None:
-                processed_per_source[source] += 1
-                
-                
-                gt_answer = data['answers'][0]['value']
-                # Predicted bbox is in range(0,1) and gt bbox are in range[0,1000]
-                locations = data['answers'][0].get('location', [])
-                bbox_gt = scaledown_bbox(union_boxes(locations))
-                
-                iou = compute_iou(pred_bbox, bbox_gt)
-                center_distance = compute_normalized_center_distance(pred_bbox, bbox_gt)
-                iou_05 = compute_iou_with_threshold(pred_bbox, bbox_gt, threshold=0.5)
-                iou_075 = compute_iou_with_threshold(pred_bbox, bbox_gt, threshold=0.75)
-                anls = anls_score(pred_answer, gt_answer)
-                
-                metrics_per_source[source]['iou'].append(iou)
-                metrics_per_source[source]['center_distance'].append(center_distance)
-                metrics_per_source[source]['iou_05'].append(iou_05)
-                metrics_per_source[source]['iou_075'].append(iou_075)
-                metrics_per_source[source]['anls'].append(anls)
-
-    results = compute_mean_metrics(metrics_per_source, questions_per_source, processed_per_source)
+    result_file = f'{model_name}_docexplainer_result{subset_suffix(subset)}{shard_suffix(args.shard_id, args.num_shards)}.json'
+    run = EvaluationRun(
+        args.checkpoint or result_file.replace('.json', '.checkpoint.jsonl'),
+        len(dataset),
+        shard_id=args.shard_id,
+        num_shards=args.num_shards,
+        resume=not args.restart,
+        subset=subset,
+    )
+    
+    results = evaluate(
+        dataset, DocExplainerStrategy(explainer, snap_to_ocr=args.snap_to_ocr, batch_size=args.batch_size), run,
+        loader_workers=args.loader_workers,
+        inference_workers=args.inference_workers,
+        scoring_workers=args.scoring_workers,
+        prefetch=args.prefetch,
+    )
     
         
-    with open(f'{model_name}_docexplainer_result.json', 'w') as f:
-        json.dump(results, f, indent=2)
\ No newline at end of file
+    with open(result_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    if get_prediction_cache() is not None:
+        print(f"Prediction cache: {get_prediction_cache().stats()}")
+    save_instrumentation(args, collector)
@@ -0,0 +1,124 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import argparse
+import os
+import sys
+
+from tqdm import tqdm
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from doc_explainer.models.claude_batches import BATCH_MAX_REQUESTS, POLL_INTERVAL, MessageBatchJob
+from doc_explainer.models.utils import VLMModel
+from dataset.pipeline import QUEUE_SIZE, Pipeline, Stage
+from dataset.runs import EvaluationRun
+from dataset.strategies import DocumentItem, EvaluationStrategy, QuestionItem, document_loader, prompt_builder
+
+
+def question_key(doc: DocumentItem, question: QuestionItem) -> Tuple[str, str, str]:
+    """Key of a question in the batch journal."""
+    return (doc.source, doc.doc_id, question.q_key)
+
+
+class BulkStrategy(EvaluationStrategy):
+    """
+    Strategy answering from the results of a `MessageBatchJob`.
+
+    Prompts, OCR and scoring are those of the wrapped strategy. Questions without
+    a result (failed in their batch, or added to the run afterwards) are sent
+    through the wrapped strategy as usual.
+    """
+
+    def __init__(self, strategy: EvaluationStrategy, job: MessageBatchJob):
+        self.strategy = strategy
+        self.job = job
+        self.name = strategy.name
+
+    def load(self, doc: DocumentItem, document: Dict[str, Any]) -> None:
+        self.strategy.load(doc, document)
+
+    def build_prompt(self, doc: DocumentItem, question: QuestionItem) -> str:
+        return self.strategy.build_prompt(doc, question)
+
+    def predict(self, doc: DocumentItem, question: QuestionItem) -> Any:
+        return self.predict_batch(doc, [question])[0]
+
+    def predict_batch(self, doc: DocumentItem, questions: List[QuestionItem]) -> List[Any]:
+        keys = [question_key(doc, q) for q in questions]
+        missing = [q for q, key in zip(questions, keys) if not self.job.has_prediction(key)]
+        live = iter(self.strategy.predict_batch(doc, missing) if missing else [])
+        return [
+            self.job.prediction(key, q.image, doc.source) if self.job.has_prediction(key) else next(live)
+            for q, key in zip(questions, keys)
+        ]
+
+    def observe(self, doc: DocumentItem, question: QuestionItem) -> None:
+        self.strategy.observe(doc, question)
+
+    def score(self, doc: DocumentItem, question: QuestionItem) -> Optional[Dict[str, float]]:
+        return self.strategy.score(doc, question)
+
+
+def submit_questions(
+    dataset: Any,
+    strategy: EvaluationStrategy,
+    run: EvaluationRun,
+    job: MessageBatchJob,
+    loader_workers: int = 2,
+    prefetch: int = QUEUE_SIZE,
+) -> int:
+    """
+    Queue the prompts of the unfinished questions of a run into batches.
+
+    Documents are loaded and prompted by the same stages as `evaluate`. Questions
+    already in the journal with the same request parameters are skipped, so that
+    an interrupted submission can be resumed (see `MessageBatchJob.add`).
+
+    Returns:
+        int: Number of requests added.
+    """
+    pipeline = Pipeline(
+        [
+            Stage("load", document_loader(dataset, strategy, run), workers=loader_workers),
+            Stage("prompt", prompt_builder(strategy)),
+        ],
+        queue_size=prefetch,
+    )
+    added = 0
+    for doc in tqdm(pipeline.run(run.document_indices()), total=run.num_remaining, desc="Submitting batches"):
+        for question in doc.pending:
+            added += job.add(question_key(doc, question), question.prompt, question.image, doc.source)
+    job.flush()
+    return added
+
+
+def add_bulk_arguments(parser: argparse.ArgumentParser) -> None:
+    """Message Batches arguments of the evaluation scripts (Claude only)."""
+    parser.add_argument('--bulk', type=str, default=None, help="Send the questions through the Message Batches API, with this journal file")
+    parser.add_argument('--bulk-max-requests', type=int, default=BATCH_MAX_REQUESTS, help="Requests per batch")
+    parser.add_argument('--bulk-poll-interval', type=float, default=POLL_INTERVAL, help="Seconds between two checks of the running batches")
+
+
+def run_bulk(args, dataset: Any, strategy: EvaluationStrategy, run: EvaluationRun) -> EvaluationStrategy:
+    """
+    With `--bulk`, submit the questions of the run, wait for the batches and
+    return the strategy answering from their results; otherwise return `strategy`.
+
+    Rerunning the same command after an interruption resumes where it stopped:
+    questions already submitted are not sent again and running batches are polled.
+    """
+    if not args.bulk:
+        return strategy
+    if args.vlm_model != VLMModel.CLAUDE:
+        raise ValueError("--bulk is only available with claude-sonnet-4")
+    if strategy.sequential:
+        raise ValueError(f"The {strategy.name} strategy cannot run in bulk")
+
+    job = MessageBatchJob(args.bulk, max_requests=args.bulk_max_requests, poll_interval=args.bulk_poll_interval)
+    added = submit_questions(dataset, strategy, run, job, loader_workers=args.loader_workers, prefetch=args.prefetch)
+    print(f"Submitted {added} new requests, {len(job.unfinished_batches)} batches running")
+    job.wait()
+    if job.failures:
+        print(f"{len(job.failures)} requests failed in their batch and will be sent again")
+    return BulkStrategy(strategy, job)
@@ -1,14 +1,238 @@
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 import json 
+import os
+import re
+import sys
+
+import numpy as np
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from doc_explainer.boxes import BoxArray, WordTable
+
+# Keys of the MP-DocVQA layout, {"LINE": [...], "WORD": [...]}
+BLOCK_KEYS = ("LINE", "WORD")
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def slim_block(block: Any) -> Optional[Dict[str, Any]]:
+    """Keep only the fields of a Textract block used by OCRProcessor, or None if it has no text or box."""
+    if not isinstance(block, dict) or 'Text' not in block:
+        return None
+    geometry = block.get('Geometry')
+    if not isinstance(geometry, dict) or 'BoundingBox' not in geometry:
+        return None
+    
+    slim = {'Text': block['Text'], 'Geometry': {'BoundingBox': geometry['BoundingBox']}}
+    for key in ('BlockType', 'Page'):
+        if key in block:
+            slim[key] = block[key]
+    return slim
+
+
+class TextractStream:
+    """
+    Incremental parser for a raw Textract JSON string.
+    
+    Walks the JSON text and decodes one block at a time, so that only the slim
+    blocks are kept instead of the whole tree (polygons, relationships, ids...).
+    Follows the same layout rules as `OCRProcessor.extract_blocks_from_ocr`:
+      - [{"Blocks": [...]}, ...]: blocks of the first element
+      - [block, ...]: the list itself
+      - {"Blocks": [...]}: its blocks
+      - {"LINE": [...], "WORD": [...]}: MP-DocVQA layout
+    """
+    
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+    
+    def _skip(self) -> str:
+        self.pos = _WHITESPACE.match(self.text, self.pos).end()
+        if self.pos >= len(self.text):
+            raise json.JSONDecodeError("Unexpected end of data", self.text, self.pos)
+        return self.text[self.pos]
+    
+    def _expect(self, char: str) -> None:
+        if self._skip() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.text, self.pos)
+        self.pos += 1
+    
+    def _value(self) -> Any:
+        self._skip()
+        value, self.pos = self.decoder.raw_decode(self.text, self.pos)
+        return value
+    
+    def _items(self) -> Iterator[None]:
+        """Position the cursor on each element of the array at the cursor in turn."""
+        self._expect('[')
+        if self._skip() == ']':
+            self.pos += 1
+            return
+        while True:
+            start = self.pos
+            yield
+            if self.pos == start: # the element was not consumed
+                self._value()
+            if self._skip() == ',':
+                self.pos += 1
+                continue
+            self._expect(']')
+            return
+    
+    def _keys(self) -> Iterator[str]:
+        """Yield the keys of the object at the cursor, with the cursor on the value."""
+        self._expect('{')
+        if self._skip() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            start = self.pos
+            yield key
+            if self.pos == start:
+                self._value()
+            if self._skip() == ',':
+                self.pos += 1
+                continue
+            self._expect('}')
+            return
+    
+    def _blocks(self, keep_empty: bool = False) -> Iterator[Dict[str, Any]]:
+        for _ in self._items():
+            block = slim_block(self._value())
+            if block is not None:
+                yield block
+            elif keep_empty:
+                yield {}
+    
+    def _array_at_cursor(self) -> bool:
+        return self._skip() == '['
+    
+    def _end(self) -> None:
+        self.pos = _WHITESPACE.match(self.text, self.pos).end()
+        if self.pos < len(self.text):
+            raise json.JSONDecodeError("Extra data", self.text, self.pos)
+    
+    def iter_blocks(self) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+        """
+        Yield (key, block) pairs, where key is "LINE"/"WORD" for the MP-DocVQA
+        layout and None otherwise. Blocks without text or box are skipped.
+        
+        The rest of the document is still read after the blocks, so that a
+        truncated or malformed document raises like `json.loads` would.
+        """
+        self.pos = 0
+        char = self._skip()
+        found = False
+        
+        if char == '[':
+            for index, _ in enumerate(self._items()):
+                if index > 0:
+                    continue
+                if self._skip() != '{':
+                    break
+                for key in self._keys():
+                    if key == 'Blocks' and not found and self._array_at_cursor():
+                        for block in self._blocks():
+                            yield None, block
+                        found = True
+                if not found:
+                    break
+            
+            if not found:
+                # No "Blocks" in the first element: the list holds the blocks
+                self.pos = 0
+                for block in self._blocks():
+                    yield None, block
+            self._end()
+        
+        elif char == '{':
+            for key in self._keys():
+                if found:
+                    continue
+                if key == 'Blocks' and self._array_at_cursor():
+                    for block in self._blocks():
+                        yield None, block
+                    found = True
+                elif key in BLOCK_KEYS and self._array_at_cursor():
+                    # Unusable blocks are kept as {} so that a LINE list is still
+                    # non-empty for `extract_lines_from_blocks`
+                    for block in self._blocks(keep_empty=True):
+                        yield key, block
+            self._end()
+
 
 class OCRProcessor:
+    # Optional pre-parsed OCRStore, see `set_store`
+    store = None
+    # Parse `doc_ocr` with `TextractStream` instead of `json.loads`, see `set_streaming`
+    streaming = False
+
+    @classmethod
+    def set_store(cls, store) -> None:
+        """Read words from a pre-parsed `OCRStore` instead of the raw Textract JSON."""
+        cls.store = store
+
+    @classmethod
+    def set_streaming(cls, streaming: bool = True) -> None:
+        """Parse the raw Textract JSON incrementally, keeping only the fields used here."""
+        cls.streaming = streaming
+
+    @classmethod
+    def get_words(cls, sample: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Return the words and 0-1000 boxes of a document, from the store when the
+        document is in it, otherwise by parsing its `doc_ocr` Textract output.
+        """
+        if cls.store is not None:
+            words = cls.store.get_words(sample.get('source'), sample.get('doc_id'))
+            if words is not None:
+                return words
+        
+        blocks = cls.extract_blocks_from_ocr(sample)
+        return cls.extract_words_and_bboxes(blocks)
+
+    @classmethod
+    def get_word_table(cls, sample: Dict[str, Any]) -> WordTable:
+        """
+        Same as `get_words`, as a column-oriented `WordTable` with xywh 0-1000 boxes.
+        """
+        if cls.store is not None:
+            table = cls.store.get_word_table(sample.get('source'), sample.get('doc_id'))
+            if table is not None:
+                return table
+        
+        blocks = cls.extract_blocks_from_ocr(sample)
+        return cls.extract_word_table(blocks)
+
     @staticmethod
     def scale_to_1000(value: float) -> int:
         scaled = int(value * 1000)
         return max(0, min(1000, scaled))
     
     @classmethod
-    def extract_blocks_from_ocr(cls, sample: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def extract_blocks_from_ocr(
+        cls,
+        sample: Dict[str, Any],
+        streaming: Optional[bool] = None
+    ) -> Union[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+        """
+        Return the Textract blocks of a sample, in its original layout.
+        
+        With `streaming` (defaults to `OCRProcessor.streaming`), blocks are parsed
+        one by one and only keep their text, box, type and page, which is enough
+        for every extractor of this class and bounds the memory on long documents.
+        """
+        if streaming is None:
+            streaming = cls.streaming
+        if streaming:
+            return cls.stream_blocks_from_ocr(sample)
+        
         try:
             ocr_raw = sample.get('doc_ocr', ['{}'])[0]
             ocr_json = json.loads(ocr_raw)
@@ -20,6 +244,29 @@ class OCRProcessor:
             print(f"Error extracting OCR blocks: {e}")
             return []
     
+    @classmethod
+    def iter_blocks_from_ocr(cls, sample: Dict[str, Any]) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+        """Lazily yield the (key, slim block) pairs of a sample, see `TextractStream.iter_blocks`."""
+        ocr_raw = sample.get('doc_ocr', ['{}'])[0]
+        return TextractStream(ocr_raw).iter_blocks()
+    
+    @classmethod
+    def stream_blocks_from_ocr(cls, sample: Dict[str, Any]) -> Union[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+        """Slim blocks of a sample in its original layout, parsed with `TextractStream`."""
+        blocks = []
+        keyed = {}
+        try:
+            for key, block in cls.iter_blocks_from_ocr(sample):
+                if key is None:
+                    blocks.append(block)
+                else:
+                    keyed.setdefault(key, []).append(block)
+        except (json.JSONDecodeError, IndexError) as e:
+            print(f"Error extracting OCR blocks: {e}")
+            return []
+        
+        return keyed if keyed else blocks
+    
     @classmethod
     def process_block(cls, block: Dict[str, Any]) -> Optional[str]:
         if not all(key in block for key in ['Geometry', 'Text']) or 'BoundingBox' not in block.get('Geometry', {}):
@@ -77,14 +324,12 @@ class OCRProcessor:
 
         return "\n".join(lines)
 
-    @classmethod 
-    def extract_words_and_bboxes(
+    @classmethod
+    def iter_word_blocks(
         cls,
         blocks: Union[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]
-    ) -> List[Dict[str, Any]]:
-        res = []
-        
-        
+    ):
+        """Yield the blocks that carry a text and a bounding box."""
         if isinstance(blocks, dict): # MP-DocVQA has different structure
             all_blocks = []
             for key in ("LINE", "WORD"):
@@ -93,7 +338,7 @@ class OCRProcessor:
         elif isinstance(blocks, list):
             all_blocks = blocks
         else:
-            return res
+            return
         
         for block in all_blocks: 
             if not isinstance(block, dict):
@@ -104,7 +349,17 @@ class OCRProcessor:
             
             if 'BoundingBox' not in block.get('Geometry', {}):
                 continue     
-                
+            
+            yield block
+
+    @classmethod 
+    def extract_words_and_bboxes(
+        cls,
+        blocks: Union[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]
+    ) -> List[Dict[str, Any]]:
+        res = []
+        
+        for block in cls.iter_word_blocks(blocks):
             text = block['Text']
             box = block['Geometry']['BoundingBox']
             page = block.get('Page', 1)
@@ -120,4 +375,26 @@ class OCRProcessor:
                 "bbox": [left, top, width, height]
             })
                 
-        return res
\ No newline at end of file
+        return res
+
+    @classmethod
+    def extract_word_table(
+        cls,
+        blocks: Union[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]
+    ) -> WordTable:
+        """
+        Same words as `extract_words_and_bboxes`, scaled in one vectorized pass
+        into a `WordTable` instead of one dict and list per word.
+        """
+        pages, texts, coords = [], [], []
+        for block in cls.iter_word_blocks(blocks):
+            box = block['Geometry']['BoundingBox']
+            pages.append(block.get('Page', 1))
+            texts.append(block['Text'])
+            coords.append((box['Left'], box['Top'], box['Width'], box['Height']))
+        
+        coords = np.array(coords, dtype=np.float64).reshape(-1, 4)
+        # Same truncation and clamping as `scale_to_1000`
+        scaled = np.clip((coords * 1000).astype(np.int64), 0, 1000).astype(np.int16)
+        
+        return WordTable(pages, texts, BoxArray(scaled, format="xywh", scale=1000))
@@ -0,0 +1,182 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dataset.ocr_processor import OCRProcessor
+from doc_explainer.boxes import BoxArray, WordTable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    source TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    num_words INTEGER NOT NULL,
+    pages BLOB NOT NULL,
+    boxes BLOB NOT NULL,
+    texts TEXT NOT NULL,
+    lines TEXT NOT NULL,
+    PRIMARY KEY (source, doc_id)
+) WITHOUT ROWID
+"""
+
+
+class OCRStore:
+    """
+    Pre-parsed Textract output of BoundingDocs, keyed by (source, doc_id).
+
+    Each document is stored once as compact columns: page numbers (int32), 0-1000
+    [left, top, width, height] boxes (int16), the word texts and the
+    `extract_lines_from_blocks` string, so that reading a document is a primary key
+    lookup and two `np.frombuffer` calls instead of a `json.loads` of the raw
+    Textract payload.
+
+    Build it once with:
+        python src/dataset/ocr_store.py --output data/ocr_store.sqlite
+    """
+
+    def __init__(self, path: str, readonly: bool = True):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "OCRStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM documents WHERE source = ? AND doc_id = ?", key
+        ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    @staticmethod
+    def encode(words: List[Dict[str, Any]], lines: str) -> Tuple[int, bytes, bytes, str, str]:
+        pages = np.array([w['page'] for w in words], dtype=np.int32)
+        boxes = np.array([w['bbox'] for w in words], dtype=np.int16).reshape(-1, 4)
+        texts = json.dumps([w['text'] for w in words], ensure_ascii=False)
+        return len(words), pages.tobytes(), boxes.tobytes(), texts, lines
+
+    def put(self, source: str, doc_id: str, words: List[Dict[str, Any]], lines: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (source, doc_id, *self.encode(words, lines)),
+        )
+
+    def put_document(self, document: Dict[str, Any]) -> None:
+        """Parse the Textract output of a BoundingDocs document and store it."""
+        # Only the text and boxes are stored, so the slim streamed blocks are enough
+        blocks = OCRProcessor.extract_blocks_from_ocr(document, streaming=True)
+        words = OCRProcessor.extract_words_and_bboxes(blocks)
+        lines = OCRProcessor.extract_lines_from_blocks(blocks)
+        self.put(document['source'], document['doc_id'], words, lines)
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def _row(self, source: str, doc_id: str, columns: str) -> Optional[tuple]:
+        return self.conn.execute(
+            f"SELECT {columns} FROM documents WHERE source = ? AND doc_id = ?",
+            (source, doc_id),
+        ).fetchone()
+
+    def get_arrays(self, source: str, doc_id: str) -> Optional[Tuple[np.ndarray, np.ndarray, List[str]]]:
+        """
+        Return the (pages, boxes, texts) columns of a document, or None if it is not stored.
+
+        The arrays are read-only views over the stored bytes.
+        """
+        row = self._row(source, doc_id, "num_words, pages, boxes, texts")
+        if row is None:
+            return None
+        num_words, pages, boxes, texts = row
+        pages = np.frombuffer(pages, dtype=np.int32, count=num_words)
+        boxes = np.frombuffer(boxes, dtype=np.int16, count=num_words * 4).reshape(num_words, 4)
+        return pages, boxes, json.loads(texts)
+
+    def get_word_table(self, source: str, doc_id: str) -> Optional[WordTable]:
+        """
+        Return the words of a document as a `WordTable` viewing the stored bytes,
+        or None if it is not stored.
+        """
+        arrays = self.get_arrays(source, doc_id)
+        if arrays is None:
+            return None
+        pages, boxes, texts = arrays
+        return WordTable(pages, texts, BoxArray(boxes, format="xywh", scale=1000))
+
+    def get_words(self, source: str, doc_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Return the words of a document in the `extract_words_and_bboxes` format,
+        or None if it is not stored.
+        """
+        arrays = self.get_arrays(source, doc_id)
+        if arrays is None:
+            return None
+        pages, boxes, texts = arrays
+        return [
+            {"page": page, "text": text, "bbox": bbox}
+            for page, text, bbox in zip(pages.tolist(), texts, boxes.tolist())
+        ]
+
+    def get_lines(self, source: str, doc_id: str) -> Optional[str]:
+        """Return the `extract_lines_from_blocks` string of a document, or None."""
+        row = self._row(source, doc_id, "lines")
+        return row[0] if row is not None else None
+
+
+def build_store(documents: Iterable[Dict[str, Any]], path: str, commit_every: int = 500) -> int:
+    """
+    Write the parsed OCR of every document to the store at `path`.
+
+    Returns:
+        Number of documents written.
+    """
+    count = 0
+    with OCRStore(path, readonly=False) as store:
+        for document in documents:
+            store.put_document(document)
+            count += 1
+            if count % commit_every == 0:
+                store.commit()
+        store.commit()
+    return count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, default="data/ocr_store.sqlite", help="Path of the SQLite store")
+    parser.add_argument('--split', type=str, default="test", help="Dataset split")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from datasets import load_dataset
+    from tqdm import tqdm
+
+    args = parse_args()
+    dataset = load_dataset("letxbe/BoundingDocs", revision="v2.0", split=args.split)
+    # Only the OCR is needed, skip decoding the page images
+    dataset = dataset.select_columns(['source', 'doc_id', 'doc_ocr'])
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    count = build_store(tqdm(dataset, desc="Parsing OCR"), args.output)
+    print(f"✅ Stored OCR of {count} documents in {args.output}")
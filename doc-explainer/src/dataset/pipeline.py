@@ -0,0 +1,274 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from doc_explainer import instrumentation
+from doc_explainer.instrumentation import MetricsCollector
+from doc_explainer.models.utils import VLMModel
+
+# Items waiting between two stages, bounds the memory held by prefetched documents
+QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a `Pipeline`: a function applied to every item by `workers` threads.
+
+    With `processes=True`, each worker thread runs the function in a shared process
+    pool instead, for CPU-bound work; the function and the items must then be
+    picklable.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1, processes: bool = False):
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.processes = processes
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages connected by bounded queues.
+
+    Every stage has its own workers, so loading the next documents, running the
+    model on the current one and scoring the previous ones overlap. A stage whose
+    output queue is full blocks until the next stage catches up (backpressure),
+    so at most about `queue_size` items wait between two stages. Results are
+    yielded in input order, whatever the number of workers: no new item is fed
+    while `window` items are in flight or waiting for an earlier one, so a slow
+    item does not let the finished ones behind it pile up.
+
+    Example:
+        pipeline = Pipeline([
+            Stage("load", load_document, workers=2),
+            Stage("infer", predict),
+            Stage("score", score, workers=2),
+        ])
+        for result in pipeline.run(documents):
+            write(result)
+
+    Attributes:
+        stages (List[Stage]): The stages, in order.
+        queue_size (int): Capacity of the queue in front of each stage.
+        window (int): Items fed but not yielded yet, by default what the queues
+            and the workers hold.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = QUEUE_SIZE, window: Optional[int] = None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.window = window or queue_size * (len(stages) + 1) + sum(stage.workers for stage in stages)
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        output: queue.Queue = queue.Queue(self.queue_size)
+        # Slots of the items fed but not yielded yet, released in input order
+        window = threading.Semaphore(self.window)
+        stop = threading.Event()
+        errors: List[BaseException] = []
+
+        def put(q: queue.Queue, item: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q: queue.Queue) -> Any:
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def acquire() -> bool:
+            while not stop.is_set():
+                if window.acquire(timeout=0.1):
+                    return True
+            return False
+
+        def fail(error: BaseException) -> None:
+            errors.append(error)
+            stop.set()
+
+        def feed() -> None:
+            try:
+                for position, item in enumerate(items):
+                    if not acquire() or not put(queues[0], (position, item)):
+                        return
+            except BaseException as error:
+                fail(error)
+                return
+            for _ in range(self.stages[0].workers):
+                put(queues[0], _DONE)
+
+        pools: Dict[int, ProcessPoolExecutor] = {
+            index: ProcessPoolExecutor(stage.workers)
+            for index, stage in enumerate(self.stages)
+            if stage.processes
+        }
+        remaining = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+
+        def work(index: int) -> None:
+            stage = self.stages[index]
+            inbox = queues[index]
+            is_last = index == len(self.stages) - 1
+            outbox = output if is_last else queues[index + 1]
+            try:
+                while True:
+                    entry = get(inbox)
+                    if entry is _DONE:
+                        break
+                    position, item = entry
+                    with instrumentation.stage(f"pipeline.{stage.name}"):
+                        if index in pools:
+                            result = pools[index].submit(stage.fn, item).result()
+                        else:
+                            result = stage.fn(item)
+                    if not put(outbox, (position, result)):
+                        return
+            except BaseException as error:
+                fail(error)
+                return
+
+            # The last worker of a stage closes the next one
+            with lock:
+                remaining[index] -= 1
+                last_worker = remaining[index] == 0
+            if last_worker:
+                if is_last:
+                    put(output, _DONE)
+                else:
+                    for _ in range(self.stages[index + 1].workers):
+                        put(outbox, _DONE)
+
+        threads = [threading.Thread(target=feed, daemon=True, name="pipeline-feed")]
+        for index, stage in enumerate(self.stages):
+            threads.extend(
+                threading.Thread(target=work, args=(index,), daemon=True, name=f"pipeline-{stage.name}-{worker}")
+                for worker in range(stage.workers)
+            )
+        for thread in threads:
+            thread.start()
+
+        # Reorder the results, so that they come out in input order
+        pending: Dict[int, Any] = {}
+        next_position = 0
+        try:
+            while True:
+                entry = get(output)
+                if entry is _DONE:
+                    break
+                position, result = entry
+                pending[position] = result
+                while next_position in pending:
+                    result = pending.pop(next_position)
+                    next_position += 1
+                    window.release()
+                    yield result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for pool in pools.values():
+                pool.shutdown(cancel_futures=True)
+
+        if errors:
+            raise errors[0]
+
+
+def add_pipeline_arguments(parser: argparse.ArgumentParser) -> None:
+    """Pipeline arguments shared by the evaluation scripts."""
+    parser.add_argument('--loader-workers', type=int, default=2, help="Threads loading and decoding documents")
+    parser.add_argument('--inference-workers', type=int, default=1, help="Threads running the model (raise for API backends)")
+    parser.add_argument('--scoring-workers', type=int, default=1, help="Threads computing metrics and debug images")
+    parser.add_argument('--prefetch', type=int, default=QUEUE_SIZE, help="Documents queued between two stages")
+    parser.add_argument('--batch-size', type=int, default=8, help="Questions of a document sent per VLM call (SmolVLM, Qwen)")
+    parser.add_argument('--metrics-out', type=str, default=None, help="Write stage timings, token counts and peak memory to this JSON file")
+    parser.add_argument('--prometheus-out', type=str, default=None, help="Write the same metrics in the Prometheus text format")
+    parser.add_argument('--track-memory', action='store_true', help="Also record the peak memory of every stage (slower)")
+
+
+def add_device_arguments(parser: argparse.ArgumentParser) -> None:
+    """Device arguments of the local models (SmolVLM, Qwen), shared by the evaluation scripts."""
+    parser.add_argument('--device', type=str, default="auto", help="Device of the local models: auto, cpu, cuda, cuda:1...")
+    parser.add_argument('--quantization', type=str, choices=['bf16', 'int8'], default=None, help="Precision of the local models (int8 is CPU only)")
+    parser.add_argument('--num-threads', type=int, default=None, help="Threads used by torch on CPU")
+
+
+def add_backend_arguments(parser: argparse.ArgumentParser) -> None:
+    """Arguments of the shared backend state set up by `start_api_backend`: Claude API limits and requests, page caches, resolution policy."""
+    parser.add_argument('--api-concurrency', type=int, default=8, help="Claude requests in flight")
+    parser.add_argument('--api-rate', type=float, default=4.0, help="Claude requests per second, lowered automatically on rate limits")
+    parser.add_argument('--request-mode', type=str, choices=['single', 'cached', 'multi'], default='single', help="Claude requests per page: one per question, one per question on a cached image prefix, or one for all the questions")
+    parser.add_argument('--image-format', type=str, choices=['auto', 'jpeg', 'png', 'webp'], default='auto', help="Format of the pages sent to Claude (auto: PNG for flat pages, JPEG for scans)")
+    parser.add_argument('--image-cache-mb', type=int, default=256, help="Memory bound of the encoded pages reused across the questions of a page")
+    parser.add_argument('--adaptive-resolution', action='store_true', help="Downscale the pages to the image token budget of each backend (see ResolutionPolicy)")
+    parser.add_argument('--resolution-config', type=str, default=None, help="JSON file of the budgets per backend and per source, implies --adaptive-resolution")
+    parser.add_argument('--prefix-cache-gb', type=float, default=None, help="Reuse the prefilled page across the questions of a page in the local models, within this memory bound (off by default)")
+
+
+def start_api_backend(args) -> None:
+    """
+    Shared state of the backends from `add_backend_arguments`: resolution policy, Claude client with
+    its limits when evaluating Claude, page prefix cache of the local models otherwise.
+    """
+    if args.adaptive_resolution or args.resolution_config:
+        from doc_explainer.models.resolution import ResolutionPolicy, set_resolution_policy
+        config = {}
+        if args.resolution_config:
+            with open(args.resolution_config) as f:
+                config = json.load(f)
+        set_resolution_policy(ResolutionPolicy.from_config(config))
+    if args.vlm_model != VLMModel.CLAUDE:
+        if args.prefix_cache_gb:
+            from doc_explainer.models.prefix_cache import PrefixCache, set_prefix_cache
+            set_prefix_cache(PrefixCache(max_bytes=int(args.prefix_cache_gb * 2**30)))
+    else:
+        from doc_explainer.models.claude import ClaudeBackend, set_claude_backend
+        from doc_explainer.models.image_cache import EncodedImageCache, set_image_cache
+        set_image_cache(EncodedImageCache(max_bytes=args.image_cache_mb * 2**20, image_format=args.image_format))
+        set_claude_backend(ClaudeBackend(max_concurrency=args.api_concurrency, requests_per_second=args.api_rate, request_mode=args.request_mode))
+
+
+def start_instrumentation(args) -> Optional[MetricsCollector]:
+    """Register a `MetricsCollector` if the run asked for metrics, see `add_pipeline_arguments`."""
+    if not (args.metrics_out or args.prometheus_out):
+        return None
+    collector = MetricsCollector(track_memory=args.track_memory)
+    instrumentation.add_hook(collector)
+    return collector
+
+
+def save_instrumentation(args, collector: Optional[MetricsCollector]) -> None:
+    if collector is None:
+        return
+    instrumentation.remove_hook(collector)
+    if args.metrics_out:
+        with open(args.metrics_out, 'w') as f:
+            f.write(collector.to_json())
+        print(f"Metrics saved to {args.metrics_out}")
+    if args.prometheus_out:
+        with open(args.prometheus_out, 'w') as f:
+            f.write(collector.to_prometheus())
+        print(f"Prometheus metrics saved to {args.prometheus_out}")
+    collector.close()
@@ -12,6 +12,17 @@ Provide ONLY a JSON response in the following format:
 
 Each position value MUST be in the range [0, 1000]."""
 
+# Answer only, the box is found in the OCR (02_ocr_naive.py)
+CONTENT_ONLY_PROMPT = """Based only on the document image, answer the following question:
+
+Question: {QUESTION}
+
+Provide ONLY a JSON response in the following format:
+{{
+  "content": "answer",
+}}
+"""
+
 COT_ONE_SHOT_PROMPT = """
 Based only on this document image, answer the question step-by-step.
 
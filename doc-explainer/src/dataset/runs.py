@@ -0,0 +1,303 @@
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import argparse
+import json
+import os
+import sys
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dataset.utils import METRIC_KEYS, MetricsAccumulator, compute_mean_metrics
+
+# Number of finished questions buffered before they are written to the checkpoint
+CHECKPOINT_EVERY = 20
+
+
+def shard_suffix(shard_id: int, num_shards: int) -> str:
+    """Suffix added to the output files of a shard, empty for unsharded runs."""
+    if num_shards == 1:
+        return ""
+    return f".shard{shard_id}of{num_shards}"
+
+
+def shard_indices(num_documents: int, shard_id: int, num_shards: int) -> range:
+    """Documents of a shard: every `num_shards`-th document starting at `shard_id`."""
+    if not 0 <= shard_id < num_shards:
+        raise ValueError(f"Invalid shard {shard_id} of {num_shards}")
+    return range(shard_id, num_documents, num_shards)
+
+
+def read_checkpoint(path: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]], int]:
+    """
+    Read a checkpoint file.
+
+    Returns:
+        (header, records, size of the valid prefix in bytes). A last line cut by a
+        crash is not part of the valid prefix.
+    """
+    header, records, valid = None, [], 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if not line.endswith(b'\n'):
+                break
+            valid += len(line)
+            if 'run' in record:
+                header = record['run']
+            else:
+                records.append(record)
+    return header, records, valid
+
+
+class EvaluationRun:
+    """
+    Checkpointed, optionally sharded evaluation run.
+
+    Wraps the `MetricsAccumulator` of the eval scripts and also appends every
+    finished question (and a marker per finished document) to a JSONL checkpoint.
+    Restarting with the same checkpoint skips what was already done, and the
+    checkpoints of all shards can be merged with `merge_checkpoints`. With a
+    `subset` (see `subsets.py`), only its documents and questions are visited,
+    and they are split into shards the same way.
+
+    Example:
+        run = EvaluationRun(args.checkpoint, len(dataset), args.shard_id, args.num_shards)
+        for doc_index, document in run.documents(dataset):
+            for q_key, data in qa_data.items():
+                if run.is_done(doc_index, q_key):
+                    continue
+                run.add_question(source, doc_index, doc_id, q_key)
+                run.add(source, {'iou': iou, ...})
+            run.end_document(doc_index)
+        results = run.report()
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        num_documents: int,
+        shard_id: int = 0,
+        num_shards: int = 1,
+        resume: bool = True,
+        checkpoint_every: int = CHECKPOINT_EVERY,
+        metric_keys: Optional[List[str]] = None,
+        subset: Optional[Any] = None,
+    ):
+        self.path = path
+        self.num_documents = num_documents
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.subset = subset
+        self.shard_documents: Sequence[int] = shard_indices(num_documents, shard_id, num_shards)
+        if subset is not None:
+            self.shard_documents = subset.doc_indices[shard_id::num_shards]
+        self.checkpoint_every = checkpoint_every
+        self.accumulator = MetricsAccumulator(metric_keys)
+
+        self.done: Dict[Tuple[int, str], Optional[Dict[str, float]]] = {}
+        self.complete: Set[int] = set()
+        self._pending: List[Dict[str, Any]] = []
+        self._current: Optional[Dict[str, Any]] = None
+        self._file = None
+
+        if path is None:
+            return
+
+        header = {'num_documents': num_documents, 'shard_id': shard_id, 'num_shards': num_shards}
+        if subset is not None:
+            header['subset'] = {'fingerprint': subset.fingerprint, 'num_documents': len(subset.doc_indices)}
+        if resume and os.path.exists(path):
+            previous, records, valid = read_checkpoint(path)
+            if previous is not None and previous != header:
+                raise ValueError(f"Checkpoint {path} belongs to another run: {previous}")
+            for record in records:
+                self._restore(record)
+            self._file = open(path, 'r+b')
+            # Drop a last line cut by a crash
+            self._file.truncate(valid)
+            self._file.seek(valid)
+            if previous is None:
+                self._write([{'run': header}])
+        else:
+            self._file = open(path, 'wb')
+            self._write([{'run': header}])
+
+    def _restore(self, record: Dict[str, Any]) -> None:
+        if record.get('complete'):
+            self.complete.add(record['doc_index'])
+            return
+        self.done[(record['doc_index'], record['q_key'])] = record['metrics']
+        self.accumulator.add_question(record['source'])
+        if record['metrics'] is not None:
+            self.accumulator.add(record['source'], record['metrics'])
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        self._file.write(data.encode('utf-8'))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def document_indices(self) -> Iterator[int]:
+        """Yield the indexes of the unfinished documents of this shard, in dataset order."""
+        for doc_index in self.shard_documents:
+            if doc_index not in self.complete:
+                yield doc_index
+
+    def documents(self, dataset: Any) -> Iterator[Tuple[int, Any]]:
+        """Yield (doc_index, document) for the unfinished documents of this shard, in dataset order."""
+        for doc_index in self.document_indices():
+            yield doc_index, dataset[doc_index]
+
+    @property
+    def num_remaining(self) -> int:
+        return len(self.shard_documents) - len(self.complete)
+
+    def is_done(self, doc_index: int, q_key: str) -> bool:
+        return (doc_index, q_key) in self.done
+
+    def is_selected(self, doc_index: int, q_key: str) -> bool:
+        """Whether a question is part of the run (always, without subset)."""
+        return self.subset is None or (doc_index, q_key) in self.subset
+
+    def metrics(self, doc_index: int, q_key: str) -> Optional[Dict[str, float]]:
+        """Metrics recorded for a finished question, None if it was skipped."""
+        return self.done.get((doc_index, q_key))
+
+    def _finish_question(self) -> None:
+        if self._current is None:
+            return
+        record, self._current = self._current, None
+        self.done[(record['doc_index'], record['q_key'])] = record['metrics']
+        if self._file is not None:
+            self._pending.append(record)
+            if len(self._pending) >= self.checkpoint_every:
+                self.flush()
+
+    def add_question(self, source: str, doc_index: int, doc_id: str, q_key: str) -> None:
+        """Start a question, see `MetricsAccumulator.add_question`."""
+        self._finish_question()
+        self.accumulator.add_question(source)
+        self._current = {
+            'doc_index': doc_index,
+            'source': source,
+            'doc_id': doc_id,
+            'q_key': q_key,
+            'metrics': None,
+        }
+
+    def add(self, source: str, metrics: Dict[str, float]) -> None:
+        """Record the metrics of the current question, see `MetricsAccumulator.add`."""
+        self.accumulator.add(source, metrics)
+        if self._current is not None:
+            self._current['metrics'] = dict(metrics)
+
+    def end_document(self, doc_index: int) -> None:
+        self._finish_question()
+        self.complete.add(doc_index)
+        if self._file is not None:
+            self._pending.append({'doc_index': doc_index, 'complete': True})
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file is not None and self._pending:
+            self._write(self._pending)
+            self._pending = []
+
+    def close(self) -> None:
+        self._finish_question()
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def report(self) -> Dict:
+        self.close()
+        return self.accumulator.report()
+
+
+def merge_checkpoints(paths: Iterable[str], metric_keys: Optional[List[str]] = None) -> Dict:
+    """
+    Combine the checkpoints of the shards of a run into its `compute_mean_metrics` report.
+
+    Questions are ordered as in the dataset before computing the means, so the report
+    does not depend on how the run was split.
+
+    Raises:
+        ValueError: If the checkpoints do not come from the same run, a shard is missing
+            or incomplete, or a question was recorded twice.
+    """
+    metric_keys = list(metric_keys or METRIC_KEYS)
+    headers, records = [], []
+    for path in paths:
+        header, shard_records, _ = read_checkpoint(path)
+        if header is None:
+            raise ValueError(f"{path} is not a run checkpoint")
+        headers.append(header)
+        records.extend(shard_records)
+
+    num_shards = {header['num_shards'] for header in headers}
+    num_documents = {header['num_documents'] for header in headers}
+    subsets = {json.dumps(header.get('subset'), sort_keys=True) for header in headers}
+    if len(num_shards) != 1 or len(num_documents) != 1 or len(subsets) != 1:
+        raise ValueError("Checkpoints come from different runs")
+    num_shards, num_documents = num_shards.pop(), num_documents.pop()
+    subset = headers[0].get('subset')
+    if subset is not None:
+        num_documents = subset['num_documents']
+    shard_ids = sorted(header['shard_id'] for header in headers)
+    if shard_ids != list(range(num_shards)):
+        raise ValueError(f"Expected shards 0..{num_shards - 1}, got {shard_ids}")
+
+    complete = {record['doc_index'] for record in records if record.get('complete')}
+    if len(complete) != num_documents:
+        raise ValueError(f"Only {len(complete)} of {num_documents} documents are finished")
+
+    questions = [record for record in records if not record.get('complete')]
+    keys = [(record['doc_index'], record['q_key']) for record in questions]
+    if len(set(keys)) != len(keys):
+        raise ValueError("A question was recorded more than once")
+
+    # `sorted` is stable, questions of a document keep their checkpoint order
+    questions.sort(key=lambda record: record['doc_index'])
+
+    metrics_per_source = defaultdict(lambda: {key: [] for key in metric_keys})
+    questions_per_source = defaultdict(int)
+    processed_per_source = defaultdict(int)
+    for record in questions:
+        source = record['source']
+        questions_per_source[source] += 1
+        if record['metrics'] is None:
+            continue
+        processed_per_source[source] += 1
+        for key, value in record['metrics'].items():
+            metrics_per_source[source].setdefault(key, []).append(value)
+
+    return compute_mean_metrics(metrics_per_source, questions_per_source, processed_per_source)
+
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    """Sharding and checkpointing arguments shared by the evaluation scripts."""
+    parser.add_argument('--shard-id', type=int, default=0, help="Shard of the documents to evaluate")
+    parser.add_argument('--num-shards', type=int, default=1, help="Number of shards the run is split into")
+    parser.add_argument('--checkpoint', type=str, default=None, help="Checkpoint file (defaults to the result file name)")
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start over")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge the checkpoints of a sharded run")
+    parser.add_argument('checkpoints', nargs='+', help="Checkpoint files of all the shards")
+    parser.add_argument('--output', type=str, required=True, help="Result JSON file to write")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = merge_checkpoints(args.checkpoints)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Merged {len(args.checkpoints)} checkpoints into {args.output}")
@@ -0,0 +1,411 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+import numpy as np
+from PIL import Image
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dataset.ocr_processor import OCRProcessor
+from dataset.ocr_store import OCRStore
+
+INDEX_FILE = "index.sqlite"
+OCR_STORE_FILE = "ocr_store.sqlite"
+PIXELS_FILE = "pixels-{:05d}.u8"
+
+# Start a new pixel file past this size, keeps files manageable to copy around
+SHARD_BYTES = 2 ** 32
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_index INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    num_pages INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    doc_index INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    channels INTEGER NOT NULL,
+    PRIMARY KEY (doc_index, page)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS questions (
+    question_id INTEGER PRIMARY KEY,
+    doc_index INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    q_key TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    question TEXT,
+    rephrased_question TEXT,
+    answer TEXT,
+    location TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_source ON questions (source, page);
+CREATE INDEX IF NOT EXISTS questions_document ON questions (doc_index);
+"""
+
+
+def load_qa_data(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Q&A of a document, from a shard document or the raw `Q&A` JSON string of the dataset."""
+    if 'qa_data' in document:
+        return document['qa_data']
+    return json.loads(document.get('Q&A'))
+
+
+def page_pixels(image: Image.Image, max_side: Optional[int] = None) -> np.ndarray:
+    """Decode a page into an (H, W) or (H, W, 3) uint8 array, optionally downscaled."""
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def question_rows(doc_index: int, source: str, doc_id: str, qa_data: Dict[str, Any]) -> Iterator[tuple]:
+    """Flatten the Q&A of a document into rows of the questions table (first answer only)."""
+    for q_key, data in qa_data.items():
+        answer = data['answers'][0]
+        yield (
+            doc_index,
+            source,
+            doc_id,
+            q_key,
+            answer['page'],
+            data.get('question'),
+            data.get('rephrased_question'),
+            json.dumps(answer.get('value'), ensure_ascii=False),
+            json.dumps(answer.get('location', [])),
+        )
+
+
+class PageImages:
+    """
+    Lazy, list-like access to the pages of a shard document.
+
+    Only the indexed pages are read from the memory-mapped pixel files, so
+    `images[page_idx]` never decodes the other pages of the document.
+    """
+
+    def __init__(self, shards: "BoundingDocsShards", doc_index: int, num_pages: int):
+        self.shards = shards
+        self.doc_index = doc_index
+        self.num_pages = num_pages
+
+    def __len__(self) -> int:
+        return self.num_pages
+
+    def __getitem__(self, index: int) -> Image.Image:
+        if index < 0:
+            index += self.num_pages
+        if not 0 <= index < self.num_pages:
+            raise IndexError(f"Page index {index} out of range")
+        return self.shards.page_image(self.doc_index, index + 1)
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        for index in range(self.num_pages):
+            yield self[index]
+
+
+class BoundingDocsShards:
+    """
+    Local, preprocessed copy of a BoundingDocs split.
+
+    A shard directory holds:
+      - `index.sqlite`: documents, a (doc_index, page) -> pixels index and the Q&A
+        flattened into a typed questions table indexed by source and page
+      - `pixels-XXXXX.u8`: raw uint8 page pixels, memory-mapped on first access
+      - `ocr_store.sqlite`: the parsed OCR of the split (see `OCRStore`), if built
+
+    Iterating yields document dicts that can replace the Hub dataset rows in the
+    evaluation scripts: `source`, `doc_id`, `doc_images` (lazy `PageImages`) and
+    the already parsed `qa_data` (see `load_qa_data`).
+
+    Build it once with:
+        python src/dataset/shards.py --output data/shards
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(
+            f"file:{os.path.join(path, INDEX_FILE)}?mode=ro", uri=True, check_same_thread=False
+        )
+        self._pixels: Dict[int, np.memmap] = {}
+        self._documents = self.conn.execute(
+            "SELECT doc_index, source, doc_id, num_pages FROM documents ORDER BY doc_index"
+        ).fetchall()
+
+    def close(self) -> None:
+        self.conn.close()
+        self._pixels.clear()
+
+    def __enter__(self) -> "BoundingDocsShards":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @property
+    def ocr_store_path(self) -> Optional[str]:
+        path = os.path.join(self.path, OCR_STORE_FILE)
+        return path if os.path.exists(path) else None
+
+    def _shard(self, shard: int) -> np.memmap:
+        if shard not in self._pixels:
+            self._pixels[shard] = np.memmap(
+                os.path.join(self.path, PIXELS_FILE.format(shard)), dtype=np.uint8, mode='r'
+            )
+        return self._pixels[shard]
+
+    def page_pixels(self, doc_index: int, page: int) -> np.ndarray:
+        """Read-only (H, W[, 3]) view of a page (1-based) in the memory-mapped pixels."""
+        row = self.conn.execute(
+            "SELECT shard, offset, height, width, channels FROM pages WHERE doc_index = ? AND page = ?",
+            (doc_index, page),
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"No page {page} for document {doc_index}")
+        shard, offset, height, width, channels = row
+        pixels = self._shard(shard)[offset:offset + height * width * channels]
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        return pixels.reshape(shape)
+
+    def page_image(self, doc_index: int, page: int) -> Image.Image:
+        return Image.fromarray(np.ascontiguousarray(self.page_pixels(doc_index, page)))
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def document(self, doc_index: int) -> Dict[str, Any]:
+        doc_index, source, doc_id, num_pages = self._documents[doc_index]
+        qa_data = {
+            row['q_key']: self._qa_entry(row)
+            for row in self.questions(doc_index=doc_index)
+        }
+        return {
+            'doc_index': doc_index,
+            'source': source,
+            'doc_id': doc_id,
+            'doc_images': PageImages(self, doc_index, num_pages),
+            'qa_data': qa_data,
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for doc_index in range(len(self)):
+            yield self.document(doc_index)
+
+    def __getitem__(self, doc_index: int) -> Dict[str, Any]:
+        return self.document(doc_index)
+
+    @staticmethod
+    def _qa_entry(row: Dict[str, Any]) -> Dict[str, Any]:
+        # Same structure as an entry of the dataset `Q&A` JSON
+        entry = {'answers': [{'page': row['page'], 'value': row['answer'], 'location': row['location']}]}
+        if row['question'] is not None:
+            entry['question'] = row['question']
+        if row['rephrased_question'] is not None:
+            entry['rephrased_question'] = row['rephrased_question']
+        return entry
+
+    @staticmethod
+    def _question(row: tuple) -> Dict[str, Any]:
+        question_id, doc_index, source, doc_id, q_key, page, question, rephrased, answer, location = row
+        return {
+            'question_id': question_id,
+            'doc_index': doc_index,
+            'source': source,
+            'doc_id': doc_id,
+            'q_key': q_key,
+            'page': page,
+            'question': question,
+            'rephrased_question': rephrased,
+            'answer': json.loads(answer),
+            'location': json.loads(location),
+        }
+
+    @property
+    def num_questions(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def sources(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT source FROM questions ORDER BY source")]
+
+    def question(self, question_id: int) -> Dict[str, Any]:
+        """Random access to a question of the table, without touching any page."""
+        row = self.conn.execute("SELECT * FROM questions WHERE question_id = ?", (question_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No question {question_id}")
+        return self._question(row)
+
+    def questions(
+        self,
+        source: Optional[str] = None,
+        page: Optional[int] = None,
+        doc_index: Optional[int] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Iterate over the questions, optionally filtered, in dataset order."""
+        filters, params = [], []
+        for column, value in (('source', source), ('page', page), ('doc_index', doc_index)):
+            if value is not None:
+                filters.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(filters)}" if filters else ""
+        for row in self.conn.execute(f"SELECT * FROM questions{where} ORDER BY question_id", params):
+            yield self._question(row)
+
+    def question_image(self, question: Dict[str, Any]) -> Image.Image:
+        return self.page_image(question['doc_index'], question['page'])
+
+
+def build_shards(
+    documents: Iterable[Dict[str, Any]],
+    output_dir: str,
+    max_side: Optional[int] = None,
+    with_ocr: bool = True,
+    shard_bytes: int = SHARD_BYTES,
+) -> Tuple[int, int]:
+    """
+    Convert BoundingDocs documents into a shard directory readable by `BoundingDocsShards`.
+
+    Args:
+        documents: Dataset rows with `source`, `doc_id`, `doc_images`, `Q&A` (and `doc_ocr` if `with_ocr`).
+        output_dir: Directory to write, created if needed.
+        max_side: If given, downscale pages so that their longest side is at most this size.
+        with_ocr: Also write the parsed OCR store of the documents.
+        shard_bytes: Size after which a new pixel file is started.
+
+    Returns:
+        (number of documents, number of questions) written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(output_dir, INDEX_FILE))
+    conn.executescript(SCHEMA)
+    # Rebuilding a directory replaces its content
+    for table in ('documents', 'pages', 'questions'):
+        conn.execute(f"DELETE FROM {table}")
+
+    ocr_store = OCRStore(os.path.join(output_dir, OCR_STORE_FILE), readonly=False) if with_ocr else None
+
+    shard, offset = 0, 0
+    pixels_file = open(os.path.join(output_dir, PIXELS_FILE.format(shard)), 'wb')
+    num_documents, num_questions = 0, 0
+    try:
+        for doc_index, document in enumerate(documents):
+            images = document.get('doc_images', [])
+            source, doc_id = document['source'], document['doc_id']
+
+            for page, image in enumerate(images, start=1):
+                pixels = page_pixels(image, max_side)
+                if offset and offset + pixels.nbytes > shard_bytes:
+                    pixels_file.close()
+                    shard, offset = shard + 1, 0
+                    pixels_file = open(os.path.join(output_dir, PIXELS_FILE.format(shard)), 'wb')
+                pixels_file.write(pixels.tobytes())
+                channels = pixels.shape[2] if pixels.ndim == 3 else 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (doc_index, page, shard, offset, pixels.shape[0], pixels.shape[1], channels),
+                )
+                offset += pixels.nbytes
+
+            rows = list(question_rows(doc_index, source, doc_id, json.loads(document.get('Q&A'))))
+            conn.executemany(
+                "INSERT INTO questions (doc_index, source, doc_id, q_key, page, question, "
+                "rephrased_question, answer, location) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                (doc_index, source, doc_id, len(images)),
+            )
+            if ocr_store is not None:
+                ocr_store.put_document(document)
+
+            num_documents += 1
+            num_questions += len(rows)
+            if num_documents % 100 == 0:
+                conn.commit()
+                if ocr_store is not None:
+                    ocr_store.commit()
+    finally:
+        pixels_file.close()
+        conn.commit()
+        conn.close()
+        if ocr_store is not None:
+            ocr_store.commit()
+            ocr_store.close()
+
+    return num_documents, num_questions
+
+
+def load_evaluation_dataset(args, split: str = "test"):
+    """
+    Load the documents to evaluate from `--shards` if given, otherwise from the Hub,
+    and point `OCRProcessor` to the requested OCR source.
+    """
+    shards = getattr(args, 'shards', None)
+    ocr_store = getattr(args, 'ocr_store', None)
+
+    if shards:
+        dataset = BoundingDocsShards(shards)
+        ocr_store = ocr_store or dataset.ocr_store_path
+    else:
+        from datasets import load_dataset
+        dataset = load_dataset("letxbe/BoundingDocs", revision="v2.0", split=split)
+
+    if ocr_store:
+        store = OCRStore(ocr_store)
+        OCRProcessor.set_store(store)
+        if not shards:
+            # Words come from the store, skip decoding the raw Textract output,
+            # unless documents missing from the store need it to fall back on
+            keys = dataset.select_columns(['source', 'doc_id'])
+            missing = sum((row['source'], row['doc_id']) not in store for row in keys)
+            if missing:
+                print(f"{missing} documents are not in the OCR store {ocr_store}, their words are parsed from doc_ocr")
+            else:
+                dataset = dataset.remove_columns(['doc_ocr'])
+    if getattr(args, 'stream_ocr', False):
+        OCRProcessor.set_streaming()
+
+    return dataset
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, default="data/shards", help="Shard directory to write")
+    parser.add_argument('--input', type=str, default=None, help="Local copy of the dataset (defaults to the Hub)")
+    parser.add_argument('--split', type=str, default="test", help="Dataset split")
+    parser.add_argument('--max-side', type=int, default=None, help="Downscale pages to this longest side")
+    parser.add_argument('--no-ocr', action='store_true', help="Do not write the OCR store")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from datasets import load_dataset
+    from tqdm import tqdm
+
+    args = parse_args()
+    if args.input:
+        dataset = load_dataset(args.input, split=args.split)
+    else:
+        dataset = load_dataset("letxbe/BoundingDocs", revision="v2.0", split=args.split)
+
+    num_documents, num_questions = build_shards(
+        tqdm(dataset, desc="Writing shards"),
+        args.output,
+        max_side=args.max_side,
+        with_ocr=not args.no_ocr,
+    )
+    print(f"✅ Stored {num_documents} documents and {num_questions} questions in {args.output}")
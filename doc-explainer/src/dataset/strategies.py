@@ -0,0 +1,433 @@
+from typing import Any, Callable, Dict, List, Optional
+
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from doc_explainer.models.utils import DEFAULT_BATCH_SIZE, VLMModel, generate_prediction, generate_prediction_batch
+from doc_explainer.models.prefix_cache import get_prefix_cache
+from doc_explainer.metrics import compute_iou, compute_normalized_center_distance
+from doc_explainer.anls import compute_anls
+from doc_explainer.boxes import WordTable
+from doc_explainer.fuzzy import FuzzyMatcher
+from doc_explainer.spatial import WordIndex
+from dataset.utils import union_boxes, scaledown_bbox, save_bbox
+from dataset.prompt import ZERO_SHOT_PROMPT, COT_ONE_SHOT_PROMPT, CLAUDE_PROMPT, CONTENT_ONLY_PROMPT, build_prompt_with_anchors
+from dataset.ocr_processor import OCRProcessor
+from dataset.shards import load_qa_data
+from dataset.runs import EvaluationRun
+from dataset.pipeline import QUEUE_SIZE, Pipeline, Stage
+
+
+class QuestionItem:
+    """A question of a document on its way through the pipeline."""
+
+    def __init__(self, index: int, q_key: str, data: Dict[str, Any], done: bool = False, metrics: Optional[Dict[str, float]] = None):
+        self.index = index
+        self.q_key = q_key
+        self.data = data
+        self.question = data.get('rephrased_question', data.get('question', ''))
+        self.page_idx = data['answers'][0]['page'] - 1
+        self.locations = data['answers'][0].get('location', [])
+        # Already evaluated before a restart, only its recorded metrics are known
+        self.done = done
+        self.metrics = metrics
+        self.image = None
+        self.prompt = None
+        self.prediction = None
+
+    @property
+    def gt_answer(self) -> Any:
+        return self.data['answers'][0]['value']
+
+
+class DocumentItem:
+    """A document and its questions, the unit of work of the pipeline."""
+
+    def __init__(self, doc_index: int, source: str, doc_id: str, questions: List[QuestionItem]):
+        self.doc_index = doc_index
+        self.source = source
+        self.doc_id = doc_id
+        self.questions = questions
+        # Per-document state of the strategy (OCR words, CoT chain...)
+        self.context: Dict[str, Any] = {}
+
+    @property
+    def pending(self) -> List[QuestionItem]:
+        return [q for q in self.questions if not q.done]
+
+
+def compute_metrics(bbox_pred: List[float], bbox_gt: List[float], pred_answer: Any, gt_answer: Any) -> Dict[str, float]:
+    """IoU, center distance and ANLS of a prediction, boxes as [x0, y0, x1, y1] in the same scale."""
+    iou = compute_iou(bbox_pred, bbox_gt)
+    return {
+        'iou': iou,
+        'center_distance': compute_normalized_center_distance(bbox_pred, bbox_gt),
+        'iou_05': iou >= 0.5,
+        'iou_075': iou >= 0.75,
+        'anls': compute_anls(pred_answer, gt_answer),
+    }
+
+
+class EvaluationStrategy:
+    """
+    How to evaluate one question: what to load per document, which prompt to send,
+    how to call the model and how to score the prediction.
+
+    `load` runs in the loader threads, `predict_batch` (or `predict` one question
+    at a time for sequential strategies) in the inference threads and `score` in
+    the scoring threads. Questions of a document always go through each stage in
+    order, and `observe` is called after every prediction (or for every question
+    already evaluated before a restart) so that strategies can carry state from one
+    question to the next.
+    """
+
+    name = "strategy"
+    # Set when a prompt depends on the predictions of the previous questions, the
+    # prompt is then built right before inference instead of in its own stage
+    sequential = False
+
+    def load(self, doc: DocumentItem, document: Dict[str, Any]) -> None:
+        pass
+
+    def build_prompt(self, doc: DocumentItem, question: QuestionItem) -> Optional[str]:
+        return None
+
+    def predict(self, doc: DocumentItem, question: QuestionItem) -> Any:
+        raise NotImplementedError
+
+    def predict_batch(self, doc: DocumentItem, questions: List[QuestionItem]) -> List[Any]:
+        """Predictions of several questions of a document, override to batch model calls."""
+        return [self.predict(doc, question) for question in questions]
+
+    def observe(self, doc: DocumentItem, question: QuestionItem) -> None:
+        pass
+
+    def score(self, doc: DocumentItem, question: QuestionItem) -> Optional[Dict[str, float]]:
+        raise NotImplementedError
+
+
+class ZeroShotStrategy(EvaluationStrategy):
+    """The VLM answers and predicts an [x, y, w, h] box in [0, 1000] (00_prompting.py)."""
+
+    name = "zero_shot"
+
+    def __init__(self, model_name: str, model: Any, processor: Any, draw_bbox: bool = False, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.model_name = model_name
+        self.model = model
+        self.processor = processor
+        self.draw_bbox = draw_bbox
+        self.batch_size = batch_size
+
+    def build_prompt(self, doc: DocumentItem, question: QuestionItem) -> str:
+        if self.model_name == VLMModel.CLAUDE:
+            return CLAUDE_PROMPT.format(QUESTION=question.question)
+        return ZERO_SHOT_PROMPT.format(QUESTION=question.question)
+
+    def predict(self, doc: DocumentItem, question: QuestionItem) -> Any:
+        return generate_prediction(question.prompt, question.image, self.model_name, self.model, self.processor, source=doc.source)
+
+    def predict_batch(self, doc: DocumentItem, questions: List[QuestionItem]) -> List[Any]:
+        return generate_prediction_batch(
+            [q.prompt for q in questions], [q.image for q in questions],
+            self.model_name, self.model, self.processor, batch_size=self.batch_size, source=doc.source,
+        )
+
+    @staticmethod
+    def parse(prediction: Any):
+        """Return (answer, [x0, y0, x1, y1]) of a prediction, or None if it is unusable."""
+        if not isinstance(prediction, dict):
+            return None
+        pred_answer = prediction.get('content', None)
+        bbox_pred = prediction.get('position', None)
+        if not (isinstance(bbox_pred, list) and len(bbox_pred) == 4 and pred_answer):
+            return None
+        x, y, w, h = bbox_pred
+        return pred_answer, [x, y, x + w, y + h]
+
+    def score(self, doc: DocumentItem, question: QuestionItem) -> Optional[Dict[str, float]]:
+        parsed = self.parse(question.prediction)
+        if parsed is None:
+            return None
+        pred_answer, bbox_pred = parsed
+        bbox_gt = union_boxes(question.locations)
+        metrics = compute_metrics(bbox_pred, bbox_gt, pred_answer, question.gt_answer)
+
+        if self.draw_bbox:
+            safe_source = doc.source.replace("/", "_").replace("\\", "_").replace(":", "_")
+            safe_doc_id = doc.doc_id.replace("/", "_").replace("\\", "_").replace(":", "_")
+            save_path = f"annotated_results/{safe_source}_{safe_doc_id}_q{question.index}_debug.png"
+            save_bbox(question.image, question.locations, question.question, question.gt_answer, save_path)
+        return metrics
+
+
+class AnchorsStrategy(ZeroShotStrategy):
+    """Zero-shot with a few OCR words and their boxes given as anchors."""
+
+    name = "anchors"
+
+    def load(self, doc: DocumentItem, document: Dict[str, Any]) -> None:
+        doc.context['words_ocr'] = OCRProcessor.get_word_table(document)
+
+    def build_prompt(self, doc: DocumentItem, question: QuestionItem) -> str:
+        words_ocr = doc.context['words_ocr']
+        if words_ocr:
+            return build_prompt_with_anchors(question.question, words_ocr, question.image.size)
+        return super().build_prompt(doc, question)
+
+
+class CoTStrategy(ZeroShotStrategy):
+    """Chain of thought over the last answered questions of the document."""
+
+    name = "cot"
+    sequential = True
+    # Previous Q&A pairs kept for context
+    CHAIN_LENGTH = 3
+
+    def build_prompt(self, doc: DocumentItem, question: QuestionItem) -> str:
+        chain = doc.context.setdefault('chain', [])
+        if len(chain) > self.CHAIN_LENGTH:
+            del chain[:-self.CHAIN_LENGTH]
+
+        if chain:
+            cot_context = "Chain of Thought:\n"
+            for prev in chain:
+                cot_context += (
+                    f"Q: {prev['question']}\n"
+                    f"A: {{\"value\": \"{prev['answer_value']}\", \"position\": {prev['position']}}}\n"
+                )
+            question_for_model = cot_context + f"\nCurrent Question:\n{question.question}\n"
+        else:
+            question_for_model = question.question
+        return COT_ONE_SHOT_PROMPT.format(QUESTION=question_for_model)
+
+    def observe(self, doc: DocumentItem, question: QuestionItem) -> None:
+        # Only questions that get scored enter the chain
+        answered = question.metrics is not None if question.done else self.parse(question.prediction) is not None
+        if answered:
+            doc.context.setdefault('chain', []).append({
+                "question": question.question,
+                "answer_value": question.gt_answer,
+                "position": union_boxes(question.locations),
+            })
+
+
+class DocExplainerStrategy(EvaluationStrategy):
+    """The full DocExplainer pipeline, boxes predicted in [0, 1] (01_docexplainer_test.py)."""
+
+    name = "docexplainer"
+
+    def __init__(self, explainer: Any, snap_to_ocr: bool = False, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.explainer = explainer
+        self.snap_to_ocr = snap_to_ocr
+        self.batch_size = batch_size
+
+    def load(self, doc: DocumentItem, document: Dict[str, Any]) -> None:
+        if not self.snap_to_ocr:
+            return
+        words_ocr = OCRProcessor.get_word_table(document)
+        page_indexes = {}
+        for question in doc.pending:
+            if question.page_idx not in page_indexes:
+                # DocExplainer only sees the question page, which is its page 1
+                page_words = words_ocr.page(question.page_idx + 1)
+                page_words = WordTable(np.ones(len(page_words)), page_words.texts, page_words.boxes)
+                page_indexes[question.page_idx] = WordIndex.from_words(page_words)
+        doc.context['page_indexes'] = page_indexes
+
+    def predict(self, doc: DocumentItem, question: QuestionItem) -> Any:
+        word_index = doc.context.get('page_indexes', {}).get(question.page_idx)
+        return self.explainer([question.image], question.question, word_index=word_index, source=doc.source)
+
+    def predict_batch(self, doc: DocumentItem, questions: List[QuestionItem]) -> List[Any]:
+        page_indexes = doc.context.get('page_indexes', {})
+        return self.explainer.forward_batch(
+            [[q.image] for q in questions],
+            [q.question for q in questions],
+            word_indexes=[page_indexes.get(q.page_idx) for q in questions],
+            batch_size=self.batch_size,
+            source=doc.source,
+        )
+
+    def score(self, doc: DocumentItem, question: QuestionItem) -> Optional[Dict[str, float]]:
+        result = question.prediction
+        if not result or result.answer is None or result.bbox is None:
+            return None
+        # Predicted bbox is in range(0,1) and gt bbox are in range[0,1000]
+        bbox_gt = scaledown_bbox(union_boxes(question.locations))
+        return compute_metrics(result.bbox, bbox_gt, result.answer, question.gt_answer)
+
+
+def find_best_word_bbox(pred_answer: str | int, matcher: FuzzyMatcher, page_idx: int, max_span: int = 1) -> Optional[List[float]]:
+    """
+    Try fuzzy match for the full answer first. If not found, fall back to first word.
+    """
+    def match_word(target: str | int) -> Optional[List[float]]:
+        """Helper to match a single word/phrase against OCR words."""
+        match = matcher.match(target, page=page_idx + 1, max_span=max_span)
+        return match.bbox if match else None
+
+    # 1. Try full answer fuzzy match
+    bbox = match_word(pred_answer)
+    if bbox:
+        return bbox
+
+    # 2. Fall back to first word
+    if isinstance(pred_answer, str):
+        first_word = pred_answer.split()[0]
+        return match_word(first_word)
+
+
+class OCRNaiveStrategy(EvaluationStrategy):
+    """The VLM only answers, the box is the best fuzzy match in the OCR (02_ocr_naive.py)."""
+
+    name = "ocr_naive"
+
+    def __init__(self, model_name: str, model: Any, processor: Any, max_span: int = 1, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.model_name = model_name
+        self.model = model
+        self.processor = processor
+        self.max_span = max_span
+        self.batch_size = batch_size
+
+    def load(self, doc: DocumentItem, document: Dict[str, Any]) -> None:
+        doc.context['matcher'] = FuzzyMatcher(OCRProcessor.get_word_table(document))
+
+    def build_prompt(self, doc: DocumentItem, question: QuestionItem) -> str:
+        return CONTENT_ONLY_PROMPT.format(QUESTION=question.question)
+
+    def predict(self, doc: DocumentItem, question: QuestionItem) -> Any:
+        return generate_prediction(question.prompt, question.image, self.model_name, self.model, self.processor, source=doc.source)
+
+    def predict_batch(self, doc: DocumentItem, questions: List[QuestionItem]) -> List[Any]:
+        return generate_prediction_batch(
+            [q.prompt for q in questions], [q.image for q in questions],
+            self.model_name, self.model, self.processor, batch_size=self.batch_size, source=doc.source,
+        )
+
+    def score(self, doc: DocumentItem, question: QuestionItem) -> Optional[Dict[str, float]]:
+        prediction = question.prediction
+        if not isinstance(prediction, dict):
+            return None
+        pred_answer = prediction.get('content', None)
+        if not pred_answer:
+            return None
+
+        bbox_pred = find_best_word_bbox(pred_answer, doc.context['matcher'], question.page_idx, max_span=self.max_span)
+        if not bbox_pred or not (isinstance(bbox_pred, list) and len(bbox_pred) == 4):
+            return None
+        return compute_metrics(bbox_pred, union_boxes(question.locations), pred_answer, question.gt_answer)
+
+
+def document_loader(dataset: Any, strategy: EvaluationStrategy, run: EvaluationRun) -> Callable[[int], DocumentItem]:
+    """Load stage of `evaluate`: fetch a document, decode the question pages and run `strategy.load`."""
+    def load(doc_index: int) -> DocumentItem:
+        document = dataset[doc_index]
+        questions = [
+            QuestionItem(
+                index, q_key, data,
+                done=run.is_done(doc_index, q_key),
+                metrics=run.metrics(doc_index, q_key),
+            )
+            for index, (q_key, data) in enumerate(load_qa_data(document).items(), start=1)
+            if run.is_selected(doc_index, q_key)
+        ]
+        doc = DocumentItem(doc_index, document.get('source'), document.get('doc_id'), questions)
+
+        # Only decode the pages that are asked about
+        images = document.get('doc_images', [])
+        for question in doc.pending:
+            question.image = images[question.page_idx]
+        strategy.load(doc, document)
+        return doc
+
+    return load
+
+
+def prompt_builder(strategy: EvaluationStrategy) -> Callable[[DocumentItem], DocumentItem]:
+    """Prompt stage of `evaluate`, sequential strategies build their prompts at inference."""
+    def build_prompts(doc: DocumentItem) -> DocumentItem:
+        if not strategy.sequential:
+            for question in doc.pending:
+                question.prompt = strategy.build_prompt(doc, question)
+        return doc
+
+    return build_prompts
+
+
+def evaluate(
+    dataset: Any,
+    strategy: EvaluationStrategy,
+    run: EvaluationRun,
+    loader_workers: int = 2,
+    inference_workers: int = 1,
+    scoring_workers: int = 1,
+    prefetch: int = QUEUE_SIZE,
+) -> Dict:
+    """
+    Evaluate a strategy on the unfinished documents of a run.
+
+    Documents flow through load (fetch, decode the question pages, strategy OCR)
+    → prompt → inference → scoring stages, and are written to the run in dataset
+    order by the calling thread.
+
+    Returns:
+        The `compute_mean_metrics` report of the run.
+    """
+    load = document_loader(dataset, strategy, run)
+    build_prompts = prompt_builder(strategy)
+    prefix_cache = get_prefix_cache()
+
+    def infer(doc: DocumentItem) -> DocumentItem:
+        if strategy.sequential:
+            for question in doc.questions:
+                if not question.done:
+                    question.prompt = strategy.build_prompt(doc, question)
+                    question.prediction = strategy.predict(doc, question)
+                strategy.observe(doc, question)
+        else:
+            # All the questions of the document in as few model calls as possible
+            pending = doc.pending
+            if pending:
+                for question, prediction in zip(pending, strategy.predict_batch(doc, pending)):
+                    question.prediction = prediction
+            for question in doc.questions:
+                strategy.observe(doc, question)
+
+        # The pages of the document will not be asked about again
+        if prefix_cache is not None:
+            prefix_cache.evict_pages([question.image for question in doc.pending])
+        return doc
+
+    def score(doc: DocumentItem) -> DocumentItem:
+        for question in doc.pending:
+            question.metrics = strategy.score(doc, question)
+            question.image = None
+        return doc
+
+    pipeline = Pipeline(
+        [
+            Stage("load", load, workers=loader_workers),
+            Stage("prompt", build_prompts),
+            Stage("inference", infer, workers=inference_workers),
+            Stage("scoring", score, workers=scoring_workers),
+        ],
+        queue_size=prefetch,
+    )
+
+    progress = tqdm(total=run.num_remaining, desc=f"Processing Documents ({strategy.name})")
+    for doc in pipeline.run(run.document_indices()):
+        for question in doc.pending:
+            run.add_question(doc.source, doc.doc_index, doc.doc_id, question.q_key)
+            if question.metrics is not None:
+                run.add(doc.source, question.metrics)
+        run.end_document(doc.doc_index)
+        progress.update()
+    progress.close()
+
+    return run.report()
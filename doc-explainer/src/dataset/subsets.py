@@ -0,0 +1,300 @@
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dataset.shards import BoundingDocsShards, load_qa_data
+
+INDEX_VERSION = 2
+
+# Columns needed to build the index, the page images are never decoded
+INDEX_COLUMNS = ['source', 'doc_id', 'Q&A']
+
+
+def dataset_fingerprint(dataset: Any) -> str:
+    """
+    Hash of the (source, doc_id) of the documents, in order. Identifies the split and
+    revision a `QuestionIndex` was built from, whose doc_index are positions in it.
+    """
+    if isinstance(dataset, BoundingDocsShards):
+        keys = dataset.conn.execute("SELECT source, doc_id FROM documents ORDER BY doc_index").fetchall()
+    elif hasattr(dataset, 'select_columns'):
+        columns = dataset.select_columns(['source', 'doc_id'])
+        keys = zip(columns['source'], columns['doc_id'])
+    else:
+        keys = ((document['source'], document['doc_id']) for document in dataset)
+    return hashlib.sha256(json.dumps([list(key) for key in keys]).encode()).hexdigest()
+
+
+class QuestionIndex:
+    """
+    Questions of BoundingDocs by source and document, without the documents.
+
+    source → doc_id → {"doc_index": position in the split, "questions": {q_key: page}}
+
+    Built once per split (a scan of the `source`, `doc_id` and `Q&A` columns, or a
+    query of the shards index) and saved as JSON, so that subsets can be sampled
+    without touching the dataset. The file records the `dataset_fingerprint` of the
+    split, `load_or_build` rebuilds it for another split or revision.
+
+    Example:
+        index = QuestionIndex.load_or_build("data/question_index.json", dataset)
+        subset = index.sample(fraction=0.01, seed=0)
+    """
+
+    def __init__(self, sources: Dict[str, Dict[str, Dict[str, Any]]], num_documents: int, fingerprint: Optional[str] = None):
+        self.sources = sources
+        self.num_documents = num_documents
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, dataset: Any) -> "QuestionIndex":
+        sources: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        if isinstance(dataset, BoundingDocsShards):
+            rows = dataset.conn.execute(
+                "SELECT doc_index, source, doc_id, q_key, page FROM questions ORDER BY question_id"
+            )
+            for doc_index, source, doc_id, q_key, page in rows:
+                entry = sources[source].setdefault(doc_id, {'doc_index': doc_index, 'questions': {}})
+                entry['questions'][q_key] = page
+            return cls(dict(sources), len(dataset), dataset_fingerprint(dataset))
+
+        fingerprint = dataset_fingerprint(dataset)
+        if hasattr(dataset, 'select_columns'):
+            dataset = dataset.select_columns(INDEX_COLUMNS)
+        num_documents = 0
+        for doc_index, document in enumerate(dataset):
+            num_documents += 1
+            qa_data = load_qa_data(document)
+            sources[document['source']][document['doc_id']] = {
+                'doc_index': doc_index,
+                'questions': {q_key: data['answers'][0]['page'] for q_key, data in qa_data.items()},
+            }
+        return cls(dict(sources), num_documents, fingerprint)
+
+    @classmethod
+    def load(cls, path: str) -> "QuestionIndex":
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f"{path} is not a question index of version {INDEX_VERSION}")
+        return cls(data['sources'], data['num_documents'], data['fingerprint'])
+
+    @classmethod
+    def load_or_build(cls, path: Optional[str], dataset: Any) -> "QuestionIndex":
+        """
+        Load the index at `path` if it was built from this split, otherwise build it
+        from the dataset and save it there.
+        """
+        if path and os.path.exists(path):
+            with open(path) as f:
+                header = json.load(f)
+            if header.get('version') == INDEX_VERSION and header.get('fingerprint') == dataset_fingerprint(dataset):
+                return cls(header['sources'], header['num_documents'], header['fingerprint'])
+            print(f"{path} was built from another split or revision of the dataset, rebuilding it")
+        index = cls.build(dataset)
+        if path:
+            index.save(path)
+        return index
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'fingerprint': self.fingerprint,
+                'num_documents': self.num_documents,
+                'sources': self.sources,
+            }, f)
+
+    def questions(self, source: Optional[str] = None) -> Iterator[Tuple[str, str, int, str, int]]:
+        """Yield (source, doc_id, doc_index, q_key, page), in dataset order within a source."""
+        for name in sorted(self.sources) if source is None else [source]:
+            documents = sorted(self.sources[name].items(), key=lambda item: item[1]['doc_index'])
+            for doc_id, entry in documents:
+                for q_key, page in entry['questions'].items():
+                    yield name, doc_id, entry['doc_index'], q_key, page
+
+    def counts(self) -> Dict[str, int]:
+        """Number of questions per source."""
+        return {
+            source: sum(len(entry['questions']) for entry in documents.values())
+            for source, documents in sorted(self.sources.items())
+        }
+
+    def sample(
+        self,
+        fraction: Optional[float] = None,
+        per_source: Optional[int] = None,
+        seed: int = 0,
+        sources: Optional[Sequence[str]] = None,
+    ) -> "Subset":
+        """
+        Draw a subset of the questions, stratified by source.
+
+        Args:
+            fraction: Share of the questions of every source to keep (at least one
+                question per source).
+            per_source: Number of questions to keep per source, instead of `fraction`.
+            seed: Seed of the draw. Each source is drawn with its own generator, so
+                restricting `sources` does not change the questions of the others.
+            sources: Sources to sample from (all by default).
+
+        Returns:
+            Subset: The selected questions.
+        """
+        if (fraction is None) == (per_source is None):
+            raise ValueError("Give exactly one of fraction and per_source")
+        if fraction is not None and not 0 < fraction <= 1:
+            raise ValueError(f"Invalid fraction {fraction}")
+
+        selected: Dict[int, List[str]] = defaultdict(list)
+        for source in sorted(sources or self.sources):
+            if source not in self.sources:
+                raise ValueError(f"Unknown source {source}")
+            candidates = [(doc_index, q_key) for _, _, doc_index, q_key, _ in self.questions(source)]
+            if per_source is not None:
+                size = min(per_source, len(candidates))
+            else:
+                size = min(len(candidates), max(1, round(fraction * len(candidates))))
+            rng = random.Random(f"{seed}:{source}")
+            for doc_index, q_key in rng.sample(candidates, size):
+                selected[doc_index].append(q_key)
+
+        params = {'fraction': fraction, 'per_source': per_source, 'seed': seed, 'sources': sorted(sources) if sources else None}
+        return Subset(
+            {doc_index: sorted(q_keys) for doc_index, q_keys in selected.items()},
+            self.num_documents,
+            params,
+            self.fingerprint,
+        )
+
+
+class Subset:
+    """
+    Selected questions of a split: doc_index → question keys.
+
+    Passed to `EvaluationRun`, which then only visits the selected documents and
+    questions. The fingerprint identifies the selection in checkpoints and file names,
+    the index fingerprint the split it was drawn from (see `dataset_fingerprint`).
+    """
+
+    def __init__(
+        self,
+        questions: Dict[int, List[str]],
+        num_documents: int,
+        params: Optional[Dict[str, Any]] = None,
+        index_fingerprint: Optional[str] = None,
+    ):
+        self.questions = {int(doc_index): list(q_keys) for doc_index, q_keys in questions.items()}
+        self.num_documents = num_documents
+        self.params = params or {}
+        self.index_fingerprint = index_fingerprint
+        self.doc_indices = sorted(self.questions)
+        self._keys = {doc_index: set(q_keys) for doc_index, q_keys in self.questions.items()}
+        content = json.dumps([[doc_index, self.questions[doc_index]] for doc_index in self.doc_indices])
+        self.fingerprint = hashlib.sha256(content.encode()).hexdigest()
+
+    @property
+    def num_questions(self) -> int:
+        return sum(len(q_keys) for q_keys in self.questions.values())
+
+    def __contains__(self, key: Tuple[int, str]) -> bool:
+        doc_index, q_key = key
+        return q_key in self._keys.get(doc_index, ())
+
+    @classmethod
+    def load(cls, path: str) -> "Subset":
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['questions'], data['num_documents'], data.get('params'), data.get('index_fingerprint'))
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                'num_documents': self.num_documents,
+                'params': self.params,
+                'fingerprint': self.fingerprint,
+                'index_fingerprint': self.index_fingerprint,
+                'questions': {str(doc_index): self.questions[doc_index] for doc_index in self.doc_indices},
+            }, f, indent=1)
+
+
+def subset_suffix(subset: Optional[Subset]) -> str:
+    """Suffix added to the output files of a subset run, empty for full runs."""
+    if subset is None:
+        return ""
+    return f".subset-{subset.fingerprint[:8]}"
+
+
+def add_subset_arguments(parser: argparse.ArgumentParser) -> None:
+    """Subset arguments shared by the evaluation scripts."""
+    parser.add_argument('--subset', type=str, default=None, help="Evaluate the questions of a subset file written by subsets.py")
+    parser.add_argument('--sample-fraction', type=float, default=None, help="Evaluate this share of the questions of every source")
+    parser.add_argument('--sample-per-source', type=int, default=None, help="Evaluate this many questions per source")
+    parser.add_argument('--sample-seed', type=int, default=0, help="Seed of the sampled subset")
+    parser.add_argument('--question-index', type=str, default="data/question_index.json", help="Question index, built on first use")
+
+
+def load_subset(args, dataset: Any) -> Optional[Subset]:
+    """The subset requested by `add_subset_arguments`, None to evaluate every question."""
+    if args.subset:
+        subset = Subset.load(args.subset)
+        # doc_index are positions in the split the subset was drawn from
+        if subset.index_fingerprint is not None and subset.index_fingerprint != dataset_fingerprint(dataset):
+            raise ValueError(f"{args.subset} was sampled from another split or revision of the dataset")
+    elif args.sample_fraction is not None or args.sample_per_source is not None:
+        index = QuestionIndex.load_or_build(args.question_index, dataset)
+        subset = index.sample(fraction=args.sample_fraction, per_source=args.sample_per_source, seed=args.sample_seed)
+    else:
+        return None
+    if subset.num_documents != len(dataset):
+        raise ValueError(f"Subset of a split of {subset.num_documents} documents, got {len(dataset)}")
+    print(f"Evaluating {subset.num_questions} questions of {len(subset.doc_indices)} documents")
+    return subset
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the question index of a split and sample stratified subsets")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    index = commands.add_parser('index', help="Build the question index")
+    index.add_argument('--output', type=str, default="data/question_index.json", help="Index file to write")
+    index.add_argument('--shards', type=str, default=None, help="Local shards built with shards.py instead of the Hub dataset")
+    index.add_argument('--split', type=str, default="test", help="Dataset split")
+
+    sample = commands.add_parser('sample', help="Sample a stratified subset")
+    sample.add_argument('--index', type=str, default="data/question_index.json", help="Question index")
+    sample.add_argument('--fraction', type=float, default=None, help="Share of the questions of every source")
+    sample.add_argument('--per-source', type=int, default=None, help="Number of questions per source")
+    sample.add_argument('--seed', type=int, default=0, help="Seed of the draw")
+    sample.add_argument('--sources', nargs='+', default=None, help="Only sample these sources")
+    sample.add_argument('--output', type=str, required=True, help="Subset file to write")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'index':
+        if args.shards:
+            dataset = BoundingDocsShards(args.shards)
+        else:
+            from datasets import load_dataset
+            dataset = load_dataset("letxbe/BoundingDocs", revision="v2.0", split=args.split)
+        index = QuestionIndex.build(dataset)
+        index.save(args.output)
+        print(f"✅ Indexed {sum(index.counts().values())} questions of {index.num_documents} documents in {args.output}")
+    else:
+        index = QuestionIndex.load(args.index)
+        subset = index.sample(fraction=args.fraction, per_source=args.per_source, seed=args.seed, sources=args.sources)
+        subset.save(args.output)
+        print(f"✅ Sampled {subset.num_questions} questions of {len(subset.doc_indices)} documents into {args.output}")
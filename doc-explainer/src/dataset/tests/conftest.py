@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Add src to path to import the doc_explainer and dataset packages
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from dataset.ocr_processor import OCRProcessor, TextractStream
+
+
+def _block(text, left, top, block_type='WORD', page=1):
+    return {
+        'BlockType': block_type,
+        'Id': f'{text}-{left}',
+        'Page': page,
+        'Text': text,
+        'Confidence': 99.1,
+        'Geometry': {
+            'BoundingBox': {'Left': left, 'Top': top, 'Width': 0.05, 'Height': 0.02},
+            'Polygon': [{'X': left, 'Y': top}] * 4,
+        },
+        'Relationships': [{'Type': 'CHILD', 'Ids': ['a', 'b']}],
+    }
+
+
+BLOCKS = [
+    {'BlockType': 'PAGE', 'Geometry': {'BoundingBox': {'Left': 0, 'Top': 0, 'Width': 1, 'Height': 1}}},
+    _block('Invoice 42', 0.1, 0.1, 'LINE'),
+    _block('Invoice', 0.1, 0.1),
+    _block('42', 0.2, 0.1),
+    _block('Total', 0.5, 1.3, page=2),  # out of range, clamped
+    {'BlockType': 'WORD', 'Text': 'no box'},
+    {'BlockType': 'KEY_VALUE_SET', 'Text': 'key', 'Geometry': {'BoundingBox': {'Left': 0.3, 'Top': 0.3, 'Width': 0.1, 'Height': 0.1}}},
+    'not a block',
+]
+
+LAYOUTS = {
+    'list': BLOCKS,
+    'list_of_pages': [{'DocumentMetadata': {'Pages': 2}, 'Blocks': BLOCKS}, {'Blocks': []}],
+    'blocks': {'DocumentMetadata': {'Pages': 2}, 'Blocks': BLOCKS},
+    'mp_docvqa': {'LINE': [_block('Invoice 42', 0.1, 0.1, 'LINE')], 'WORD': [_block('Invoice', 0.1, 0.1), _block('42', 0.2, 0.1)]},
+    # Only unusable lines: neither parser falls back to the words
+    'mp_docvqa_empty_lines': {'LINE': [{'Text': 'no box'}], 'WORD': [_block('42', 0.2, 0.1)]},
+    'mp_docvqa_words': {'WORD': [_block('Invoice', 0.1, 0.1), _block('42', 0.2, 0.1)]},
+    'empty_list': [],
+    'empty_object': {},
+    'empty_blocks': {'Blocks': []},
+}
+
+
+def _sample(ocr_raw):
+    return {'doc_ocr': [ocr_raw]}
+
+
+def _parse(sample, streaming):
+    blocks = OCRProcessor.extract_blocks_from_ocr(sample, streaming=streaming)
+    return OCRProcessor.extract_words_and_bboxes(blocks), OCRProcessor.extract_lines_from_blocks(blocks)
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+@pytest.mark.parametrize('indent', [None, 2])
+def test_streaming_matches_json_loads(layout, indent):
+    sample = _sample(json.dumps(LAYOUTS[layout], indent=indent))
+    words, lines = _parse(sample, streaming=True)
+    assert (words, lines) == _parse(sample, streaming=False)
+
+    expected_table = OCRProcessor.extract_word_table(OCRProcessor.extract_blocks_from_ocr(sample, streaming=False))
+    table = OCRProcessor.extract_word_table(OCRProcessor.extract_blocks_from_ocr(sample, streaming=True))
+    assert table.texts == expected_table.texts
+    assert table.pages.tolist() == expected_table.pages.tolist()
+    assert (table.boxes.data == expected_table.boxes.data).all()
+
+
+def test_streaming_keeps_only_the_used_fields():
+    blocks = OCRProcessor.stream_blocks_from_ocr(_sample(json.dumps(LAYOUTS['blocks'])))
+    assert [block['Text'] for block in blocks] == ['Invoice 42', 'Invoice', '42', 'Total', 'key']
+    assert all(set(block) <= {'Text', 'Geometry', 'BlockType', 'Page'} for block in blocks)
+    assert all(set(block['Geometry']) == {'BoundingBox'} for block in blocks)
+
+
+@pytest.mark.parametrize('layout', ['list', 'list_of_pages', 'blocks', 'mp_docvqa'])
+def test_truncated_json_yields_no_blocks(layout, capsys):
+    ocr_raw = json.dumps(LAYOUTS[layout])
+    for malformed in (ocr_raw[:1], ocr_raw[:len(ocr_raw) // 2], ocr_raw[:-1], ocr_raw + ' {}'):
+        sample = _sample(malformed)
+        assert _parse(sample, streaming=True) == _parse(sample, streaming=False) == ([], '')
+
+    # The lazy iterator yields the blocks read before the error, then raises it
+    with pytest.raises(json.JSONDecodeError):
+        list(TextractStream(ocr_raw[:len(ocr_raw) // 2]).iter_blocks())
+
+
+def test_missing_ocr():
+    assert _parse({}, streaming=True) == _parse({}, streaming=False) == ([], '')
@@ -0,0 +1,85 @@
+import json
+import sqlite3
+
+import numpy as np
+import pytest
+
+from dataset.ocr_processor import OCRProcessor
+from dataset.ocr_store import OCRStore, build_store
+
+
+def _block(text, left, top, block_type='WORD', page=1):
+    box = {'Left': left, 'Top': top, 'Width': 0.05, 'Height': 0.02}
+    return {'BlockType': block_type, 'Page': page, 'Text': text, 'Geometry': {'BoundingBox': box}}
+
+
+DOCUMENTS = [
+    {'source': 'docvqa', 'doc_id': 'a', 'doc_ocr': [json.dumps({'Blocks': [
+        _block('Invoice 42', 0.1, 0.1, 'LINE'), _block('Invoice', 0.1, 0.1), _block('42', 0.2, 0.1), _block('Total', 0.5, 1.3, page=2),
+    ]})]},
+    {'source': 'docvqa', 'doc_id': 'b', 'doc_ocr': [json.dumps([_block('Ünïcode', 0.3, 0.4, 'LINE')])]},
+    # Same doc_id in another source
+    {'source': 'funsd', 'doc_id': 'a', 'doc_ocr': [json.dumps({'LINE': [_block('Form', 0.0, 0.0, 'LINE')], 'WORD': []})]},
+    {'source': 'sroie', 'doc_id': 'empty', 'doc_ocr': ['{}']},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / 'ocr_store.sqlite')
+    assert build_store(iter(DOCUMENTS), path, commit_every=2) == len(DOCUMENTS)
+    with OCRStore(path) as store:
+        yield store
+
+
+def test_round_trip(store):
+    assert len(store) == len(DOCUMENTS)
+    for document in DOCUMENTS:
+        key = (document['source'], document['doc_id'])
+        assert key in store
+
+        blocks = OCRProcessor.extract_blocks_from_ocr(document, streaming=False)
+        assert store.get_words(*key) == OCRProcessor.extract_words_and_bboxes(blocks)
+        assert store.get_lines(*key) == OCRProcessor.extract_lines_from_blocks(blocks)
+
+        table = store.get_word_table(*key)
+        expected = OCRProcessor.extract_word_table(blocks)
+        assert table.texts == expected.texts
+        assert table.pages.tolist() == expected.pages.tolist()
+        assert np.array_equal(table.boxes.data, expected.boxes.data)
+
+
+def test_missing_documents(store):
+    assert ('docvqa', 'missing') not in store
+    assert store.get_words('docvqa', 'missing') is None
+    assert store.get_word_table('docvqa', 'missing') is None
+    assert store.get_lines('docvqa', 'missing') is None
+
+
+def test_readonly(store):
+    with pytest.raises(sqlite3.OperationalError):
+        store.put('docvqa', 'c', [], '')
+
+
+def test_put_replaces_a_document(tmp_path):
+    path = str(tmp_path / 'ocr_store.sqlite')
+    with OCRStore(path, readonly=False) as store:
+        store.put('docvqa', 'a', [{'page': 1, 'text': 'old', 'bbox': [1, 2, 3, 4]}], 'old;1 2 3 4')
+        store.put('docvqa', 'a', [{'page': 2, 'text': 'new', 'bbox': [5, 6, 7, 8]}], 'new;5 6 7 8')
+        store.commit()
+        assert len(store) == 1
+        assert store.get_words('docvqa', 'a') == [{'page': 2, 'text': 'new', 'bbox': [5, 6, 7, 8]}]
+        assert store.get_lines('docvqa', 'a') == 'new;5 6 7 8'
+
+
+def test_processor_reads_from_the_store(store, monkeypatch):
+    monkeypatch.setattr(OCRProcessor, 'store', None)
+    document = DOCUMENTS[0]
+    parsed = OCRProcessor.get_words(document)
+
+    OCRProcessor.set_store(store)
+    # The raw OCR is not read for stored documents
+    assert OCRProcessor.get_words({**document, 'doc_ocr': ['[]']}) == parsed
+    assert OCRProcessor.get_word_table({**document, 'doc_ocr': ['[]']}).texts == [word['text'] for word in parsed]
+    # Documents missing from the store are still parsed
+    assert OCRProcessor.get_words({'source': 'docvqa', 'doc_id': 'c', 'doc_ocr': DOCUMENTS[1]['doc_ocr']}) == store.get_words('docvqa', 'b')
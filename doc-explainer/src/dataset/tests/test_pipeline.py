@@ -0,0 +1,102 @@
+import random
+import threading
+import time
+
+import pytest
+
+from dataset.pipeline import Pipeline, Stage
+
+
+def _jitter(item):
+    time.sleep(random.Random(item).uniform(0, 0.005))
+    return item
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_results_come_in_input_order(workers):
+    pipeline = Pipeline([
+        Stage('load', _jitter, workers=workers),
+        Stage('infer', lambda item: item * 2),
+        Stage('score', lambda item: _jitter(item) + 1, workers=workers),
+    ], queue_size=2)
+    assert list(pipeline.run(range(100))) == [item * 2 + 1 for item in range(100)]
+    assert list(pipeline.run([])) == []
+
+
+def test_process_stage():
+    pipeline = Pipeline([Stage('load', _jitter), Stage('score', abs, workers=2, processes=True), Stage('format', str)])
+    assert list(pipeline.run(range(-10, 10))) == [str(abs(item)) for item in range(-10, 10)]
+
+
+def test_stage_errors_are_raised():
+    def infer(item):
+        if item == 7:
+            raise KeyError(item)
+        return item
+
+    results = []
+    with pytest.raises(KeyError):
+        for result in Pipeline([Stage('load', _jitter, workers=3), Stage('infer', infer)]).run(range(100)):
+            results.append(result)
+    assert results == list(range(len(results)))
+    assert len(results) <= 7
+
+
+def test_input_errors_are_raised():
+    def items():
+        yield from range(5)
+        raise OSError("read error")
+
+    with pytest.raises(OSError, match="read error"):
+        list(Pipeline([Stage('load', _jitter)]).run(items()))
+
+
+def test_early_close_stops_the_workers():
+    consumed = []
+
+    def items():
+        for item in range(1000):
+            consumed.append(item)
+            yield item
+
+    pipeline = Pipeline([Stage('load', _jitter, workers=2), Stage('infer', _jitter)], queue_size=2)
+    results = pipeline.run(items())
+    assert [next(results) for _ in range(5)] == list(range(5))
+    results.close()
+
+    # The feed stopped within the window of the yielded items
+    assert len(consumed) <= 5 + pipeline.window + 1
+    assert not any(thread.name.startswith('pipeline-') for thread in threading.enumerate())
+
+
+def test_slow_items_bound_the_window():
+    release = threading.Event()
+    consumed = []
+
+    def items():
+        for item in range(100):
+            consumed.append(item)
+            yield item
+
+    def infer(item):
+        if item == 0:
+            release.wait(5)
+        return item
+
+    pipeline = Pipeline([Stage('infer', infer, workers=4)], queue_size=2, window=6)
+    results = pipeline.run(items())
+    thread = threading.Thread(target=lambda: consumed.append(list(results)))
+    thread.start()
+    time.sleep(0.3)
+    # Items behind the first one are done but wait for it, the next one waits for a slot
+    assert len(consumed) == 6 + 1
+    release.set()
+    thread.join(5)
+    assert consumed[-1] == list(range(100))
+
+
+def test_invalid_stages():
+    with pytest.raises(ValueError):
+        Pipeline([])
+    with pytest.raises(ValueError):
+        Stage('load', _jitter, workers=0)
@@ -0,0 +1,171 @@
+import json
+import random
+
+import pytest
+
+from dataset.runs import EvaluationRun, merge_checkpoints, read_checkpoint, shard_indices
+
+
+def _dataset(num_documents=12, seed=0):
+    # Documents as lists of (source, q_key, metrics), None for skipped questions
+    rng = random.Random(seed)
+    dataset = []
+    for doc_index in range(num_documents):
+        source = rng.choice(['docvqa', 'funsd', 'sroie'])
+        questions = []
+        for q in range(rng.randint(1, 4)):
+            iou = rng.random()
+            metrics = None if rng.random() < 0.1 else {
+                'iou': iou,
+                'center_distance': rng.random(),
+                'iou_05': float(iou >= 0.5),
+                'iou_075': float(iou >= 0.75),
+                'anls': rng.random(),
+            }
+            questions.append((source, f'q{q}', metrics))
+        dataset.append(questions)
+    return dataset
+
+
+class Crash(Exception):
+    pass
+
+
+def _evaluate(run, dataset, crash_after=None):
+    """Evaluate the unfinished questions of a run, raising `Crash` after `crash_after` new questions."""
+    evaluated = 0
+    for doc_index, questions in run.documents(dataset):
+        for source, q_key, metrics in questions:
+            if run.is_done(doc_index, q_key):
+                continue
+            if evaluated == crash_after:
+                raise Crash
+            run.add_question(source, doc_index, f'doc{doc_index}', q_key)
+            if metrics is not None:
+                run.add(source, metrics)
+            evaluated += 1
+        run.end_document(doc_index)
+    return evaluated
+
+
+def _assert_same_report(report, expected):
+    assert report.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            _assert_same_report(report[key], value)
+        else:
+            assert report[key] == pytest.approx(value, rel=1e-12), key
+
+
+@pytest.fixture
+def dataset():
+    return _dataset()
+
+
+@pytest.fixture
+def expected(dataset):
+    run = EvaluationRun(None, len(dataset))
+    _evaluate(run, dataset)
+    return run.report()
+
+
+@pytest.mark.parametrize('checkpoint_every', [1, 3])
+def test_resume_after_a_crash(tmp_path, dataset, expected, checkpoint_every):
+    path = str(tmp_path / 'run.jsonl')
+    run = EvaluationRun(path, len(dataset), checkpoint_every=checkpoint_every)
+    with pytest.raises(Crash):
+        _evaluate(run, dataset, crash_after=10)
+    # The process dies: buffered questions and the open file are lost
+    run._file.close()
+    with open(path, 'ab') as f:
+        f.write(b'{"doc_index": 3, "q_k')
+
+    resumed = EvaluationRun(path, len(dataset), checkpoint_every=checkpoint_every)
+    assert resumed.num_remaining < len(dataset)
+    evaluated = _evaluate(resumed, dataset)
+    assert evaluated < sum(len(questions) for questions in dataset)
+    _assert_same_report(resumed.report(), expected)
+
+    # Everything is done, a new resume has nothing left to evaluate
+    again = EvaluationRun(path, len(dataset))
+    assert again.num_remaining == 0
+    assert list(again.documents(dataset)) == []
+    _assert_same_report(again.report(), expected)
+
+    header, records, valid = read_checkpoint(path)
+    assert header == {'num_documents': len(dataset), 'shard_id': 0, 'num_shards': 1}
+    with open(path, 'rb') as f:
+        assert valid == len(f.read())
+
+
+def test_restart_ignores_the_checkpoint(tmp_path, dataset, expected):
+    path = str(tmp_path / 'run.jsonl')
+    run = EvaluationRun(path, len(dataset))
+    _evaluate(run, dataset)
+    run.close()
+
+    restarted = EvaluationRun(path, len(dataset), resume=False)
+    assert restarted.num_remaining == len(dataset)
+    _evaluate(restarted, dataset)
+    _assert_same_report(restarted.report(), expected)
+
+
+def test_checkpoint_of_another_run(tmp_path, dataset):
+    path = str(tmp_path / 'run.jsonl')
+    EvaluationRun(path, len(dataset)).close()
+    with pytest.raises(ValueError):
+        EvaluationRun(path, len(dataset), shard_id=1, num_shards=2)
+
+
+@pytest.mark.parametrize('num_shards', [1, 3, 5])
+def test_merge_matches_a_single_run(tmp_path, dataset, expected, num_shards):
+    paths = []
+    for shard_id in range(num_shards):
+        path = str(tmp_path / f'run.shard{shard_id}.jsonl')
+        run = EvaluationRun(path, len(dataset), shard_id, num_shards)
+        assert list(run.document_indices()) == list(shard_indices(len(dataset), shard_id, num_shards))
+        _evaluate(run, dataset)
+        run.close()
+        paths.append(path)
+
+    _assert_same_report(merge_checkpoints(reversed(paths)), expected)
+
+
+def test_merge_rejects_partial_runs(tmp_path, dataset):
+    paths = []
+    for shard_id in range(2):
+        path = str(tmp_path / f'run.shard{shard_id}.jsonl')
+        run = EvaluationRun(path, len(dataset), shard_id, 2)
+        _evaluate(run, dataset)
+        run.close()
+        paths.append(path)
+
+    with pytest.raises(ValueError, match="Expected shards"):
+        merge_checkpoints(paths[:1])
+
+    other = str(tmp_path / 'other.jsonl')
+    run = EvaluationRun(other, len(dataset) + 1, 1, 2)
+    _evaluate(run, _dataset(len(dataset) + 1))
+    run.close()
+    with pytest.raises(ValueError, match="different runs"):
+        merge_checkpoints([paths[0], other])
+
+    unfinished = str(tmp_path / 'unfinished.jsonl')
+    run = EvaluationRun(unfinished, len(dataset), 1, 2)
+    with pytest.raises(Crash):
+        _evaluate(run, dataset, crash_after=3)
+    run.close()
+    with pytest.raises(ValueError, match="documents are finished"):
+        merge_checkpoints([paths[0], unfinished])
+
+    duplicated = str(tmp_path / 'duplicated.jsonl')
+    with open(paths[1]) as f, open(duplicated, 'w') as out:
+        lines = f.readlines()
+        out.writelines(lines + [line for line in lines[1:] if 'complete' not in json.loads(line)])
+    with pytest.raises(ValueError, match="more than once"):
+        merge_checkpoints([paths[0], duplicated])
+
+    empty = tmp_path / 'empty.jsonl'
+    empty.write_text('')
+    with pytest.raises(ValueError, match="not a run checkpoint"):
+        merge_checkpoints([paths[0], str(empty)])
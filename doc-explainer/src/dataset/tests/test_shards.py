@@ -0,0 +1,117 @@
+import json
+import os
+from argparse import Namespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from dataset.ocr_processor import OCRProcessor
+from dataset.shards import PIXELS_FILE, BoundingDocsShards, build_shards, load_evaluation_dataset, load_qa_data
+
+
+def _page(mode, size, seed):
+    rng = np.random.default_rng(seed)
+    if mode == 'L':
+        return Image.fromarray(rng.integers(0, 256, size[::-1], dtype=np.uint8), 'L')
+    return Image.fromarray(rng.integers(0, 256, (*size[::-1], 3), dtype=np.uint8), 'RGB').convert(mode)
+
+
+def _qa(page, key):
+    return {key: {
+        'question': f'What is {key}?',
+        'rephrased_question': f'Which is {key}?',
+        'answers': [{'page': page, 'value': f'{key} value', 'location': [[1, 2, 3, 4]]}],
+    }}
+
+
+def _word(text):
+    box = {'Left': 0.1, 'Top': 0.2, 'Width': 0.05, 'Height': 0.02}
+    return {'BlockType': 'WORD', 'Page': 1, 'Text': text, 'Geometry': {'BoundingBox': box}}
+
+
+DOCUMENTS = [
+    {
+        'source': 'docvqa', 'doc_id': 'a',
+        'doc_images': [_page('RGB', (40, 30), 0), _page('L', (20, 50), 1)],
+        'Q&A': json.dumps({**_qa(1, 'q0'), **_qa(2, 'q1')}),
+        'doc_ocr': [json.dumps({'Blocks': [_word('Invoice')]})],
+    },
+    {
+        'source': 'funsd', 'doc_id': 'b',
+        # Converted to RGB
+        'doc_images': [_page('RGBA', (64, 16), 2)],
+        'Q&A': json.dumps({'q0': {'question': 'Name?', 'answers': [{'page': 1, 'value': ['x', 'y']}]}}),
+        'doc_ocr': [json.dumps([_word('Form')])],
+    },
+]
+
+
+@pytest.fixture
+def shards(tmp_path):
+    # Small pixel files, so that the pages span several of them
+    assert build_shards(iter(DOCUMENTS), str(tmp_path), shard_bytes=4000) == (2, 3)
+    assert os.path.exists(tmp_path / PIXELS_FILE.format(1))
+    with BoundingDocsShards(str(tmp_path)) as shards:
+        yield shards
+
+
+def test_pages_round_trip(shards):
+    assert len(shards) == len(DOCUMENTS)
+    for document, stored in zip(DOCUMENTS, shards):
+        assert (stored['source'], stored['doc_id']) == (document['source'], document['doc_id'])
+        images = stored['doc_images']
+        assert len(images) == len(document['doc_images'])
+        for image, expected in zip(images, document['doc_images']):
+            if expected.mode not in ('L', 'RGB'):
+                expected = expected.convert('RGB')
+            assert image.mode == expected.mode
+            assert np.array_equal(np.asarray(image), np.asarray(expected))
+        assert np.array_equal(np.asarray(images[-1]), np.asarray(list(images)[-1]))
+        with pytest.raises(IndexError):
+            images[len(images)]
+
+
+def test_pixels_are_read_only_views(shards):
+    pixels = shards.page_pixels(0, 1)
+    assert pixels.shape == (30, 40, 3)
+    with pytest.raises(ValueError):
+        pixels[0, 0, 0] = 0
+    with pytest.raises(KeyError):
+        shards.page_pixels(0, 3)
+
+
+def test_questions_round_trip(shards):
+    for document, stored in zip(DOCUMENTS, shards):
+        qa_data = load_qa_data(document)
+        assert load_qa_data(stored) == {
+            key: {**entry, 'answers': [{'location': [], **entry['answers'][0]}]}
+            for key, entry in qa_data.items()
+        }
+
+    assert shards.num_questions == 3
+    assert shards.sources() == ['docvqa', 'funsd']
+    assert [q['q_key'] for q in shards.questions(source='docvqa', page=2)] == ['q1']
+    question = shards.question(3)
+    assert (question['doc_id'], question['answer'], question['rephrased_question']) == ('b', ['x', 'y'], None)
+    assert np.array_equal(np.asarray(shards.question_image(question)), shards.page_pixels(1, 1))
+    with pytest.raises(KeyError):
+        shards.question(4)
+
+
+def test_downscaled_rebuild(tmp_path, shards):
+    build_shards(iter(DOCUMENTS[:1]), str(tmp_path), max_side=20, with_ocr=False)
+    with BoundingDocsShards(str(tmp_path)) as rebuilt:
+        # Rebuilding a directory replaces its content
+        assert len(rebuilt) == 1
+        assert rebuilt.num_questions == 2
+        assert [max(image.size) for image in rebuilt[0]['doc_images']] == [20, 20]
+
+
+def test_load_evaluation_dataset_uses_the_ocr_store(shards, monkeypatch):
+    monkeypatch.setattr(OCRProcessor, 'store', None)
+    dataset = load_evaluation_dataset(Namespace(shards=shards.path))
+    assert len(dataset) == len(DOCUMENTS)
+    assert OCRProcessor.store.path == shards.ocr_store_path
+    # Shard documents have no raw OCR, their words come from the store
+    assert [word['text'] for word in OCRProcessor.get_words(dataset[1])] == ['Form']
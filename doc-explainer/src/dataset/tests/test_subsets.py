@@ -0,0 +1,144 @@
+import json
+import random
+from argparse import Namespace
+
+import pytest
+from PIL import Image
+
+from dataset.shards import BoundingDocsShards, build_shards
+from dataset.subsets import QuestionIndex, Subset, dataset_fingerprint, load_subset
+
+SOURCES = {'docvqa': 30, 'funsd': 10, 'sroie': 3}
+
+
+def _documents(seed=0):
+    rng = random.Random(seed)
+    documents = []
+    for source, num_documents in SOURCES.items():
+        for i in range(num_documents):
+            qa_data = {
+                f'q{q}': {'question': f'Question {q}?', 'answers': [{'page': rng.randint(1, 2), 'value': 'x'}]}
+                for q in range(rng.randint(1, 4))
+            }
+            documents.append({'source': source, 'doc_id': f'{source}-{i}', 'Q&A': json.dumps(qa_data)})
+    rng.shuffle(documents)
+    return documents
+
+
+@pytest.fixture
+def documents():
+    return _documents()
+
+
+@pytest.fixture
+def index(documents):
+    return QuestionIndex.build(documents)
+
+
+def test_build_from_shards(tmp_path, documents, index):
+    pages = [Image.new('L', (4, 4)), Image.new('L', (4, 4))]
+    build_shards(({**document, 'doc_images': pages} for document in documents), str(tmp_path), with_ocr=False)
+    with BoundingDocsShards(str(tmp_path)) as shards:
+        assert dataset_fingerprint(shards) == dataset_fingerprint(documents)
+        from_shards = QuestionIndex.build(shards)
+    assert from_shards.sources == index.sources
+    assert from_shards.num_documents == index.num_documents == len(documents)
+    assert from_shards.fingerprint == index.fingerprint
+
+
+def test_load_or_build(tmp_path, documents, index, monkeypatch):
+    path = str(tmp_path / 'index' / 'question_index.json')
+    built = QuestionIndex.load_or_build(path, documents)
+    assert (built.sources, built.fingerprint) == (index.sources, index.fingerprint)
+
+    # Reused as long as the split is the same
+    def build(dataset):
+        raise AssertionError("rebuilt")
+    with monkeypatch.context() as m:
+        m.setattr(QuestionIndex, 'build', build)
+        assert QuestionIndex.load_or_build(path, documents).sources == index.sources
+    assert QuestionIndex.load(path).counts() == index.counts()
+
+    # Another revision of the split: same documents in another order
+    reordered = documents[1:] + documents[:1]
+    rebuilt = QuestionIndex.load_or_build(path, reordered)
+    assert rebuilt.fingerprint == dataset_fingerprint(reordered) != index.fingerprint
+    assert QuestionIndex.load(path).fingerprint == rebuilt.fingerprint
+    first = documents[0]
+    assert rebuilt.sources[first['source']][first['doc_id']]['doc_index'] == len(documents) - 1
+
+
+def test_load_rejects_other_versions(tmp_path, index):
+    path = str(tmp_path / 'question_index.json')
+    index.save(path)
+    with open(path) as f:
+        data = json.load(f)
+    data['version'] = 1
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    with pytest.raises(ValueError):
+        QuestionIndex.load(path)
+
+
+def test_seeded_stratified_sampling(index):
+    counts = index.counts()
+    subset = index.sample(fraction=0.25, seed=3)
+    assert subset.fingerprint == index.sample(fraction=0.25, seed=3).fingerprint
+    assert subset.fingerprint != index.sample(fraction=0.25, seed=4).fingerprint
+
+    sampled = {source: 0 for source in counts}
+    for source, _, doc_index, q_key, _ in index.questions():
+        if (doc_index, q_key) in subset:
+            sampled[source] += 1
+    # At least one question per source
+    assert sampled == {source: max(1, round(0.25 * count)) for source, count in counts.items()}
+    assert subset.num_questions == sum(sampled.values())
+    assert subset.doc_indices == sorted(subset.questions)
+
+    per_source = index.sample(per_source=5, seed=3)
+    assert per_source.num_questions == sum(min(5, count) for count in counts.values())
+
+    # Each source has its own generator
+    funsd = index.sample(fraction=0.25, seed=3, sources=['funsd'])
+    assert funsd.num_questions == sampled['funsd']
+    assert all((doc_index, q_key) in subset for doc_index, q_keys in funsd.questions.items() for q_key in q_keys)
+
+
+def test_invalid_samples(index):
+    for kwargs in ({}, {'fraction': 0.1, 'per_source': 1}, {'fraction': 0}, {'fraction': 1.5}, {'fraction': 0.1, 'sources': ['cord']}):
+        with pytest.raises(ValueError):
+            index.sample(**kwargs)
+
+
+def test_subset_round_trip(tmp_path, index):
+    subset = index.sample(per_source=4, seed=1, sources=['sroie', 'docvqa'])
+    path = str(tmp_path / 'subset.json')
+    subset.save(path)
+    loaded = Subset.load(path)
+    assert loaded.questions == subset.questions
+    assert loaded.fingerprint == subset.fingerprint
+    assert (loaded.num_documents, loaded.params) == (subset.num_documents, subset.params)
+    assert loaded.index_fingerprint == subset.index_fingerprint == index.fingerprint
+    assert loaded.params['sources'] == ['docvqa', 'sroie']
+
+
+def test_load_subset(tmp_path, documents, index):
+    args = Namespace(subset=None, sample_fraction=None, sample_per_source=None, sample_seed=0, question_index=str(tmp_path / 'question_index.json'))
+    assert load_subset(args, documents) is None
+
+    args.sample_per_source = 2
+    subset = load_subset(args, documents)
+    assert subset.fingerprint == index.sample(per_source=2).fingerprint
+
+    args.subset = str(tmp_path / 'subset.json')
+    subset.save(args.subset)
+    assert load_subset(args, documents).fingerprint == subset.fingerprint
+    with pytest.raises(ValueError):
+        load_subset(args, documents[:-1])
+    # Same number of documents, in another order
+    with pytest.raises(ValueError, match="another split"):
+        load_subset(args, documents[1:] + documents[:1])
+
+    # Subsets saved without the fingerprint of their index only check the size
+    Subset(subset.questions, subset.num_documents).save(args.subset)
+    assert load_subset(args, documents[1:] + documents[:1]).fingerprint == subset.fingerprint
@@ -0,0 +1,114 @@
+import json
+import random
+from collections import defaultdict
+
+import pytest
+
+from dataset import utils
+
+MetricsAccumulator = utils.MetricsAccumulator
+QuantileSketch = utils.QuantileSketch
+RunningStats = utils.RunningStats
+
+
+def _questions(seed: int = 0, n: int = 500):
+    # (source, metrics) of processed questions, None for skipped ones
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(n):
+        source = rng.choice(['docvqa', 'funsd', 'sroie'])
+        if rng.random() < 0.1:
+            questions.append((source, None))
+            continue
+        iou = rng.random()
+        questions.append((source, {
+            'iou': iou,
+            'center_distance': rng.random(),
+            'iou_05': float(iou >= 0.5),
+            'iou_075': float(iou >= 0.75),
+            'anls': rng.random(),
+        }))
+    return questions
+
+
+def _accumulate(questions, **kwargs) -> MetricsAccumulator:
+    accumulator = MetricsAccumulator(**kwargs)
+    for source, metrics in questions:
+        accumulator.add_question(source)
+        if metrics is not None:
+            accumulator.add(source, metrics)
+    return accumulator
+
+
+def _assert_same_report(report, expected):
+    assert report.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            _assert_same_report(report[key], value)
+        else:
+            assert report[key] == pytest.approx(value, rel=1e-12), key
+
+
+def test_report_matches_compute_mean_metrics():
+    questions = _questions()
+    metrics_per_source = defaultdict(lambda: defaultdict(list))
+    questions_per_source = defaultdict(int)
+    processed_per_source = defaultdict(int)
+    for source, metrics in questions:
+        questions_per_source[source] += 1
+        if metrics is not None:
+            processed_per_source[source] += 1
+            for key, value in metrics.items():
+                metrics_per_source[source][key].append(value)
+
+    expected = utils.compute_mean_metrics(metrics_per_source, questions_per_source, processed_per_source)
+    _assert_same_report(_accumulate(questions).report(), expected)
+
+
+def test_merged_shards_match_a_single_pass():
+    questions = _questions(n=600)
+    shards = [_accumulate(questions[i::3], quantiles=True) for i in range(3)]
+    merged = shards[0].merge(shards[1]).merge(shards[2])
+    _assert_same_report(merged.report(), _accumulate(questions, quantiles=True).report())
+
+
+def test_json_round_trip(tmp_path):
+    accumulator = _accumulate(_questions(), quantiles=True)
+    path = tmp_path / 'metrics.json'
+    accumulator.save(str(path))
+    assert MetricsAccumulator.load(str(path)).report() == accumulator.report()
+
+    stats = RunningStats()
+    assert RunningStats.from_dict(json.loads(json.dumps(stats.to_dict()))).count == 0
+
+
+def test_running_stats_merge():
+    rng = random.Random(1)
+    values = [rng.uniform(-1e6, 1e6) for _ in range(1000)]
+    left, right, whole = RunningStats(), RunningStats(), RunningStats()
+    for i, value in enumerate(values):
+        (left if i % 2 else right).add(value)
+        whole.add(value)
+    left.merge(right)
+
+    assert left.count == whole.count
+    assert left.mean == pytest.approx(whole.mean, rel=1e-12)
+    assert left.variance == pytest.approx(whole.variance, rel=1e-9)
+    assert (left.min, left.max) == (min(values), max(values))
+
+
+def test_quantile_sketch():
+    sketch = QuantileSketch(num_bins=10)
+    assert sketch.quantile(0.5) is None
+    for value in (0.05, 0.15, 0.25, 0.35, 2.0):
+        sketch.add(value)
+    # Bin midpoints, out of range values clamped to the last bin
+    assert sketch.quantile(0.5) == pytest.approx(0.25)
+    assert sketch.quantile(1.0) == pytest.approx(0.95)
+
+    other = QuantileSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+    assert other.counts == sketch.counts
+    other.merge(sketch)
+    assert sum(other.counts) == 10
+    with pytest.raises(ValueError):
+        other.merge(QuantileSketch(num_bins=20))
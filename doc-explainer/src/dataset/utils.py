@@ -1,15 +1,24 @@
 from typing import List
 from collections import defaultdict
-from typing import Dict, List 
+from typing import Any, Dict, List, Optional
 from statistics import mean
 from PIL import Image, ImageDraw, ImageFont
 
+import json
+import math
+
+from doc_explainer.boxes import PIXELS, BoxArray
+
 def convert_to_xyxy(box: List[int]) -> List[int]:
     """Convert from [left, top, width, height] to [x1, y1, x2, y2]"""
     if not box or len(box) != 4:
         return [0, 0, 0, 0] 
-    w, h, x1, y1 = box
-    return [x1, y1, x1 + w, y1 + h]
+    return BoxArray(box, format="whxy").to_format("xyxy").tolist()[0]
+
+def _location_boxes(boxes: List[List[int]]) -> BoxArray:
+    # Malformed boxes count as [0, 0, 0, 0], like `convert_to_xyxy`
+    boxes = [b if b and len(b) == 4 else [0, 0, 0, 0] for b in boxes]
+    return BoxArray(boxes, format="whxy")
 
 def union_boxes(boxes: List[List[int]]) -> List[int]:
     """Returns the union of all [left, top, width, height] boxes as [x1, y1, x2, y2]"""
@@ -17,28 +26,15 @@ def union_boxes(boxes: List[List[int]]) -> List[int]:
         return [0, 0, 0, 0]
     
     try:
-        boxes_xyxy = [convert_to_xyxy(b) for b in boxes]
-        x1 = min(b[0] for b in boxes_xyxy)
-        y1 = min(b[1] for b in boxes_xyxy)
-        x2 = max(b[2] for b in boxes_xyxy)
-        y2 = max(b[3] for b in boxes_xyxy)
-    except Exception:
+        return _location_boxes(boxes).union().tolist()[0]
+    except (TypeError, ValueError):
         return [0, 0, 0, 0]  # Fallback for corrupted box data
 
-    return [x1, y1, x2, y2]
-
 def scaledown_bbox(bbox: List[int], scale_factor: float = 1000.0):
     if len(bbox) != 4 or scale_factor == 0:
         return [0.0, 0.0, 0.0, 0.0]
 
-    x1, y1, x2, y2 = bbox
-    
-    return [
-        x1 / scale_factor, 
-        y1 / scale_factor, 
-        x2 / scale_factor, 
-        y2 / scale_factor
-    ]
+    return BoxArray(bbox, scale=scale_factor).to_scale(1).tolist()[0]
 
 
 def scale_bbox_to_image(
@@ -50,18 +46,13 @@ def scale_bbox_to_image(
     if len(bbox) != 4 or len(img_size) != 2 or scale_factor == 0:
         return [0, 0, 0, 0]
     
-    x1, y1, x2, y2 = bbox
     img_w, img_h = img_size
 
     if img_w <= 0 or img_h <= 0:
         return [0, 0, 0, 0]
 
-    x1_scaled = int((x1 / scale_factor) * img_w)
-    y1_scaled = int((y1 / scale_factor) * img_h)
-    x2_scaled = int((x2 / scale_factor) * img_w)
-    y2_scaled = int((y2 / scale_factor) * img_h)
-
-    return [x1_scaled, y1_scaled, x2_scaled, y2_scaled]
+    box = BoxArray(bbox, scale=scale_factor).to_scale(PIXELS, (img_w, img_h))
+    return box.astype(int).tolist()[0]
 
     
 
@@ -70,11 +61,11 @@ def save_bbox(image: Image, locations: list[List[int]], question: str, gt_answer
     draw = ImageDraw.Draw(image_with_boxes)
 
     # Draw individual GT boxes (blue)
-    for box in locations:
-        # Convert each word box from [left, top, w, h] to [x1,y1,x2,y2]
-        box = convert_to_xyxy(box)
-        box = scale_bbox_to_image(box, image.size)
-        draw.rectangle(box, outline="blue", width=2)
+    # Convert all word boxes from [left, top, w, h] to pixel [x1,y1,x2,y2] at once
+    if locations and image.width > 0 and image.height > 0:
+        boxes = _location_boxes(locations).to_format("xyxy").to_scale(PIXELS, image.size)
+        for box in boxes.astype(int).tolist():
+            draw.rectangle(box, outline="blue", width=2)
 
     # Draw union GT box (green)
     box_gt = union_boxes(locations)
@@ -174,7 +165,16 @@ def compute_mean_metrics(metrics_per_source: Dict[str, Dict[str, List[float]]],
         'micro_averages': micro_averages
     }
     
-    results['success_rate_per_source'] = {}
+    results.update(compute_success_rates(questions_per_source, processed_per_source))
+    
+    return results
+
+
+def compute_success_rates(questions_per_source: Dict[str, int], processed_per_source: Dict[str, int]) -> Dict:
+    """
+    Compute the per-source and overall share of questions that produced a usable prediction.
+    """
+    results = {'success_rate_per_source': {}}
     
     for source in questions_per_source:
         total = questions_per_source[source]
@@ -195,5 +195,311 @@ def compute_mean_metrics(metrics_per_source: Dict[str, Dict[str, List[float]]],
     results['skipped_predictions'] = total_questions - processed_predictions
     results['overall_success_rate'] = round(processed_predictions / total_questions, 4) if total_questions > 0 else 0.0
 
+    return results
+
+
+class QuantileSketch:
+    """
+    Fixed-size histogram over [low, high] used to estimate quantiles in constant memory.
     
-    return results
\ No newline at end of file
+    Values outside the range are clamped to the first/last bin. Two sketches with the
+    same range and number of bins can be merged by adding their counts, so the
+    estimate does not depend on how the values were split across workers.
+    """
+
+    def __init__(self, num_bins: int = 1000, low: float = 0.0, high: float = 1.0):
+        if num_bins <= 0 or high <= low:
+            raise ValueError(f"Invalid sketch range [{low}, {high}] with {num_bins} bins")
+        self.num_bins = num_bins
+        self.low = low
+        self.high = high
+        self.counts = [0] * num_bins
+
+    def add(self, value: float) -> None:
+        position = (value - self.low) / (self.high - self.low)
+        index = min(self.num_bins - 1, max(0, int(position * self.num_bins)))
+        self.counts[index] += 1
+
+    def merge(self, other: "QuantileSketch") -> None:
+        if (other.num_bins, other.low, other.high) != (self.num_bins, self.low, self.high):
+            raise ValueError("Cannot merge quantile sketches with different bins")
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return the midpoint of the bin holding the q-th quantile (None if empty)."""
+        total = sum(self.counts)
+        if total == 0:
+            return None
+        
+        rank = q * (total - 1)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen > rank:
+                width = (self.high - self.low) / self.num_bins
+                return self.low + (i + 0.5) * width
+        return self.high
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Store sparse counts, most bins are empty for IoU/ANLS distributions
+        return {
+            'num_bins': self.num_bins,
+            'low': self.low,
+            'high': self.high,
+            'counts': {str(i): c for i, c in enumerate(self.counts) if c},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuantileSketch":
+        sketch = cls(data['num_bins'], data['low'], data['high'])
+        for i, count in data['counts'].items():
+            sketch.counts[int(i)] = count
+        return sketch
+
+
+class RunningStats:
+    """
+    Online count / mean / variance / min / max of a stream of values.
+
+    The sum is accumulated with Neumaier compensation so the mean stays within
+    rounding error of `statistics.mean` over the same values, and the variance uses
+    the Welford/Chan update so that partial results can be merged exactly.
+    """
+
+    def __init__(self, sketch: Optional[QuantileSketch] = None):
+        self.count = 0
+        self._sum = 0.0
+        self._compensation = 0.0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = sketch
+
+    def _add_to_sum(self, value: float) -> None:
+        total = self._sum + value
+        if abs(self._sum) >= abs(value):
+            self._compensation += (self._sum - total) + value
+        else:
+            self._compensation += (value - total) + self._sum
+        self._sum = total
+
+    def add(self, value: float) -> None:
+        value = float(value)
+        self.count += 1
+        self._add_to_sum(value)
+        
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+        
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if self.sketch is not None:
+            self.sketch.add(value)
+
+    def merge(self, other: "RunningStats") -> None:
+        if other.count == 0:
+            return
+        
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self._mean += delta * other.count / count
+        self.count = count
+        
+        self._add_to_sum(other._sum)
+        self._compensation += other._compensation
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.sketch = QuantileSketch(other.sketch.num_bins, other.sketch.low, other.sketch.high)
+            self.sketch.merge(other.sketch)
+
+    @property
+    def mean(self) -> float:
+        if self.count == 0:
+            raise ValueError("mean requires at least one value")
+        return (self._sum + self._compensation) / self.count
+
+    @property
+    def variance(self) -> float:
+        """Sample variance, as `statistics.variance` (0.0 for fewer than two values)."""
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum': self._sum,
+            'compensation': self._compensation,
+            'mean': self._mean,
+            'm2': self._m2,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'sketch': self.sketch.to_dict() if self.sketch is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunningStats":
+        sketch = QuantileSketch.from_dict(data['sketch']) if data.get('sketch') else None
+        stats = cls(sketch)
+        stats.count = data['count']
+        stats._sum = data['sum']
+        stats._compensation = data['compensation']
+        stats._mean = data['mean']
+        stats._m2 = data['m2']
+        stats.min = data['min'] if data['min'] is not None else math.inf
+        stats.max = data['max'] if data['max'] is not None else -math.inf
+        return stats
+
+
+class MetricsAccumulator:
+    """
+    Constant-memory replacement for the `metrics_per_source` lists of the eval scripts.
+
+    Keeps one `RunningStats` per (source, metric) plus the question/processed counters,
+    can be merged across shards and saved to JSON. `report()` returns the same layout
+    as `compute_mean_metrics`.
+
+    Example:
+        accumulator = MetricsAccumulator()
+        accumulator.add_question(source)
+        accumulator.add(source, {'iou': iou, 'anls': anls, ...})
+        results = accumulator.report()
+    """
+
+    QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+    def __init__(self, metric_keys: Optional[List[str]] = None, quantiles: bool = False, sketch_bins: int = 1000):
+        self.metric_keys = list(metric_keys or METRIC_KEYS)
+        self.quantiles = quantiles
+        self.sketch_bins = sketch_bins
+        self.stats: Dict[str, Dict[str, RunningStats]] = {}
+        self.questions_per_source: Dict[str, int] = defaultdict(int)
+        self.processed_per_source: Dict[str, int] = defaultdict(int)
+
+    def _new_stats(self) -> RunningStats:
+        sketch = QuantileSketch(self.sketch_bins) if self.quantiles else None
+        return RunningStats(sketch)
+
+    def add_question(self, source: str) -> None:
+        """Count a question of `source`, whether or not it ends up processed."""
+        self.questions_per_source[source] += 1
+
+    def add(self, source: str, metrics: Dict[str, float]) -> None:
+        """Record the metrics of one processed question of `source`."""
+        self.processed_per_source[source] += 1
+        
+        source_stats = self.stats.get(source)
+        if source_stats is None:
+            source_stats = {key: self._new_stats() for key in self.metric_keys}
+            self.stats[source] = source_stats
+        
+        for key, value in metrics.items():
+            if key not in source_stats:
+                source_stats[key] = self._new_stats()
+            source_stats[key].add(value)
+
+    def merge(self, other: "MetricsAccumulator") -> "MetricsAccumulator":
+        """Merge the results of another shard into this accumulator (in place)."""
+        for source, other_stats in other.stats.items():
+            source_stats = self.stats.setdefault(source, {})
+            for key, stats in other_stats.items():
+                if key not in source_stats:
+                    source_stats[key] = RunningStats()
+                    if key not in self.metric_keys:
+                        self.metric_keys.append(key)
+                source_stats[key].merge(stats)
+        
+        for source, count in other.questions_per_source.items():
+            self.questions_per_source[source] += count
+        for source, count in other.processed_per_source.items():
+            self.processed_per_source[source] += count
+        return self
+
+    def report(self) -> Dict:
+        """
+        Compute per-source, macro-average, and micro-average metrics.
+        
+        Returns:
+            Same dictionary layout as `compute_mean_metrics`.
+        """
+        mean_metrics_per_source = {}
+        overall_stats = defaultdict(RunningStats)
+        per_metric_means = defaultdict(list)
+
+        for source, source_stats in self.stats.items():
+            first_key = next(iter(source_stats), None)
+            source_metrics = {
+                'elements': source_stats[first_key].count if first_key else 0
+            }
+            
+            for key, stats in source_stats.items():
+                if stats.count:
+                    key_mean = stats.mean
+                    source_metrics[f'mean_{key}'] = key_mean
+                    if stats.sketch is not None:
+                        source_metrics[f'quantiles_{key}'] = {
+                            f'p{int(q * 100)}': stats.sketch.quantile(q) for q in self.QUANTILES
+                        }
+                    
+                    per_metric_means[key].append(key_mean)
+                    overall_stats[key].merge(stats)
+            
+            mean_metrics_per_source[source] = source_metrics
+        
+        # Compute macro averages (equal weight per source)
+        macro_averages = {'num_sources': len(mean_metrics_per_source)}
+        for key, values in per_metric_means.items():
+            macro_averages[f'overall_macro_mean_{key}'] = mean(values)
+        
+        # Compute micro averages (equal weight per data point)
+        micro_averages = {}
+        for key, stats in overall_stats.items():
+            micro_averages[f'overall_micro_mean_{key}'] = stats.mean
+            micro_averages[f'total_{key}_values'] = stats.count
+        
+        results = {
+            'per_source_metrics': mean_metrics_per_source,
+            'macro_averages': macro_averages,
+            'micro_averages': micro_averages
+        }
+        results.update(compute_success_rates(self.questions_per_source, self.processed_per_source))
+        
+        return results
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'metric_keys': self.metric_keys,
+            'quantiles': self.quantiles,
+            'sketch_bins': self.sketch_bins,
+            'stats': {
+                source: {key: stats.to_dict() for key, stats in source_stats.items()}
+                for source, source_stats in self.stats.items()
+            },
+            'questions_per_source': dict(self.questions_per_source),
+            'processed_per_source': dict(self.processed_per_source),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MetricsAccumulator":
+        accumulator = cls(data['metric_keys'], data['quantiles'], data['sketch_bins'])
+        accumulator.stats = {
+            source: {key: RunningStats.from_dict(stats) for key, stats in source_stats.items()}
+            for source, source_stats in data['stats'].items()
+        }
+        accumulator.questions_per_source.update(data['questions_per_source'])
+        accumulator.processed_per_source.update(data['processed_per_source'])
+        return accumulator
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "MetricsAccumulator":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
@@ -1,4 +1,24 @@
-from .model import DocExplainer
-from .type import ExplainableAnswer
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .model import DocExplainer
+    from .type import ExplainableAnswer
 
 __all__ = ["DocExplainer", "ExplainableAnswer"]
+
+# Imported on first access, so that `import doc_explainer` and its lightweight
+# modules (metrics, anls, type...) do not import torch and the VLM backends
+_LAZY_ATTRIBUTES = {"DocExplainer": ".model", "ExplainableAnswer": ".type"}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
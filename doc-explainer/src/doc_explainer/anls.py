@@ -0,0 +1,196 @@
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional, Tuple
+
+# ANLS threshold, 0.5 is the standard value
+ANLS_THRESHOLD = 0.5
+
+# Number of normalized answers kept in memory; ground truths repeat a lot
+# across questions (FATURA, VRDU), so most lookups are hits.
+NORMALIZE_CACHE_SIZE = 65536
+
+Leaf = (str, float, int, bool)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE, typed=True)
+def normalize_answer(value: Any) -> str:
+    """
+    Normalize an answer the same way as ANLS*: lowercase and collapse whitespace.
+    """
+    return " ".join(str(value).strip().lower().split())
+
+
+def levenshtein_distance(s1: str, s2: str, max_distance: Optional[int] = None) -> int:
+    """
+    Compute the Levenshtein distance between two strings.
+
+    Args:
+        s1: First string.
+        s2: Second string.
+        max_distance: If given, stop as soon as the distance is known to be larger
+            and return `max_distance + 1`.
+
+    Returns:
+        int: The edit distance, or `max_distance + 1` if it exceeds `max_distance`.
+    """
+    if s1 == s2:
+        return 0
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+
+    # Common prefix and suffix do not change the distance
+    start = 0
+    while start < len(s1) and s1[start] == s2[start]:
+        start += 1
+    end = 0
+    while end < len(s1) - start and s1[-1 - end] == s2[-1 - end]:
+        end += 1
+    s1 = s1[start : len(s1) - end]
+    s2 = s2[start : len(s2) - end]
+
+    if max_distance is not None and len(s2) - len(s1) > max_distance:
+        return max_distance + 1
+    if not s1:
+        return len(s2)
+
+    distances = list(range(len(s1) + 1))
+    for i2, c2 in enumerate(s2):
+        distances_ = [i2 + 1]
+        for i1, c1 in enumerate(s1):
+            if c1 == c2:
+                distances_.append(distances[i1])
+            else:
+                distances_.append(
+                    1 + min(distances[i1], distances[i1 + 1], distances_[-1])
+                )
+        # Row minima never decrease, so the threshold can no longer be met
+        if max_distance is not None and min(distances_) > max_distance:
+            return max_distance + 1
+        distances = distances_
+    return distances[-1]
+
+
+def _max_distance(length: int, threshold: float) -> int:
+    # Largest distance d such that 1 - d / length >= threshold, computed with the
+    # same float expression as the score to avoid off-by-one at the boundary.
+    d = int((1 - threshold) * length)
+    while d >= 0 and 1 - d / length < threshold:
+        d -= 1
+    while d + 1 <= length and 1 - (d + 1) / length >= threshold:
+        d += 1
+    return d
+
+
+def _leaf_anls(prediction: Any, ground_truth: Any, threshold: float) -> float:
+    this_str = normalize_answer(ground_truth)
+    other_str = normalize_answer(prediction)
+
+    str_length = max(len(this_str), len(other_str))
+    if str_length == 0:
+        return 1.0
+
+    max_distance = _max_distance(str_length, threshold)
+    if max_distance < 0:
+        return 0.0
+
+    dist = levenshtein_distance(this_str, other_str, max_distance)
+    if dist > max_distance:
+        return 0.0
+    return 1 - float(dist) / float(str_length)
+
+
+def _is_none(value: Any) -> bool:
+    return value in (None, {}, [], "")
+
+
+def _structure_anls(prediction: Any, ground_truth: Any) -> float:
+    # Lists against lists and dicts against dicts (e.g. a JSON answer of the VLM)
+    # are matched element-wise by ANLS* itself
+    try:
+        from anls_star import anls_score
+    except ImportError as error:
+        raise ImportError(
+            "Scoring list and dict answers requires the anls_star package"
+        ) from error
+    return anls_score(ground_truth, prediction)
+
+
+def compute_anls(
+    prediction: Any, ground_truth: Any, threshold: float = ANLS_THRESHOLD
+) -> float:
+    """
+    Compute the ANLS between a predicted answer and its ground truth.
+
+    Gives the same score as `anls_star.anls_score(ground_truth, prediction)` for
+    plain answers: strings, numbers, None, and a list/tuple of accepted options
+    against a single answer. Nested structures (dicts, lists against lists) are
+    scored by `anls_star` itself, with its default threshold.
+
+    Args:
+        prediction: The predicted answer.
+        ground_truth: The expected answer.
+        threshold: Similarity below which the score is 0.
+
+    Returns:
+        float: ANLS score in [0, 1].
+    """
+    if ground_truth is None:
+        return 1.0 if _is_none(prediction) else 0.0
+
+    if isinstance(ground_truth, (list, tuple)):
+        if isinstance(prediction, (list, tuple, dict)):
+            return _structure_anls(prediction, ground_truth)
+        if isinstance(ground_truth, list) and not (
+            isinstance(prediction, str)
+            and all(isinstance(x, str) for x in ground_truth)
+        ):
+            # A list only counts as a set of options against a string prediction
+            return 0.0
+        if not ground_truth:
+            raise ValueError("Expected at least 1 valid ground truth option")
+        return max(compute_anls(prediction, gt, threshold) for gt in ground_truth)
+
+    if isinstance(ground_truth, dict):
+        if isinstance(prediction, dict):
+            return _structure_anls(prediction, ground_truth)
+        return 0.0
+
+    if not isinstance(ground_truth, Leaf):
+        raise ValueError(f"Unsupported ground truth type {type(ground_truth)}")
+    if not isinstance(prediction, Leaf):
+        return 0.0
+
+    return _leaf_anls(prediction, ground_truth, threshold)
+
+
+def batch_anls(
+    pairs: Iterable[Tuple[Any, Any]], threshold: float = ANLS_THRESHOLD
+) -> List[float]:
+    """
+    Score a list of (prediction, ground_truth) pairs.
+
+    Identical pairs are only scored once, and normalized strings are shared
+    through the `normalize_answer` cache.
+
+    Args:
+        pairs: Iterable of (prediction, ground_truth) pairs.
+        threshold: Similarity below which the score is 0.
+
+    Returns:
+        List[float]: ANLS score of each pair, in input order.
+    """
+    scores = []
+    seen = {}
+    for prediction, ground_truth in pairs:
+        try:
+            # Types are part of the key: 1, 1.0 and True normalize differently
+            key = (type(prediction), prediction, type(ground_truth), ground_truth)
+            score = seen.get(key)
+        except TypeError:  # unhashable (list) answers
+            key, score = None, None
+
+        if score is None:
+            score = compute_anls(prediction, ground_truth, threshold)
+            if key is not None:
+                seen[key] = score
+        scores.append(score)
+    return scores
@@ -0,0 +1,247 @@
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Box layouts found across the project:
+#   xyxy: [x0, y0, x1, y1] (metrics, DocExplainer predictions)
+#   xywh: [left, top, width, height] (Textract / OCRProcessor words, VLM "position")
+#   whxy: [width, height, left, top] (BoundingDocs answer "location")
+BOX_FORMATS = ("xyxy", "xywh", "whxy")
+
+# Scale of the coordinates: a normalization factor (1 or 1000) or pixels
+PIXELS = "pixels"
+Scale = Union[float, str]
+
+
+def _axis_factors(image_size: Tuple[int, int]) -> np.ndarray:
+    # Every supported layout alternates horizontal and vertical values
+    width, height = image_size
+    return np.array([width, height, width, height], dtype=np.float64)
+
+
+class BoxArray:
+    """
+    An (N, 4) array of boxes tagged with its layout and scale.
+
+    Conversions are vectorized over all the boxes and return `self` when nothing
+    has to change; indexing with an int or a slice returns a view sharing the
+    same memory. Integer coordinates stay integers through format conversions and
+    unions, so 0-1000 boxes round-trip exactly.
+
+    Example:
+        gt = BoxArray(locations, format="whxy", scale=1000)
+        bbox_gt = gt.union().to_scale(1).tolist()[0]
+
+    Attributes:
+        data (np.ndarray): Coordinates, shape (N, 4).
+        format (str): One of `BOX_FORMATS`.
+        scale (Scale): 1, 1000 or "pixels".
+        image_size (Optional[Tuple[int, int]]): (width, height), required when the
+            scale is "pixels".
+    """
+
+    __slots__ = ("data", "format", "scale", "image_size")
+
+    def __init__(
+        self,
+        data: Any,
+        format: str = "xyxy",
+        scale: Scale = 1000,
+        image_size: Optional[Tuple[int, int]] = None,
+    ):
+        if format not in BOX_FORMATS:
+            raise ValueError(f"Unsupported box format: {format}")
+        if scale == PIXELS and image_size is None:
+            raise ValueError("Pixel boxes require the image size")
+
+        data = np.asarray(data)
+        if data.size == 0:
+            data = data.reshape(0, 4)
+        elif data.ndim == 1:
+            data = data.reshape(1, -1)
+        if data.ndim != 2 or data.shape[1] != 4:
+            raise ValueError(f"Expected boxes of shape (N, 4), got {data.shape}")
+        if not np.issubdtype(data.dtype, np.number):
+            raise ValueError(f"Expected numeric boxes, got {data.dtype}")
+
+        self.data = data
+        self.format = format
+        self.scale = scale
+        self.image_size = image_size
+
+    def _like(self, data: np.ndarray, **kwargs) -> "BoxArray":
+        attributes = {
+            "format": self.format,
+            "scale": self.scale,
+            "image_size": self.image_size,
+        }
+        attributes.update(kwargs)
+        return BoxArray(data, **attributes)
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def __getitem__(self, index: Union[int, slice, np.ndarray]) -> "BoxArray":
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 if index != -1 else None)
+        return self._like(self.data[index])
+
+    def __repr__(self) -> str:
+        return f"BoxArray({self.data.tolist()}, format={self.format!r}, scale={self.scale!r})"
+
+    def tolist(self) -> List[List[Union[int, float]]]:
+        return self.data.tolist()
+
+    def astype(self, dtype: Any) -> "BoxArray":
+        """Cast the coordinates, truncating towards zero for integer types."""
+        return self._like(self.data.astype(dtype))
+
+    def to_format(self, format: str) -> "BoxArray":
+        """Convert the boxes to another layout."""
+        if format == self.format:
+            return self
+        if format not in BOX_FORMATS:
+            raise ValueError(f"Unsupported box format: {format}")
+
+        d = self.data
+        if self.format == "xyxy":
+            x0, y0, x1, y1 = d[:, 0], d[:, 1], d[:, 2], d[:, 3]
+            w, h = x1 - x0, y1 - y0
+        elif self.format == "xywh":
+            x0, y0, w, h = d[:, 0], d[:, 1], d[:, 2], d[:, 3]
+            x1, y1 = x0 + w, y0 + h
+        else:
+            w, h, x0, y0 = d[:, 0], d[:, 1], d[:, 2], d[:, 3]
+            x1, y1 = x0 + w, y0 + h
+
+        if format == "xyxy":
+            columns = (x0, y0, x1, y1)
+        elif format == "xywh":
+            columns = (x0, y0, w, h)
+        else:
+            columns = (w, h, x0, y0)
+        return self._like(np.stack(columns, axis=1), format=format)
+
+    def to_scale(
+        self, scale: Scale, image_size: Optional[Tuple[int, int]] = None
+    ) -> "BoxArray":
+        """
+        Rescale the boxes.
+
+        Args:
+            scale: Target scale, 1, 1000 or "pixels".
+            image_size: (width, height) of the image, required to convert to
+                pixels (defaults to the current image size).
+        """
+        image_size = image_size or self.image_size
+        if scale == self.scale and (scale != PIXELS or image_size == self.image_size):
+            return self
+
+        if self.scale == PIXELS:
+            normalized = self.data / _axis_factors(self.image_size)
+        else:
+            normalized = self.data / self.scale
+
+        if scale == PIXELS:
+            if image_size is None:
+                raise ValueError("Converting to pixels requires the image size")
+            return self._like(
+                normalized * _axis_factors(image_size),
+                scale=PIXELS,
+                image_size=image_size,
+            )
+        return self._like(normalized * scale, scale=scale, image_size=None)
+
+    def union(self) -> "BoxArray":
+        """Return the smallest xyxy box enclosing all the boxes, shape (1, 4)."""
+        if len(self) == 0:
+            raise ValueError("Cannot compute the union of zero boxes")
+        d = self.to_format("xyxy").data
+        union = np.array(
+            [d[:, 0].min(), d[:, 1].min(), d[:, 2].max(), d[:, 3].max()],
+            dtype=d.dtype,
+        )
+        return self._like(union, format="xyxy")
+
+    def areas(self) -> np.ndarray:
+        d = self.to_format("xyxy").data
+        return np.maximum(0, d[:, 2] - d[:, 0]) * np.maximum(0, d[:, 3] - d[:, 1])
+
+
+class WordTable:
+    """
+    Column-oriented OCR words: page numbers, texts and a `BoxArray`.
+
+    Replaces lists of {"page", "text", "bbox"} dicts. It still behaves like that
+    list where needed: `len`, iteration and integer indexing produce the same
+    dicts, and slicing returns a table viewing the same arrays.
+
+    Attributes:
+        pages (np.ndarray): Page number of each word, shape (N,).
+        texts (List[str]): Text of each word.
+        boxes (BoxArray): Box of each word.
+    """
+
+    __slots__ = ("pages", "texts", "boxes")
+
+    def __init__(self, pages: Any, texts: Sequence[str], boxes: BoxArray):
+        self.pages = np.asarray(pages, dtype=np.int32).reshape(-1)
+        self.texts = list(texts)
+        self.boxes = boxes
+        if not len(self.pages) == len(self.texts) == len(self.boxes):
+            raise ValueError("Pages, texts and boxes must have the same length")
+
+    @classmethod
+    def from_words(
+        cls,
+        words: Sequence[Dict[str, Any]],
+        format: str = "xywh",
+        scale: Scale = 1000,
+    ) -> "WordTable":
+        """Build a table from `OCRProcessor.extract_words_and_bboxes`-style dicts."""
+        if isinstance(words, WordTable):
+            return words
+        pages = [w.get("page", 1) for w in words]
+        texts = [w.get("text", "") for w in words]
+        boxes = BoxArray([w["bbox"] for w in words], format=format, scale=scale)
+        return cls(pages, texts, boxes)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def _word(self, index: int) -> Dict[str, Any]:
+        return {
+            "page": int(self.pages[index]),
+            "text": self.texts[index],
+            "bbox": self.boxes.data[index].tolist(),
+        }
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return WordTable(self.pages[index], self.texts[index], self.boxes[index])
+        return self._word(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self._word(i)
+
+    def to_words(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+    def page(self, page: int) -> "WordTable":
+        """
+        Return the words of a page.
+
+        OCR output is ordered by page, so this is usually a view; words that are
+        not contiguous are copied.
+        """
+        ids = np.flatnonzero(self.pages == page)
+        if len(ids) == 0:
+            return self[0:0]
+        if ids[-1] - ids[0] + 1 == len(ids):
+            return self[int(ids[0]) : int(ids[-1]) + 1]
+        return WordTable(
+            self.pages[ids],
+            [self.texts[i] for i in ids.tolist()],
+            self.boxes[ids],
+        )
@@ -0,0 +1,191 @@
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from pydantic import BaseModel
+
+from .boxes import WordTable
+from .spatial import Word
+
+# Minimum SequenceMatcher ratio for a match
+FUZZY_THRESHOLD = 0.6
+
+
+class FuzzyMatch(BaseModel):
+    """
+    Best fuzzy match of an answer among the OCR words of a page.
+
+    Attributes:
+        page (int): Page of the match (same numbering as the OCR words).
+        score (float): SequenceMatcher ratio between the answer and the matched text.
+        bbox (List[float]): Union box of the matched words [x0, y0, x1, y1].
+        word_ids (List[int]): Ids of the matched (consecutive) words.
+        text (str): The matched text.
+    """
+
+    page: int
+    score: float
+    bbox: List[float]
+    word_ids: List[int]
+    text: str
+
+
+class _Entries:
+    """
+    Deduplicated candidate texts of one page with a character inverted index.
+
+    Each entry is a single OCR word (or a span of consecutive words), lowercased
+    and stripped. Identical texts are stored once with their first word id, which
+    is the one a linear scan would return.
+    """
+
+    def __init__(self, spans: List[Tuple[str, List[int]]]):
+        self.texts: List[str] = []
+        self.word_ids: List[List[int]] = []
+        first_entry: Dict[str, int] = {}
+        for text, ids in spans:
+            if text in first_entry:
+                continue
+            first_entry[text] = len(self.texts)
+            self.texts.append(text)
+            self.word_ids.append(ids)
+
+        self.lengths = np.array([len(t) for t in self.texts], dtype=np.int64)
+        self.order = np.array([ids[0] for ids in self.word_ids], dtype=np.int64)
+
+        postings: Dict[str, Tuple[List[int], List[int]]] = defaultdict(lambda: ([], []))
+        for entry_id, text in enumerate(self.texts):
+            for char, count in Counter(text).items():
+                postings[char][0].append(entry_id)
+                postings[char][1].append(count)
+        self.postings = {
+            char: (np.array(ids, dtype=np.int64), np.array(counts, dtype=np.int64))
+            for char, (ids, counts) in postings.items()
+        }
+
+    def upper_bounds(self, target: str) -> np.ndarray:
+        # SequenceMatcher.quick_ratio for every entry: matching characters are
+        # bounded by the size of the multiset intersection of the two strings.
+        common = np.zeros(len(self.texts), dtype=np.int64)
+        for char, count in Counter(target).items():
+            posting = self.postings.get(char)
+            if posting is not None:
+                ids, counts = posting
+                common[ids] += np.minimum(counts, count)
+        total = len(target) + self.lengths
+        return np.divide(2.0 * common, total, out=np.ones(len(total)), where=total > 0)
+
+
+class FuzzyMatcher:
+    """
+    Fuzzy answer-to-OCR matcher built once per document.
+
+    Returns the same match as scanning every word of the page with
+    `difflib.SequenceMatcher` and keeping the first best ratio above the
+    threshold, but only runs SequenceMatcher on the few candidates whose
+    character-count upper bound can still beat the best score found so far.
+
+    Example:
+        matcher = FuzzyMatcher(words_ocr)
+        match = matcher.match("INV-0042", page=1)
+        match_span = matcher.match("Total amount due", page=1, max_span=3)
+
+    Attributes:
+        words (WordTable): The OCR words.
+        threshold (float): Minimum ratio for a match.
+    """
+
+    def __init__(
+        self,
+        words: Union[Sequence[Word], WordTable],
+        threshold: float = FUZZY_THRESHOLD,
+    ):
+        self.words = WordTable.from_words(words)
+        self.threshold = threshold
+
+        self._page_words: Dict[int, List[int]] = defaultdict(list)
+        for word_id, page in enumerate(self.words.pages.tolist()):
+            self._page_words[page].append(word_id)
+        self._texts = [str(text).strip().lower() for text in self.words.texts]
+
+        self._entries: Dict[Tuple[int, int], _Entries] = {}
+
+    def _page_entries(self, page: int, span: int) -> Optional[_Entries]:
+        key = (page, span)
+        if key not in self._entries:
+            word_ids = self._page_words.get(page)
+            if not word_ids or len(word_ids) < span:
+                return None
+            spans = [
+                (
+                    " ".join(self._texts[i] for i in word_ids[start : start + span]),
+                    word_ids[start : start + span],
+                )
+                for start in range(len(word_ids) - span + 1)
+            ]
+            self._entries[key] = _Entries(spans)
+        return self._entries[key]
+
+    def _best_entry(
+        self, target: str, entries: _Entries
+    ) -> Tuple[float, Optional[int]]:
+        bounds = entries.upper_bounds(target)
+        candidates = np.flatnonzero(bounds >= self.threshold)
+        # Highest bound first, then OCR order so that ties resolve like a scan
+        candidates = candidates[
+            np.lexsort((entries.order[candidates], -bounds[candidates]))
+        ]
+
+        best_score, best_entry = -1.0, None
+        for entry_id in candidates.tolist():
+            if bounds[entry_id] < best_score:
+                break
+            score = SequenceMatcher(None, target, entries.texts[entry_id]).ratio()
+            if score < self.threshold:
+                continue
+            if score > best_score or (
+                score == best_score
+                and entries.order[entry_id] < entries.order[best_entry]
+            ):
+                best_score, best_entry = score, entry_id
+        return best_score, best_entry
+
+    def _union_bbox(self, word_ids: List[int]) -> List[float]:
+        return self.words.boxes[word_ids].union().tolist()[0]
+
+    def match(
+        self, target: str | int, page: int, max_span: int = 1
+    ) -> Optional[FuzzyMatch]:
+        """
+        Find the OCR text of a page that best matches the target.
+
+        Args:
+            target: The answer to locate.
+            page: Page to search (same numbering as the OCR words).
+            max_span: Also try runs of up to `max_span` consecutive words; with
+                the default of 1, only single OCR entries are matched.
+
+        Returns:
+            Optional[FuzzyMatch]: The best match, or None if no text reaches the
+                threshold. Across span lengths, shorter spans win ties.
+        """
+        target = str(target).strip().lower()
+
+        best: Optional[FuzzyMatch] = None
+        for span in range(1, max_span + 1):
+            entries = self._page_entries(page, span)
+            if entries is None:
+                break
+            score, entry_id = self._best_entry(target, entries)
+            if entry_id is None or (best is not None and score <= best.score):
+                continue
+            word_ids = entries.word_ids[entry_id]
+            best = FuzzyMatch(
+                page=page,
+                score=score,
+                bbox=self._union_bbox(word_ids),
+                word_ids=word_ids,
+                text=entries.texts[entry_id],
+            )
+        return best
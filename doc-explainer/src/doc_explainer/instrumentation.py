@@ -0,0 +1,368 @@
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Registered hooks. Replaced (never mutated) on change, so that readers need no lock
+_hooks: Tuple["Hook", ...] = ()
+_hooks_lock = threading.Lock()
+
+# Prefix of the exported Prometheus metrics
+PROMETHEUS_PREFIX = "docexplainer"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Hook:
+    """
+    Receives the timings and counts of the instrumented code.
+
+    Subclass and override the methods you need, then register the hook with
+    `add_hook` (or the `instrument` context manager). Stages are named after
+    what they time, e.g. "generation", "json_parsing", "explainer.predict", and
+    carry labels such as the backend.
+
+    Stages and counts:
+        - generate_prediction, generate_prediction_batch, prompt_processing,
+          generation, json_parsing, image_hashing, image_encoding, api_call,
+          rate_limit_wait, backoff_sleep, batch_submit, batch_poll,
+          batch_results, prefix_prefill, image_resizing (labels: backend)
+        - docexplainer.forward, docexplainer.forward_batch, explainer.predict, snap
+        - model_load (labels: model)
+        - counts: input_tokens, output_tokens, retries, cache_hits,
+          cache_misses, batch_requests, batch_failures, image_cache_hits,
+          image_cache_misses, image_encoding_seconds_saved, image_bytes_sent,
+          prompt_cache_creation_input_tokens, prompt_cache_read_input_tokens,
+          multi_question_fallbacks, prefix_cache_hits, prefix_cache_misses,
+          prefix_tokens_reused, images_downscaled, image_tokens_saved
+          (labels: backend), model_evictions
+    """
+
+    def on_stage_start(self, stage: str, labels: Dict[str, str]) -> None:
+        pass
+
+    def on_stage_end(self, stage: str, labels: Dict[str, str], seconds: float) -> None:
+        pass
+
+    def on_count(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        pass
+
+
+def add_hook(hook: Hook) -> None:
+    """
+    Register a hook for the whole process: it receives the stages of every
+    thread, including the Claude event loop and the worker threads.
+    """
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_hook(hook: Hook) -> None:
+    global _hooks
+    with _hooks_lock:
+        _hooks = tuple(h for h in _hooks if h is not hook)
+
+
+def enabled() -> bool:
+    """Whether any hook is registered, to skip work done only for the hooks."""
+    return bool(_hooks)
+
+
+@contextmanager
+def instrument(*hooks: Hook) -> Iterator[None]:
+    """Register hooks for the duration of a block."""
+    for hook in hooks:
+        add_hook(hook)
+    try:
+        yield
+    finally:
+        for hook in hooks:
+            remove_hook(hook)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *args) -> None:
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("hooks", "name", "labels", "start")
+
+    def __init__(self, hooks: Tuple[Hook, ...], name: str, labels: Dict[str, str]):
+        self.hooks = hooks
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> None:
+        for hook in self.hooks:
+            hook.on_stage_start(self.name, self.labels)
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args) -> None:
+        seconds = time.perf_counter() - self.start
+        for hook in self.hooks:
+            hook.on_stage_end(self.name, self.labels, seconds)
+
+
+def stage(name: str, **labels: str):
+    """
+    Time a block of code.
+
+    Without registered hooks, this returns a shared no-op context manager.
+
+    Example:
+        with stage("generation", backend="smolvlm"):
+            generated_ids = model.generate(**inputs)
+    """
+    hooks = _hooks
+    if not hooks:
+        return _NULL_STAGE
+    return _Stage(hooks, name, labels)
+
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    """Add to a counter (tokens, retries...), a no-op without registered hooks."""
+    hooks = _hooks
+    if not hooks:
+        return
+    for hook in hooks:
+        hook.on_count(name, value, labels)
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsCollector(Hook):
+    """
+    Hook aggregating the stage timings and counts, exportable as JSON or in the
+    Prometheus text format.
+
+    With `track_memory=True`, the peak Python heap of every stage is recorded
+    with tracemalloc (started if needed, which slows allocations down), and the
+    peak CUDA memory of torch is exported if torch is in use. Peaks of
+    concurrent stages in several threads overlap, as tracemalloc only has one
+    global peak.
+
+    Example:
+        collector = MetricsCollector()
+        with instrument(collector):
+            explainer([image], question)
+        print(collector.to_prometheus())
+
+    Attributes:
+        track_memory (bool): Whether peak memory is tracked.
+    """
+
+    def __init__(self, track_memory: bool = False):
+        self.track_memory = track_memory
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, Labels], int] = defaultdict(int)
+        self._seconds: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._max_seconds: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._peak_bytes: Dict[Tuple[str, Labels], int] = defaultdict(int)
+        self._counts: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._local = threading.local()
+        self._started_tracemalloc = False
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def close(self) -> None:
+        """Stop tracemalloc if this collector started it."""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _peaks(self) -> List[int]:
+        if not hasattr(self._local, "peaks"):
+            self._local.peaks = []
+        return self._local.peaks
+
+    def on_stage_start(self, stage: str, labels: Dict[str, str]) -> None:
+        if not (self.track_memory and tracemalloc.is_tracing()):
+            return
+        peaks = self._peaks()
+        peak = tracemalloc.get_traced_memory()[1]
+        if peaks:
+            # The enclosing stage keeps the peak reached so far
+            peaks[-1] = max(peaks[-1], peak)
+        peaks.append(0)
+        tracemalloc.reset_peak()
+
+    def on_stage_end(self, stage: str, labels: Dict[str, str], seconds: float) -> None:
+        key = (stage, _labels(labels))
+        peak = None
+        if self.track_memory and tracemalloc.is_tracing():
+            peaks = self._peaks()
+            if peaks:
+                peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if peaks:
+                    peaks[-1] = max(peaks[-1], peak)
+        with self._lock:
+            self._calls[key] += 1
+            self._seconds[key] += seconds
+            self._max_seconds[key] = max(self._max_seconds[key], seconds)
+            if peak is not None:
+                self._peak_bytes[key] = max(self._peak_bytes[key], peak)
+
+    def on_count(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        with self._lock:
+            self._counts[(name, _labels(labels))] += value
+
+    def reset(self) -> None:
+        with self._lock:
+            for values in (
+                self._calls,
+                self._seconds,
+                self._max_seconds,
+                self._peak_bytes,
+                self._counts,
+            ):
+                values.clear()
+
+    @staticmethod
+    def _torch_peak_bytes() -> Dict[str, int]:
+        # Only look at torch if it is already in use
+        torch = sys.modules.get("torch")
+        if torch is None or not torch.cuda.is_available():
+            return {}
+        return {
+            f"cuda:{device}": torch.cuda.max_memory_allocated(device)
+            for device in range(torch.cuda.device_count())
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict with one entry per (stage, labels) in "stages" (calls, total,
+            mean and max seconds, peak_bytes when tracked), one per (counter,
+            labels) in "counters", and the process-wide peak memory in "memory".
+        """
+        with self._lock:
+            stages = [
+                {
+                    "stage": stage,
+                    "labels": dict(labels),
+                    "calls": calls,
+                    "seconds": self._seconds[(stage, labels)],
+                    "mean_seconds": self._seconds[(stage, labels)] / calls,
+                    "max_seconds": self._max_seconds[(stage, labels)],
+                    **(
+                        {"peak_bytes": self._peak_bytes[(stage, labels)]}
+                        if (stage, labels) in self._peak_bytes
+                        else {}
+                    ),
+                }
+                for (stage, labels), calls in sorted(self._calls.items())
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counts.items())
+            ]
+
+        memory: Dict[str, Any] = {}
+        if tracemalloc.is_tracing():
+            memory["python_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        torch_peaks = self._torch_peak_bytes()
+        if torch_peaks:
+            memory["torch_peak_bytes"] = torch_peaks
+        return {"stages": stages, "counters": counters, "memory": memory}
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self, prefix: str = PROMETHEUS_PREFIX) -> str:
+        """Export in the Prometheus text exposition format."""
+        data = self.to_dict()
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help: str, samples) -> None:
+            samples = list(samples)
+            if not samples:
+                return
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{_format_labels(labels)} {value!r}")
+
+        stages = data["stages"]
+        metric(
+            "stage_calls_total",
+            "counter",
+            "Number of times a stage ran.",
+            ((dict(s["labels"], stage=s["stage"]), s["calls"]) for s in stages),
+        )
+        metric(
+            "stage_seconds_total",
+            "counter",
+            "Time spent in a stage.",
+            ((dict(s["labels"], stage=s["stage"]), s["seconds"]) for s in stages),
+        )
+        metric(
+            "stage_max_seconds",
+            "gauge",
+            "Longest run of a stage.",
+            ((dict(s["labels"], stage=s["stage"]), s["max_seconds"]) for s in stages),
+        )
+        metric(
+            "stage_peak_bytes",
+            "gauge",
+            "Peak Python heap during a stage.",
+            (
+                (dict(s["labels"], stage=s["stage"]), s["peak_bytes"])
+                for s in stages
+                if "peak_bytes" in s
+            ),
+        )
+
+        counters = defaultdict(list)
+        for counter in data["counters"]:
+            counters[counter["name"]].append((counter["labels"], counter["value"]))
+        for name, samples in counters.items():
+            metric(f"{name}_total", "counter", f"Total {name}.", samples)
+
+        memory = data["memory"]
+        if "python_peak_bytes" in memory:
+            metric(
+                "python_peak_bytes",
+                "gauge",
+                "Peak Python heap traced by tracemalloc.",
+                [({}, memory["python_peak_bytes"])],
+            )
+        metric(
+            "torch_peak_bytes",
+            "gauge",
+            "Peak memory allocated by torch.",
+            (
+                ({"device": device}, value)
+                for device, value in memory.get("torch_peak_bytes", {}).items()
+            ),
+        )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())
+    )
+    return "{" + pairs + "}"
@@ -1,9 +1,19 @@
 import math
-from typing import Tuple
+from typing import Sequence, Tuple, Union
+
+import numpy as np
+
+from .boxes import BoxArray
 
 # [x0, y0, x1, y1]
 BBox = Tuple[float, float, float, float]
 
+# Any (N, 4) collection of [x0, y0, x1, y1] boxes, or a BoxArray in any format
+BBoxes = Union[BoxArray, np.ndarray, Sequence[BBox]]
+
+# Thresholds of the COCO-style IoU@0.5:0.95 sweep
+IOU_SWEEP_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
 
 def bbox_area(bbox: BBox) -> float:
     x0, y0, x1, y1 = bbox
@@ -15,11 +25,197 @@ def bbox_center(bbox: BBox) -> Tuple[float, float]:
     return ((x0 + x1) / 2, (y0 + y1) / 2)
 
 
+def as_bbox_array(boxes: BBoxes) -> np.ndarray:
+    """
+    Convert a collection of [x0, y0, x1, y1] boxes to a float64 (N, 4) array.
+
+    Arrays that already have the right dtype and shape are returned without a copy,
+    a `BoxArray` is converted to the xyxy layout (its scale is kept).
+    """
+    if isinstance(boxes, BoxArray):
+        boxes = boxes.to_format("xyxy").data
+    array = np.asarray(boxes, dtype=np.float64)
+    if array.ndim == 1 and array.shape[0] == 4:
+        array = array[np.newaxis, :]
+    if array.ndim != 2 or array.shape[1] != 4:
+        raise ValueError(f"Expected boxes of shape (N, 4), got {array.shape}")
+    return array
+
+
+def batch_bbox_area(boxes: BBoxes) -> np.ndarray:
+    """
+    Compute the area of every box in an (N, 4) array.
+    """
+    b = as_bbox_array(boxes)
+    return np.maximum(0.0, b[:, 2] - b[:, 0]) * np.maximum(0.0, b[:, 3] - b[:, 1])
+
+
+def batch_iou(b1: BBoxes, b2: BBoxes) -> np.ndarray:
+    """
+    Compute the element-wise IoU between two (N, 4) arrays of boxes.
+
+    Args:
+        b1: First set of boxes, shape (N, 4).
+        b2: Second set of boxes, shape (N, 4).
+
+    Returns:
+        np.ndarray: IoU of each pair (b1[i], b2[i]), shape (N,).
+    """
+    b1 = as_bbox_array(b1)
+    b2 = as_bbox_array(b2)
+    if b1.shape != b2.shape:
+        raise ValueError(
+            f"Box arrays must have the same shape: {b1.shape} != {b2.shape}"
+        )
+
+    x0 = np.maximum(b1[:, 0], b2[:, 0])
+    y0 = np.maximum(b1[:, 1], b2[:, 1])
+    x1 = np.minimum(b1[:, 2], b2[:, 2])
+    y1 = np.minimum(b1[:, 3], b2[:, 3])
+
+    inter_area = np.maximum(0.0, x1 - x0) * np.maximum(0.0, y1 - y0)
+    union_area = batch_bbox_area(b1) + batch_bbox_area(b2) - inter_area
+
+    return np.divide(
+        inter_area,
+        union_area,
+        out=np.zeros_like(inter_area),
+        where=union_area > 0,
+    )
+
+
+def pairwise_iou(b1: BBoxes, b2: BBoxes) -> np.ndarray:
+    """
+    Compute the IoU between every box of b1 and every box of b2.
+
+    Args:
+        b1: First set of boxes, shape (M, 4).
+        b2: Second set of boxes, shape (N, 4).
+
+    Returns:
+        np.ndarray: IoU matrix of shape (M, N).
+    """
+    b1 = as_bbox_array(b1)
+    b2 = as_bbox_array(b2)
+
+    x0 = np.maximum(b1[:, None, 0], b2[None, :, 0])
+    y0 = np.maximum(b1[:, None, 1], b2[None, :, 1])
+    x1 = np.minimum(b1[:, None, 2], b2[None, :, 2])
+    y1 = np.minimum(b1[:, None, 3], b2[None, :, 3])
+
+    inter_area = np.maximum(0.0, x1 - x0) * np.maximum(0.0, y1 - y0)
+    union_area = (
+        batch_bbox_area(b1)[:, None] + batch_bbox_area(b2)[None, :] - inter_area
+    )
+
+    return np.divide(
+        inter_area,
+        union_area,
+        out=np.zeros_like(inter_area),
+        where=union_area > 0,
+    )
+
+
+def batch_iou_with_threshold(
+    b1: BBoxes, b2: BBoxes, threshold: float = 0.5
+) -> np.ndarray:
+    """
+    Check element-wise whether the IoU of two (N, 4) arrays exceeds a threshold.
+    """
+    return batch_iou(b1, b2) >= threshold
+
+
+def _center_distance(b1: np.ndarray, b2: np.ndarray) -> np.ndarray:
+    # Broadcasting helper shared by the element-wise and pairwise versions
+    cx1 = (b1[..., 0] + b1[..., 2]) / 2
+    cy1 = (b1[..., 1] + b1[..., 3]) / 2
+    cx2 = (b2[..., 0] + b2[..., 2]) / 2
+    cy2 = (b2[..., 1] + b2[..., 3]) / 2
+    distance = np.sqrt((cx1 - cx2) ** 2 + (cy1 - cy2) ** 2)
+
+    x0 = np.minimum(b1[..., 0], b2[..., 0])
+    y0 = np.minimum(b1[..., 1], b2[..., 1])
+    x1 = np.maximum(b1[..., 2], b2[..., 2])
+    y1 = np.maximum(b1[..., 3], b2[..., 3])
+    diag = np.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
+
+    return np.divide(distance, diag, out=np.zeros_like(distance), where=diag > 0)
+
+
+def batch_normalized_center_distance(b1: BBoxes, b2: BBoxes) -> np.ndarray:
+    """
+    Compute the element-wise normalized center distance between two (N, 4) arrays.
+    See `compute_normalized_center_distance` for the definition.
+    """
+    b1 = as_bbox_array(b1)
+    b2 = as_bbox_array(b2)
+    if b1.shape != b2.shape:
+        raise ValueError(
+            f"Box arrays must have the same shape: {b1.shape} != {b2.shape}"
+        )
+    return _center_distance(b1, b2)
+
+
+def pairwise_normalized_center_distance(b1: BBoxes, b2: BBoxes) -> np.ndarray:
+    """
+    Compute the normalized center distance between every box of b1 (M, 4)
+    and every box of b2 (N, 4), as a matrix of shape (M, N).
+    """
+    b1 = as_bbox_array(b1)
+    b2 = as_bbox_array(b2)
+    return _center_distance(b1[:, None, :], b2[None, :, :])
+
+
+def iou_threshold_sweep(
+    ious: Union[np.ndarray, Sequence[float]],
+    thresholds: Union[np.ndarray, Sequence[float]] = IOU_SWEEP_THRESHOLDS,
+) -> np.ndarray:
+    """
+    Compute the success rate (fraction of IoU >= t) for every threshold t.
+
+    The result is the AP-style success curve of a set of predictions; its mean
+    over the default thresholds is the IoU@0.5:0.95 score.
+
+    Args:
+        ious: IoU values, shape (N,).
+        thresholds: Thresholds to evaluate, shape (T,).
+
+    Returns:
+        np.ndarray: Success rate for each threshold, shape (T,).
+    """
+    ious = np.asarray(ious, dtype=np.float64).ravel()
+    thresholds = np.asarray(thresholds, dtype=np.float64).ravel()
+    if ious.size == 0:
+        return np.zeros_like(thresholds)
+    return (ious[None, :] >= thresholds[:, None]).mean(axis=1)
+
+
+def mean_iou_over_thresholds(
+    ious: Union[np.ndarray, Sequence[float]],
+    thresholds: Union[np.ndarray, Sequence[float]] = IOU_SWEEP_THRESHOLDS,
+) -> float:
+    """
+    Compute the IoU@0.5:0.95 score: the success rate averaged over the thresholds.
+    """
+    return float(iou_threshold_sweep(ious, thresholds).mean())
+
+
+def _scalar_bbox(bbox: Union[BBox, BoxArray]) -> BBox:
+    # Single pairs are computed in pure Python: converting them to arrays costs
+    # more than the computation itself
+    if isinstance(bbox, BoxArray):
+        return bbox.to_format("xyxy").tolist()[0]
+    return bbox
+
+
 def compute_iou(b1: BBox, b2: BBox) -> float:
     """
     Compute Intersection over Union (IoU) between two bounding boxes.
+
+    Same result as `batch_iou` on one pair, without the array overhead.
     """
     try:
+        b1, b2 = _scalar_bbox(b1), _scalar_bbox(b2)
         x0 = max(b1[0], b2[0])
         y0 = max(b1[1], b2[1])
         x1 = min(b1[2], b2[2])
@@ -48,6 +244,7 @@ def compute_normalized_center_distance(b1: BBox, b2: BBox) -> float:
     Normalized by the diagonal length of the smallest box that encloses both.
     """
     try:
+        b1, b2 = _scalar_bbox(b1), _scalar_bbox(b2)
         cx1, cy1 = bbox_center(b1)
         cx2, cy2 = bbox_center(b2)
     except Exception as e:
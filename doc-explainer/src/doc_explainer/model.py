@@ -1,10 +1,18 @@
-from typing import List, Optional
+import asyncio
+from typing import Any, List, Optional
 
 import torch.nn as nn
 from PIL.Image import Image
-from transformers import AutoModel
 
-from .models.utils import generate_prediction, get_model_and_processor
+from .instrumentation import stage
+from .models.registry import ModelRegistry, get_registry
+from .models.utils import (
+    DEFAULT_BATCH_SIZE,
+    agenerate_prediction,
+    generate_prediction,
+    generate_prediction_batch,
+)
+from .spatial import WordIndex
 from .type import ExplainableAnswer
 
 VLM_PROMPT = """Based only on the document image, answer the following question:
@@ -29,25 +37,126 @@ class DocExplainer(nn.Module):
 
     Attributes:
         vlm_model_name (str): Name of the VLM model to use for question answering
-        device (str): Device to run the models on (e.g., 'cuda', 'cpu')
-        explainer: The explainer model for identifying relevant regions
-        vlm: The Vision Language Model instance
-        processor: The processor for the VLM model
+        device (str): Device to run the VLM on (e.g., 'cuda', 'cpu'), or 'auto'
+            for the GPU when there is one and the CPU otherwise
+        quantization (Optional[str]): Precision of the VLM: None for the default
+            of the device, 'bf16', or 'int8' for dynamic quantization on CPU
+        explainer: The explainer model for identifying relevant regions. Loaded
+            from `letxbe/DocExplainer` unless one with the same `predict` method
+            is given (or assigned to `explainer`, e.g. `FakeExplainer` in
+            benchmarks)
+        vlm: The Vision Language Model instance, the one of the registry
+            unless one is given with `set_vlm` (or assigned to `vlm`)
+        processor: The processor for the VLM model, the one of the registry
+            unless one is given with `set_vlm` (or assigned to `processor`)
+        registry (ModelRegistry): Where the VLM and explainer are loaded,
+            `get_registry()` by default. Models are loaded on first use, shared
+            with the other instances and looked up on every call, so that the
+            registry can evict them under its memory budget. They are therefore
+            not submodules of the instance, unlike the given modules, which
+            `to()`, `eval()` and `state_dict()` reach.
+
+    The number of torch threads on CPU is process-wide, see `set_num_threads`.
+        request_mode (Optional[str]): How the questions about a page are sent
+            to Claude ("single", "cached" or "multi", see `ClaudeBackend`), the
+            mode of the shared backend by default.
     """
 
-    def __init__(self, vlm_model_name: str = "smolvlm", device: str = "cuda"):
+    def __init__(
+        self,
+        vlm_model_name: str = "smolvlm",
+        device: str = "auto",
+        explainer: Optional[Any] = None,
+        quantization: Optional[str] = None,
+        registry: Optional[ModelRegistry] = None,
+        request_mode: Optional[str] = None,
+    ):
         super().__init__()
 
         self.vlm_model_name = vlm_model_name
         self.device = device
-        self.explainer = AutoModel.from_pretrained(
-            "letxbe/DocExplainer", trust_remote_code=True
+        self.quantization = quantization
+        self.request_mode = request_mode
+        self.registry = registry or get_registry()
+        # Models given instead of the ones of the registry, registered as
+        # submodules when they are modules
+        self._explainer = explainer
+        self._vlm_model = None
+        self._vlm_processor = None
+
+    # Properties that `nn.Module.__setattr__` would bypass by storing modules
+    # in `_modules`: assignments go to the given models instead
+    _OVERRIDES = {
+        "explainer": "_explainer",
+        "vlm": "_vlm_model",
+        "processor": "_vlm_processor",
+    }
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(self._OVERRIDES.get(name, name), value)
+
+    def set_vlm(self, model: Any, processor: Any = None) -> None:
+        """Use this model and processor instead of the ones of the registry."""
+        self.vlm = model
+        self.processor = processor
+
+    @property
+    def explainer(self) -> Any:
+        if self._explainer is not None:
+            return self._explainer
+        return self.registry.explainer()
+
+    def _model_and_processor(self) -> Any:
+        # A given VLM comes with its own processor (None if not given), a
+        # given processor alone replaces the one of the registry
+        if self._vlm_model is not None:
+            return self._vlm_model, self._vlm_processor
+        model, processor = self.registry.vlm(
+            self.vlm_model_name, self.device, self.quantization
         )
+        if self._vlm_processor is not None:
+            processor = self._vlm_processor
+        return model, processor
 
-        self.vlm, self.processor = get_model_and_processor(vlm_model_name)
+    @property
+    def vlm(self) -> Any:
+        return self._model_and_processor()[0]
+
+    @property
+    def processor(self) -> Any:
+        return self._model_and_processor()[1]
 
     def forward(
-        self, document: List[Image], question: str
+        self,
+        document: List[Image],
+        question: str,
+        word_index: Optional[WordIndex] = None,
+        source: Optional[str] = None,
+    ) -> Optional[ExplainableAnswer]:
+        """
+        Answer the question and locate the answer in the document.
+
+        Args:
+            document: Pages of the document.
+            question: Question to answer.
+            word_index: Optional index over the OCR words of the document (0-1000
+                scale, 1-based pages). When given, the predicted box is snapped
+                to the boundaries of the words it covers.
+            source: Source of the document, for the budgets of the
+                `ResolutionPolicy` per source.
+
+        The call is timed as the "docexplainer.forward" stage, with the
+        "explainer.predict" and "snap" stages inside, see `instrumentation`.
+        """
+        with stage("docexplainer.forward"):
+            return self._forward(document, question, word_index, source)
+
+    def _forward(
+        self,
+        document: List[Image],
+        question: str,
+        word_index: Optional[WordIndex],
+        source: Optional[str] = None,
     ) -> Optional[ExplainableAnswer]:
         for page_idx, page in enumerate(document):
             prompt = VLM_PROMPT.format(QUESTION=question)
@@ -58,15 +167,148 @@ class DocExplainer(nn.Module):
                 image=page,
                 model=self.vlm,
                 processor=self.processor,
+                request_mode=self.request_mode,
+                source=source,
+            )
+
+            answer = self._answer(prediction)
+            if answer:
+                return self._explain(page, page_idx, question, answer, word_index)
+
+        return None
+
+    async def aforward(
+        self,
+        document: List[Image],
+        question: str,
+        word_index: Optional[WordIndex] = None,
+        source: Optional[str] = None,
+    ) -> Optional[ExplainableAnswer]:
+        """
+        Awaitable `forward`, to answer many questions concurrently.
+
+        With Claude, the requests of concurrent calls share the connections and
+        rate limits of the `ClaudeBackend`; local VLMs and the explainer run in
+        worker threads.
+
+        Example:
+            results = await asyncio.gather(
+                *(explainer.aforward(pages, question) for question in questions)
             )
+        """
+        for page_idx, page in enumerate(document):
+            prediction = await agenerate_prediction(
+                VLM_PROMPT.format(QUESTION=question),
+                page,
+                self.vlm_model_name,
+                self.vlm,
+                self.processor,
+                self.request_mode,
+                source,
+            )
+            answer = self._answer(prediction)
+            if answer:
+                return await asyncio.to_thread(
+                    self._explain, page, page_idx, question, answer, word_index
+                )
+        return None
+
+    def forward_batch(
+        self,
+        documents: List[List[Image]],
+        questions: List[str],
+        word_indexes: Optional[List[Optional[WordIndex]]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        source: Optional[str] = None,
+    ) -> List[Optional[ExplainableAnswer]]:
+        """
+        Answer several questions at once, with batched VLM calls.
 
-            if prediction and isinstance(prediction, dict):
-                answer = prediction.get("content", None)
+        Gives the same answers as calling `forward` on each question: the first
+        pages of all the documents are sent together, then the second pages of
+        the questions still unanswered, and so on.
 
-                if answer:
-                    bbox = self.explainer.predict(
-                        page, f"Question: {question} Answer: {answer}"
-                    )
-                    return ExplainableAnswer(answer=answer, page=page_idx, bbox=bbox)
+        Args:
+            documents: Pages of the document of each question.
+            questions: Questions to answer.
+            word_indexes: Optional OCR word index of each document, see `forward`.
+            batch_size: Maximum number of pages per VLM call.
+            source: Source of the documents, see `forward`.
 
+        Returns:
+            List[Optional[ExplainableAnswer]]: Answer of each question, in order.
+        """
+        if len(documents) != len(questions):
+            raise ValueError(
+                f"Got {len(questions)} questions for {len(documents)} documents"
+            )
+        word_indexes = word_indexes or [None] * len(questions)
+        results: List[Optional[ExplainableAnswer]] = [None] * len(questions)
+
+        with stage("docexplainer.forward_batch"):
+            pending = list(range(len(questions)))
+            page_idx = 0
+            while pending:
+                pending = [i for i in pending if page_idx < len(documents[i])]
+                if not pending:
+                    break
+                predictions = generate_prediction_batch(
+                    [VLM_PROMPT.format(QUESTION=questions[i]) for i in pending],
+                    [documents[i][page_idx] for i in pending],
+                    self.vlm_model_name,
+                    self.vlm,
+                    self.processor,
+                    batch_size=batch_size,
+                    request_mode=self.request_mode,
+                    source=source,
+                )
+                unanswered = []
+                for i, prediction in zip(pending, predictions):
+                    answer = self._answer(prediction)
+                    if answer:
+                        results[i] = self._explain(
+                            documents[i][page_idx],
+                            page_idx,
+                            questions[i],
+                            answer,
+                            word_indexes[i],
+                        )
+                    else:
+                        unanswered.append(i)
+                pending = unanswered
+                page_idx += 1
+
+        return results
+
+    @staticmethod
+    def _answer(prediction: Optional[dict]) -> Optional[str]:
+        if prediction and isinstance(prediction, dict):
+            return prediction.get("content", None)
         return None
+
+    def _explain(
+        self,
+        page: Image,
+        page_idx: int,
+        question: str,
+        answer: str,
+        word_index: Optional[WordIndex],
+    ) -> ExplainableAnswer:
+        with stage("explainer.predict"):
+            bbox = self.explainer.predict(
+                page, f"Question: {question} Answer: {answer}"
+            )
+        if word_index is not None:
+            with stage("snap"):
+                bbox = self._snap_bbox(bbox, page_idx, word_index)
+        return ExplainableAnswer(answer=answer, page=page_idx, bbox=bbox)
+
+    @staticmethod
+    def _snap_bbox(
+        bbox: List[float], page_idx: int, word_index: WordIndex
+    ) -> List[float]:
+        # The explainer predicts in [0, 1], the OCR words are in [0, 1000]
+        snapped = word_index.snap(page_idx + 1, [v * 1000 for v in bbox])
+        if snapped is None:
+            return bbox
+        return [v / 1000 for v in snapped]
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict
+
+from PIL.Image import Image
+
+# Default size bound of a prediction cache, in bytes of stored predictions
+CACHE_MAX_BYTES = 1 << 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    key TEXT PRIMARY KEY,
+    backend TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_last_access ON predictions (last_access);
+"""
+
+
+def image_hash(image: Image) -> str:
+    """
+    Hash of the pixels, mode and size of an image.
+
+    Computed on every call rather than memoized on the image: pages can be
+    edited in place (e.g. by `ExplainableAnswer.explain`), and the caches keyed
+    by page must then miss.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def prediction_key(
+    backend: str,
+    model_id: str,
+    params: Dict[str, Any],
+    prompt: str,
+    image: Image,
+) -> str:
+    """
+    Content address of a prediction.
+
+    Args:
+        backend: Name of the VLM backend (see `VLMModel`).
+        model_id: Checkpoint or API model used by the backend.
+        params: Generation parameters, and anything else that changes the output
+            (e.g. the system message).
+        prompt: Text prompt.
+        image: Page image.
+
+    Returns:
+        str: Hex digest identifying the prediction.
+    """
+    content = json.dumps(
+        {
+            "backend": str(backend),
+            "model_id": model_id,
+            "params": params,
+            "prompt": hashlib.sha256(prompt.encode()).hexdigest(),
+            "image": image_hash(image),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class PredictionCache:
+    """
+    Persistent, size-bounded cache of raw VLM predictions.
+
+    Predictions are stored as JSON in a SQLite database keyed by `prediction_key`,
+    so re-running an evaluation with unchanged prompts and pages does not call the
+    model again. When the stored predictions exceed `max_bytes`, the least recently
+    used ones are evicted. Several processes can share the same file: every write
+    is a single transaction, and readers never see a partial entry.
+
+    Example:
+        cache = PredictionCache("data/predictions.sqlite")
+        prediction = cache.get(key)
+        if prediction is PredictionCache.MISS:
+            prediction = model(...)
+            cache.put(key, prediction, backend, model_id)
+
+    Attributes:
+        path (str): Path of the SQLite file.
+        max_bytes (int): Size bound of the stored predictions.
+        hits (int): Number of `get` calls that found a prediction.
+        misses (int): Number of `get` calls that did not.
+        writes (int): Number of predictions stored.
+        evictions (int): Number of predictions evicted.
+    """
+
+    # Returned by `get` on a miss, since None is a valid (failed) prediction
+    MISS = object()
+
+    def __init__(
+        self, path: str, max_bytes: int = CACHE_MAX_BYTES, timeout: float = 60.0
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "PredictionCache":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None
+
+    @property
+    def size(self) -> int:
+        """Total size of the stored predictions, in bytes."""
+        with self._lock:
+            return self._size()
+
+    def _size(self) -> int:
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM predictions"
+        ).fetchone()[0]
+
+    def get(self, key: str) -> Any:
+        """Return the cached prediction, or `PredictionCache.MISS`."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return self.MISS
+            self.hits += 1
+            self.conn.execute(
+                "UPDATE predictions SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        return json.loads(row[0])
+
+    def put(self, key: str, prediction: Any, backend: str, model_id: str) -> None:
+        """Store a prediction, evicting the least recently used ones if needed."""
+        value = json.dumps(prediction, ensure_ascii=False)
+        size = len(value.encode())
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, str(backend), model_id, value, size, time.time()),
+                )
+                self._evict()
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.writes += 1
+
+    def _evict(self) -> None:
+        excess = self._size() - self.max_bytes
+        if excess <= 0:
+            return
+        freed = 0
+        keys = []
+        cursor = self.conn.execute(
+            "SELECT key, size FROM predictions ORDER BY last_access"
+        )
+        for key, size in cursor:
+            keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        cursor.close()
+        self.conn.executemany("DELETE FROM predictions WHERE key = ?", keys)
+        self.evictions += len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "bytes": self.size,
+        }
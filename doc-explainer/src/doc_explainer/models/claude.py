@@ -1,23 +1,28 @@
-import base64
+import asyncio
 import json
-import os
 import random
 import re
+import threading
 import time
-from io import BytesIO
-from typing import Optional
+from concurrent.futures import Future
+from typing import Any, Coroutine, Dict, List, Optional
 
 import anthropic
 from PIL import Image
 
-from .constants import SYSTEM_MESSAGE
+from ..instrumentation import count, stage
+from .constants import (
+    CLAUDE_GENERATION_PARAMS,
+    CLAUDE_MODEL_ID,
+    MULTI_QUESTION_PROMPT,
+    MULTI_QUESTION_TASK,
+    SYSTEM_MESSAGE,
+)
+from .image_cache import EncodedImage, get_image_cache
+from .utils import VLMModel
 
-
-def pil_to_base64(image: Image.Image) -> str:
-    """Convert a PIL Image to base64 string."""
-    buffered = BytesIO()
-    image.save(buffered, format="JPEG")  # or PNG depending on input
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+# Label of the stages and counters of this backend
+BACKEND = VLMModel.CLAUDE.value
 
 
 def safe_json_parse(text: str) -> Optional[dict]:
@@ -41,69 +46,467 @@ def safe_json_parse(text: str) -> Optional[dict]:
         return None
 
 
-def call_with_retries(client, **kwargs):
-    max_retries = 5
-    backoff = 3
-    for attempt in range(max_retries):
-        try:
-            return client.beta.messages.create(**kwargs)
-        except anthropic.InternalServerError as e:
-            print(
-                f"[Attempt {attempt + 1}] Server error (500): {e}. Retrying in {backoff} seconds..."
+def parse_json_list(text: str) -> Optional[list]:
+    """The JSON list in a response, None if there is none."""
+    match = re.search(r"\[.*\]", text.strip(), re.DOTALL)
+    if not match:
+        return None
+    candidate = re.sub(r",\s*}", "}", match.group(0))
+    candidate = re.sub(r",\s*\]", "]", candidate)
+    try:
+        value = json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, list) else None
+
+
+# How the questions about a page are sent, see `ClaudeBackend`
+REQUEST_MODES = ("single", "cached", "multi")
+
+# Requests in flight and sustained request rate of the shared backend
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_SECOND = 4.0
+
+# Retries of a request, with exponential backoff from BACKOFF_SECONDS when the
+# API gives no retry-after header
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+# Images larger than this on either side are rejected by the API
+MAX_IMAGE_SIDE = 8000
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket limiting the request rate, adapted to the rate limits of the API.
+
+    Requests take one token; tokens come back at `rate` per second, up to `burst`.
+    On a rate limit error the rate is halved (down to `min_rate`) and, when the
+    API says when to retry, no token is given before then. Every success then
+    raises the rate back by 5% of `max_rate`, so the limiter settles just below
+    the limit of the account.
+
+    Used from the event loop of a `ClaudeBackend` only, so it needs no lock.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, min_rate: float = 0.05):
+        if rate <= 0:
+            raise ValueError(f"Invalid rate: {rate}")
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = max(self._updated, now)
+
+    async def acquire(self) -> None:
+        """Wait for a token. Waiters are served in order."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + 0.05 * self.max_rate)
+
+    def on_rate_limit(self, retry_after: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0.0
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+            # No tokens accumulate during the pause
+            self._updated = self._paused_until
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _retry_reason(error: Exception) -> Optional[str]:
+    """Why a failed request is worth retrying, None if it is not."""
+    if isinstance(error, anthropic.APIConnectionError):
+        return "connection_error"
+    status = getattr(error, "status_code", None)
+    if status == 429:
+        return "rate_limit"
+    if status is not None and status >= 500:
+        return "server_error"
+    return None
+
+
+def user_messages(
+    prompt: str, image: EncodedImage, cache_prefix: bool = False
+) -> List[dict]:
+    """
+    Messages of a request. With `cache_prefix`, the system message and the
+    image are marked as a prompt caching prefix, reused by the next requests
+    about the same page.
+    """
+    image_block = {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": image.media_type,
+            "data": image.data,
+        },
+    }
+    if cache_prefix:
+        image_block["cache_control"] = {"type": "ephemeral"}
+    return [
+        {
+            "role": "user",
+            "content": [image_block, {"type": "text", "text": prompt}],
+        }
+    ]
+
+
+def multi_question_prompt(prompts: List[str]) -> str:
+    """Prompt asking the questions of several prompts about one page at once."""
+    tasks = "\n\n".join(
+        MULTI_QUESTION_TASK.format(INDEX=index, PROMPT=prompt.strip())
+        for index, prompt in enumerate(prompts, start=1)
+    )
+    return MULTI_QUESTION_PROMPT.format(NUM_TASKS=len(prompts), TASKS=tasks)
+
+
+def _check_request_mode(request_mode: str) -> None:
+    if request_mode not in REQUEST_MODES:
+        raise ValueError(
+            f"Unsupported request mode: {request_mode}, use one of {REQUEST_MODES}"
+        )
+
+
+class ClaudeBackend:
+    """
+    Claude client shared by every prediction of the process.
+
+    A single `anthropic.AsyncAnthropic` client (and its connection pool) runs on
+    a private event loop thread, so that requests from any thread or event loop
+    reuse connections and share one concurrency bound and one
+    `AdaptiveRateLimiter`. Rate limits (429), server errors (5xx) and
+    connection errors are retried with the delay of the retry-after header, or
+    an exponential backoff.
+
+    The image tokens of a page dominate the cost and latency of a request, so
+    the questions about a same page can be sent in three ways (`request_mode`):
+        - "single": one independent request per question.
+        - "cached": one request per question, with the system message and the
+          image marked as a prompt caching prefix. The first question of a
+          page is sent alone to write the prefix, then the others read it.
+        - "multi": all the questions of a page in one request answered by a
+          JSON list (`MULTI_QUESTION_PROMPT`). When the list does not have one
+          object per question, the page falls back to "cached".
+    Predictions keep the format of single requests in every mode.
+
+    Example:
+        backend = ClaudeBackend(max_concurrency=16, requests_per_second=8)
+        set_claude_backend(backend)
+        predictions = await asyncio.gather(
+            *(backend.agenerate_prediction(prompt, page) for page in pages)
+        )
+
+    Attributes:
+        max_concurrency (int): Maximum number of requests in flight.
+        limiter (AdaptiveRateLimiter): Limiter of the request rate.
+        max_retries (int): Retries of a request before giving up.
+        base_url (Optional[str]): API endpoint, e.g. a local mock server in tests.
+        api_key (Optional[str]): API key, ANTHROPIC_API_KEY by default.
+        request_mode (str): Default mode of the questions about a page, one
+            of `REQUEST_MODES`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+        max_retries: int = MAX_RETRIES,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        request_mode: str = "single",
+    ):
+        _check_request_mode(request_mode)
+        self.request_mode = request_mode
+        self.max_concurrency = max_concurrency
+        self.limiter = AdaptiveRateLimiter(
+            requests_per_second, burst=max(1, max_concurrency)
+        )
+        self.max_retries = max_retries
+        self.base_url = base_url
+        self.api_key = api_key
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[anthropic.AsyncAnthropic] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _submit(self, coroutine: Coroutine) -> Future:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="claude-backend", daemon=True
+                )
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def close(self) -> None:
+        """Close the connections and stop the event loop thread."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), loop).result()
+            self._client = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+        # The next loop needs its own synchronization primitives
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.limiter = AdaptiveRateLimiter(self.limiter.max_rate, self.limiter.burst)
+
+    async def _create(self, **kwargs) -> Any:
+        if self._client is None:
+            # SDK retries are off, they would not go through the limiter
+            self._client = anthropic.AsyncAnthropic(
+                api_key=self.api_key, base_url=self.base_url, max_retries=0
             )
-            time.sleep(backoff + random.random())
-            backoff *= 2
-        except anthropic.RateLimitError as e:
-            print(
-                f"[Attempt {attempt + 1}] Rate limited: {e}. Retrying in {backoff} seconds..."
+        for attempt in range(self.max_retries + 1):
+            with stage("rate_limit_wait", backend=BACKEND):
+                await self.limiter.acquire()
+            try:
+                async with self._semaphore:
+                    with stage("api_call", backend=BACKEND):
+                        message = await self._client.beta.messages.create(**kwargs)
+                self.limiter.on_success()
+                return message
+            except anthropic.APIError as error:
+                reason = _retry_reason(error)
+                if reason is None or attempt == self.max_retries:
+                    raise
+                retry_after = _retry_after(error)
+                if reason == "rate_limit":
+                    self.limiter.on_rate_limit(retry_after)
+                if retry_after is None:
+                    retry_after = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2**attempt)
+                    retry_after *= 1 + random.random() / 2
+                print(
+                    f"[Attempt {attempt + 1}] {reason}: {error}. Retrying in {retry_after:.1f} seconds..."
+                )
+                count("retries", backend=BACKEND, reason=reason)
+                with stage("backoff_sleep", backend=BACKEND):
+                    await asyncio.sleep(retry_after)
+
+    async def _complete(
+        self, messages: List[dict], image: EncodedImage
+    ) -> Optional[str]:
+        try:
+            message = await self._create(
+                model=CLAUDE_MODEL_ID,
+                **CLAUDE_GENERATION_PARAMS,
+                system=SYSTEM_MESSAGE,
+                messages=messages,
             )
-            time.sleep(backoff + random.random())
-            backoff *= 2
         except Exception as e:
-            print(f"Unexpected error: {e}")
-            raise
-    raise RuntimeError("Failed after retries due to repeated errors")
+            print(f"Error generating prediction: {e}")
+            return None
+        count("image_bytes_sent", len(image.data), backend=BACKEND)
 
+        usage = getattr(message, "usage", None)
+        if usage is not None:
+            count("input_tokens", usage.input_tokens, backend=BACKEND)
+            count("output_tokens", usage.output_tokens, backend=BACKEND)
+            for name in ("cache_creation_input_tokens", "cache_read_input_tokens"):
+                tokens = getattr(usage, name, None)
+                if tokens:
+                    count(f"prompt_{name}", tokens, backend=BACKEND)
 
-def generate_prediction_claude(prompt: str, image: Image.Image) -> Optional[dict]:
-    width, height = image.size
+        return "".join(block.text for block in message.content)
 
-    if width > 8000 or height > 8000:
+    async def _predict(
+        self, prompt: str, image: EncodedImage, cache_prefix: bool = False
+    ) -> Optional[dict]:
+        text_content = await self._complete(
+            user_messages(prompt, image, cache_prefix), image
+        )
+        if text_content is None:
+            return None
+        with stage("json_parsing", backend=BACKEND):
+            return safe_json_parse(text_content)
+
+    async def _predict_page(
+        self, prompts: List[str], image: EncodedImage, request_mode: str
+    ) -> List[Optional[dict]]:
+        """Predictions of several prompts about the same page."""
+        if request_mode == "single":
+            return list(
+                await asyncio.gather(*(self._predict(p, image) for p in prompts))
+            )
+
+        if request_mode == "multi" and len(prompts) > 1:
+            text_content = await self._complete(
+                user_messages(multi_question_prompt(prompts), image, True), image
+            )
+            with stage("json_parsing", backend=BACKEND):
+                answers = parse_json_list(text_content or "")
+            if answers is not None and len(answers) == len(prompts):
+                return [
+                    answer if isinstance(answer, dict) else None for answer in answers
+                ]
+            count("multi_question_fallbacks", backend=BACKEND)
+
+        # The first request writes the cached prefix that the others read
+        first = await self._predict(prompts[0], image, True)
+        rest = await asyncio.gather(
+            *(self._predict(p, image, True) for p in prompts[1:])
+        )
+        return [first, *rest]
+
+    def generate_prediction(
+        self, prompt: str, image: Image.Image, request_mode: Optional[str] = None
+    ) -> Optional[dict]:
+        """Blocking prediction, safe to call from many threads at once."""
+        return self.generate_predictions([prompt], [image], request_mode)[0]
+
+    async def agenerate_prediction(
+        self, prompt: str, image: Image.Image, request_mode: Optional[str] = None
+    ) -> Optional[dict]:
+        """Prediction awaitable from any event loop."""
+        request_mode = request_mode or self.request_mode
+        _check_request_mode(request_mode)
+        image_data = await asyncio.to_thread(encode_image, image)
+        if image_data is None:
+            return None
+        predictions = await asyncio.wrap_future(
+            self._submit(self._predict_page([prompt], image_data, request_mode))
+        )
+        return predictions[0]
+
+    def generate_predictions(
+        self,
+        prompts: List[str],
+        images: List[Image.Image],
+        request_mode: Optional[str] = None,
+    ) -> List[Optional[dict]]:
+        """
+        Blocking predictions of several pairs, sent concurrently. The prompts
+        about a same page are sent according to `request_mode` (the mode of
+        the backend by default).
+        """
+        request_mode = request_mode or self.request_mode
+        _check_request_mode(request_mode)
+        pages: Dict[str, List[int]] = {}
+        payloads: Dict[str, EncodedImage] = {}
+        for index, image_data in enumerate(encode_images(images)):
+            if image_data is not None:
+                pages.setdefault(image_data.data, []).append(index)
+                payloads[image_data.data] = image_data
+
+        futures = [
+            (
+                indexes,
+                self._submit(
+                    self._predict_page(
+                        [prompts[i] for i in indexes], payloads[data], request_mode
+                    )
+                ),
+            )
+            for data, indexes in pages.items()
+        ]
+        predictions: List[Optional[dict]] = [None] * len(prompts)
+        for indexes, future in futures:
+            for index, prediction in zip(indexes, future.result()):
+                predictions[index] = prediction
+        return predictions
+
+
+def _fits(image: Image.Image) -> bool:
+    width, height = image.size
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE:
         print(
             f"Image dimensions are too large for processing. Width: {width}, Height: {height}"
         )
-        return None
+        return False
+    return True
 
-    client = anthropic.Anthropic()
 
-    try:
-        time.sleep(1)  # small delay between calls
-
-        message = call_with_retries(
-            client,
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            system=SYSTEM_MESSAGE,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": pil_to_base64(image),
-                            },
-                        },
-                        {"type": "text", "text": prompt},
-                    ],
-                }
-            ],
-        )
-    except Exception as e:
-        print(f"Error generating prediction: {e}")
-        return None
+def encode_image(image: Image.Image) -> Optional[EncodedImage]:
+    """
+    Payload of a page from the shared `EncodedImageCache`, None if it is too
+    large for the API.
+    """
+    return get_image_cache().get(image) if _fits(image) else None
+
+
+def encode_images(images: List[Image.Image]) -> List[Optional[EncodedImage]]:
+    """Payloads of several pages, each distinct page encoded once and in parallel."""
+    fits = [_fits(image) for image in images]
+    encoded = iter(get_image_cache().get_many([i for i, ok in zip(images, fits) if ok]))
+    return [next(encoded) if ok else None for ok in fits]
+
+
+_backend: Optional[ClaudeBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_claude_backend() -> ClaudeBackend:
+    """The shared backend, created with the default limits on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = ClaudeBackend()
+        return _backend
+
+
+def set_claude_backend(backend: Optional[ClaudeBackend]) -> None:
+    """Replace the shared backend (None to go back to the default one)."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    if previous is not None and previous is not backend:
+        previous.close()
+
+
+def generate_prediction_claude(
+    prompt: str, image: Image.Image, request_mode: Optional[str] = None
+) -> Optional[dict]:
+    return get_claude_backend().generate_prediction(prompt, image, request_mode)
+
+
+async def agenerate_prediction_claude(
+    prompt: str, image: Image.Image, request_mode: Optional[str] = None
+) -> Optional[dict]:
+    return await get_claude_backend().agenerate_prediction(prompt, image, request_mode)
+
 
-    text_content = "".join(block.text for block in message.content)
-    return safe_json_parse(text_content)
+def generate_predictions_claude(
+    prompts: List[str],
+    images: List[Image.Image],
+    model: Any = None,
+    processor: Any = None,
+    request_mode: Optional[str] = None,
+) -> List[Optional[dict]]:
+    return get_claude_backend().generate_predictions(prompts, images, request_mode)
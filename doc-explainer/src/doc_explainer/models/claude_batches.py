@@ -0,0 +1,361 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import anthropic
+from PIL import Image
+
+from ..instrumentation import count, stage
+from .claude import BACKEND, encode_image, safe_json_parse, user_messages
+from .constants import CLAUDE_GENERATION_PARAMS, CLAUDE_MODEL_ID, SYSTEM_MESSAGE
+from .image_cache import get_image_cache
+from .resolution import get_resolution_policy
+
+# Limits of a submission, below those of the API (100k requests, 256 MB)
+BATCH_MAX_REQUESTS = 10_000
+BATCH_MAX_BYTES = 200 * 2**20
+
+# Seconds between two status checks of the unfinished batches
+POLL_INTERVAL = 30.0
+
+Key = Tuple[str, ...]
+
+
+def custom_id(key: Sequence[str], params: str = "") -> str:
+    """
+    Request id of a key and the `request_hash` of its parameters, within the 64
+    characters of [a-zA-Z0-9_-] of the API.
+    """
+    return hashlib.sha256(json.dumps([list(key), params]).encode()).hexdigest()[:48]
+
+
+def request_hash(prompt: str, size: Tuple[int, int]) -> str:
+    """
+    Hash of what a request is made of besides the page pixels: prompt, model,
+    generation parameters, system message, and size and format the page is sent at.
+    """
+    params = {
+        "model": CLAUDE_MODEL_ID,
+        **CLAUDE_GENERATION_PARAMS,
+        "system": SYSTEM_MESSAGE,
+        "prompt": prompt,
+        "size": list(size),
+        "image_format": get_image_cache().image_format,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def read_journal(path: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Read a batch journal.
+
+    Returns:
+        (records, size of the valid prefix in bytes). A last line cut by a crash
+        is not part of the valid prefix.
+    """
+    records, valid = [], 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            valid += len(line)
+    return records, valid
+
+
+class MessageBatchJob:
+    """
+    Claude predictions of many (key, prompt, image) through the Message Batches
+    API, resumable after an interruption.
+
+    Requests are packed into batches of at most `max_requests` requests and
+    `max_bytes` of payload, submitted as soon as one is full so that the
+    encoded images of a single batch are held in memory. `wait` polls the
+    unfinished batches and streams their results back. Everything is appended
+    to a JSONL journal: the batch ids and the keys of their requests, every
+    result, and a marker per finished batch. Reopening the journal skips the
+    requests already submitted and resumes polling. Request ids include the
+    `request_hash` of their parameters, so a key added again with another
+    prompt, model or page size is sent again and its new result replaces the
+    previous one.
+
+    Requests that failed in their batch (errored, expired or canceled) have no
+    prediction; callers can send them again through the regular backend.
+
+    Example:
+        job = MessageBatchJob("claude_batches.jsonl")
+        for key, prompt, image in questions:
+            job.add(key, prompt, image)
+        job.flush()
+        job.wait()
+        prediction = job.prediction(key)
+
+    Attributes:
+        path (str): Journal file.
+        predictions (Dict[Key, Optional[dict]]): Parsed prediction of every
+            succeeded request.
+        failures (Dict[Key, str]): Result type of every failed request.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        client: Optional[anthropic.Anthropic] = None,
+        max_requests: int = BATCH_MAX_REQUESTS,
+        max_bytes: int = BATCH_MAX_BYTES,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self.path = path
+        self.client = client or anthropic.Anthropic()
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+
+        self.predictions: Dict[Key, Optional[dict]] = {}
+        self.failures: Dict[Key, str] = {}
+        self._keys: Dict[str, Key] = {}
+        # Request id last submitted for each key, only its result is kept
+        self._latest: Dict[Key, str] = {}
+        self._batches: Dict[str, List[str]] = {}
+        self._ended: set = set()
+        self._pending: List[dict] = []
+        self._pending_ids: set = set()
+        self._pending_bytes = 0
+
+        valid = 0
+        if os.path.exists(path):
+            records, valid = read_journal(path)
+            for record in records:
+                self._replay(record)
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Opened on the first record, so that a job only read is not left open
+        self._journal = None
+
+    def _replay(self, record: Dict[str, Any]) -> None:
+        if "batch" in record:
+            requests = {cid: tuple(key) for cid, key in record["requests"].items()}
+            self._keys.update(requests)
+            self._batches[record["batch"]] = list(requests)
+            for cid, key in requests.items():
+                if self._latest.get(key) != cid:
+                    # Submitted again with other parameters
+                    self.predictions.pop(key, None)
+                    self.failures.pop(key, None)
+                self._latest[key] = cid
+        elif "ended" in record:
+            self._ended.add(record["ended"])
+        else:
+            key = self._keys[record["id"]]
+            if self._latest[key] != record["id"]:
+                return
+            if "prediction" in record:
+                self.predictions[key] = record["prediction"]
+                self.failures.pop(key, None)
+            else:
+                self.failures[key] = record["failure"]
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        if self._journal is None:
+            self._journal = open(self.path, "a")
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+
+    def close(self) -> None:
+        """Close the journal, reopened if more records are written."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def __enter__(self) -> "MessageBatchJob":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def submitted(self, key: Sequence[str]) -> bool:
+        """Whether a request was submitted for a key, whatever its parameters."""
+        return tuple(key) in self._latest
+
+    def prediction(
+        self,
+        key: Sequence[str],
+        image: Optional[Image.Image] = None,
+        source: Optional[str] = None,
+    ) -> Optional[dict]:
+        """
+        Prediction of a request. Given the page it was added with, positions are
+        mapped back to the page when the `ResolutionPolicy` resized it.
+        """
+        prediction = self.predictions.get(tuple(key))
+        policy = get_resolution_policy()
+        if image is None or policy is None:
+            return prediction
+        resize = policy.fit(image, BACKEND, source)
+        return policy.restore(prediction, image, resize, BACKEND, source)
+
+    def has_prediction(self, key: Sequence[str]) -> bool:
+        return tuple(key) in self.predictions
+
+    @property
+    def unfinished_batches(self) -> List[str]:
+        return [batch for batch in self._batches if batch not in self._ended]
+
+    def add(
+        self,
+        key: Sequence[str],
+        prompt: str,
+        image: Image.Image,
+        source: Optional[str] = None,
+    ) -> bool:
+        """
+        Queue a request, unless its key was already submitted with the same
+        parameters. When a `ResolutionPolicy` is set, the page is resized to the
+        budget of its `source`.
+
+        Returns:
+            bool: Whether the request was queued. Images too large for the API
+                are not.
+        """
+        policy = get_resolution_policy()
+        resize = policy.fit(image, BACKEND, source) if policy is not None else None
+        cid = custom_id(
+            key, request_hash(prompt, resize.size if resize else image.size)
+        )
+        if cid in self._keys or cid in self._pending_ids:
+            return False
+        if resize is not None:
+            image = policy.apply(image, resize, BACKEND)
+        image_data = encode_image(image)
+        if image_data is None:
+            return False
+        request = {
+            "custom_id": cid,
+            "params": {
+                "model": CLAUDE_MODEL_ID,
+                **CLAUDE_GENERATION_PARAMS,
+                "system": SYSTEM_MESSAGE,
+                "messages": user_messages(prompt, image_data),
+            },
+            "key": list(key),
+            "image_bytes": len(image_data.data),
+        }
+        size = len(image_data.data) + len(prompt)
+        if self._pending and (
+            len(self._pending) >= self.max_requests
+            or self._pending_bytes + size > self.max_bytes
+        ):
+            self.flush()
+        self._pending.append(request)
+        self._pending_ids.add(cid)
+        self._pending_bytes += size
+        return True
+
+    def flush(self) -> Optional[str]:
+        """Submit the queued requests as one batch, returns its id."""
+        if not self._pending:
+            return None
+        requests = self._pending
+        with stage("batch_submit", backend=BACKEND):
+            batch = self.client.messages.batches.create(
+                requests=[
+                    {"custom_id": r["custom_id"], "params": r["params"]}
+                    for r in requests
+                ]
+            )
+        # Kept queued until the submission succeeded
+        self._pending, self._pending_ids, self._pending_bytes = [], set(), 0
+        count("batch_requests", len(requests), backend=BACKEND)
+        count(
+            "image_bytes_sent",
+            sum(r["image_bytes"] for r in requests),
+            backend=BACKEND,
+        )
+        record = {
+            "batch": batch.id,
+            "requests": {r["custom_id"]: r["key"] for r in requests},
+        }
+        self._write(record)
+        self._replay(record)
+        print(f"Submitted batch {batch.id} of {len(requests)} requests")
+        return batch.id
+
+    def poll(self) -> List[str]:
+        """Collect the results of the batches that ended, returns their ids."""
+        ended = []
+        for batch_id in self.unfinished_batches:
+            with stage("batch_poll", backend=BACKEND):
+                batch = self.client.messages.batches.retrieve(batch_id)
+            if batch.processing_status != "ended":
+                continue
+            for key, prediction, failure in self._results(batch_id):
+                if failure is None:
+                    self.predictions[key] = prediction
+                    self.failures.pop(key, None)
+                else:
+                    self.failures[key] = failure
+            self._write({"ended": batch_id})
+            self._ended.add(batch_id)
+            ended.append(batch_id)
+        return ended
+
+    def _results(
+        self, batch_id: str
+    ) -> Iterator[Tuple[Key, Optional[dict], Optional[str]]]:
+        with stage("batch_results", backend=BACKEND):
+            for entry in self.client.messages.batches.results(batch_id):
+                key = self._keys.get(entry.custom_id)
+                if key is None or self._latest[key] != entry.custom_id:
+                    continue
+                result = entry.result
+                if result.type == "succeeded":
+                    message = result.message
+                    text = "".join(
+                        block.text for block in message.content if block.type == "text"
+                    )
+                    prediction = safe_json_parse(text)
+                    usage = getattr(message, "usage", None)
+                    if usage is not None:
+                        count(
+                            "input_tokens",
+                            usage.input_tokens,
+                            backend=BACKEND,
+                        )
+                        count(
+                            "output_tokens",
+                            usage.output_tokens,
+                            backend=BACKEND,
+                        )
+                    self._write({"id": entry.custom_id, "prediction": prediction})
+                    yield key, prediction, None
+                else:
+                    count("batch_failures", backend=BACKEND, reason=result.type)
+                    self._write({"id": entry.custom_id, "failure": result.type})
+                    yield key, None, result.type
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """
+        Poll until every submitted batch ended.
+
+        Raises:
+            TimeoutError: If batches are still running after `timeout` seconds.
+        """
+        self.flush()
+        start = time.monotonic()
+        while True:
+            self.poll()
+            remaining = self.unfinished_batches
+            if not remaining:
+                return
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"Batches still running: {', '.join(remaining)}")
+            print(
+                f"{len(remaining)} batches running, {len(self.predictions)} results received"
+            )
+            time.sleep(self.poll_interval)
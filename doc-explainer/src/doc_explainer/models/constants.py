@@ -2,3 +2,27 @@ SYSTEM_MESSAGE = """You are a Vision Language Model specialized in extracting in
 Your task is to analyze the provided document image and extract relevant information accurately.
 Documents may contain text, tables, forms, and structured or unstructured data.
 Ensure responses are precise and concise, without additional explanations unless required for clarity."""
+
+# Checkpoints and generation parameters of each backend. They are part of the
+# prediction cache key, so changing them invalidates the cached predictions.
+SMOL_MODEL_ID = "HuggingFaceTB/SmolVLM2-2.2B-Instruct"
+SMOL_GENERATION_PARAMS = {"do_sample": False, "max_new_tokens": 2056}
+
+QWEN_MODEL_ID = "Qwen/Qwen2.5-VL-7B-Instruct"
+QWEN_GENERATION_PARAMS = {"max_new_tokens": 256}
+
+# Box regressor of DocExplainer
+EXPLAINER_MODEL_ID = "letxbe/DocExplainer"
+
+CLAUDE_MODEL_ID = "claude-sonnet-4-20250514"
+CLAUDE_GENERATION_PARAMS = {"max_tokens": 4096}
+
+# Prompt asking all the questions about a page in one Claude request, see
+# `ClaudeBackend`. Each task is the prompt of one question.
+MULTI_QUESTION_PROMPT = """The following {NUM_TASKS} tasks are about the same document image. Carry out each task independently, as if it were the only one.
+
+{TASKS}
+
+Answer with a JSON list of {NUM_TASKS} objects: the response to task 1 first, then to task 2, and so on. Each object follows the JSON format its task asks for. Provide only the JSON list without any additional text or formatting."""
+
+MULTI_QUESTION_TASK = "### Task {INDEX}\n{PROMPT}"
@@ -0,0 +1,112 @@
+import importlib.util
+from typing import Any, Dict, Optional
+
+import torch
+import torch.nn as nn
+
+# Precisions of the local backends: bfloat16 weights, or float32 weights whose
+# linear layers are then quantized to int8 (CPU only)
+QUANTIZATIONS = ("bf16", "int8")
+
+# Attribute set on the models quantized by `quantize`, see `quantization_of`
+_QUANTIZATION_ATTR = "_doc_explainer_quantization"
+
+
+def resolve_device(device: Optional[str] = "auto") -> str:
+    """
+    Device to load a local model on.
+
+    Args:
+        device: "auto" (or None) for the first GPU when there is one and the CPU
+            otherwise, or any torch device ("cpu", "cuda", "cuda:1", "mps").
+
+    Returns:
+        str: The torch device.
+    """
+    if device in (None, "auto"):
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def attention_implementation(device: str) -> str:
+    """
+    Fastest attention kernel available on the device.
+
+    FlashAttention 2 needs a GPU and the `flash-attn` package; otherwise the
+    PyTorch scaled dot-product attention (SDPA) kernels are used, and the eager
+    implementation as a last resort.
+    """
+    if device.startswith("cuda") and importlib.util.find_spec("flash_attn"):
+        return "flash_attention_2"
+    if hasattr(nn.functional, "scaled_dot_product_attention"):
+        return "sdpa"
+    return "eager"
+
+
+def load_options(
+    device: str, quantization: Optional[str] = None, default_dtype: Any = None
+) -> Dict[str, Any]:
+    """
+    Keyword arguments of `from_pretrained` for a device and precision.
+
+    Args:
+        device: Resolved device, see `resolve_device`.
+        quantization: None for the default precision of the device (the
+            backend's `default_dtype` on GPU, float32 on CPU), "bf16", or "int8"
+            to load float32 weights for `quantize` (CPU only).
+        default_dtype: Precision of the backend on GPU.
+
+    Returns:
+        Dict[str, Any]: torch_dtype, device_map and attn_implementation.
+    """
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise ValueError(
+            f"Unsupported quantization: {quantization}, use one of {QUANTIZATIONS}"
+        )
+    on_cpu = device == "cpu"
+    if quantization == "int8" and not on_cpu:
+        raise ValueError("int8 quantization is only supported on CPU")
+
+    if quantization == "bf16":
+        dtype = torch.bfloat16
+    elif on_cpu:
+        dtype = torch.float32
+    else:
+        dtype = default_dtype if default_dtype is not None else "auto"
+
+    return {
+        "torch_dtype": dtype,
+        "device_map": "auto" if device == "cuda" else device,
+        "attn_implementation": attention_implementation(device),
+    }
+
+
+def quantize(model: nn.Module, quantization: Optional[str]) -> nn.Module:
+    """
+    Apply dynamic int8 quantization to the linear layers of a CPU model.
+
+    Weights are stored in int8 and activations quantized on the fly, which
+    roughly halves the memory of the model and speeds up the matrix products
+    on x86 CPUs. Other precisions are set at load time and leave the model
+    unchanged.
+    """
+    if quantization != "int8":
+        return model
+    model = torch.ao.quantization.quantize_dynamic(
+        model, {nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    setattr(model, _QUANTIZATION_ATTR, quantization)
+    return model
+
+
+def quantization_of(model: Any) -> Optional[str]:
+    """Quantization applied by `quantize`, None for an unquantized model."""
+    return getattr(model, _QUANTIZATION_ATTR, None)
+
+
+def set_num_threads(num_threads: Optional[int]) -> None:
+    """Number of threads used by torch for CPU inference (None keeps the default)."""
+    if num_threads is not None:
+        if num_threads < 1:
+            raise ValueError(f"Invalid number of threads: {num_threads}")
+        torch.set_num_threads(num_threads)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from ..instrumentation import count, enabled, stage
+from .parsing import safe_json_parse
+
+FAKE_MODEL_ID = "fake-vlm"
+
+
+def _digest(*parts: str) -> bytes:
+    return hashlib.sha256("\x00".join(parts).encode()).digest()
+
+
+class FakeVLM:
+    """
+    Offline stand-in for a VLM backend, used by the benchmarks and tests.
+
+    Answers are derived from a hash of the prompt and image size, so the same
+    inputs always give the same prediction, and are returned as raw JSON text
+    that goes through the same parsing as the real backends. Nothing is
+    downloaded and no network is needed.
+
+    Example:
+        model = FakeVLM(latency=0.05)
+        prediction = generate_prediction("Question?", image, "fake", model, None)
+
+    Attributes:
+        latency (float): Seconds slept per prediction, to simulate a model.
+        response (Optional[dict]): Canned prediction returned for every prompt.
+            When None, a deterministic {"content", "position"} answer is derived
+            from the inputs.
+        failure_rate (float): Fraction of the inputs (chosen by hash) for which
+            the model returns text that is not JSON.
+        calls (int): Number of predictions made.
+        batch_sizes (List[int]): Size of every `generate_batch` call.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        response: Optional[Dict[str, Any]] = None,
+        failure_rate: float = 0.0,
+    ):
+        self.latency = latency
+        self.response = response
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.batch_sizes: List[int] = []
+
+    def generate(self, prompt: str, image: Image.Image) -> str:
+        """Return the raw text output of the model."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self._answer(prompt, image)
+
+    def generate_batch(
+        self, prompts: List[str], images: List[Image.Image]
+    ) -> List[str]:
+        """Same outputs as `generate`, with one `latency` for the whole batch."""
+        self.batch_sizes.append(len(prompts))
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return [self._answer(prompt, image) for prompt, image in zip(prompts, images)]
+
+    def _answer(self, prompt: str, image: Image.Image) -> str:
+        self.calls += 1
+        digest = _digest(prompt, f"{image.size}")
+        if digest[0] / 256 < self.failure_rate:
+            return "I cannot answer this question."
+        if self.response is not None:
+            return json.dumps(self.response)
+
+        x, y = digest[1] * 3, digest[2] * 3
+        w, h = 20 + digest[3] % 200, 10 + digest[4] % 40
+        answer = f"answer-{digest[5:8].hex()}"
+        return json.dumps({"content": answer, "position": [x, y, w, h]})
+
+
+class FakeExplainer:
+    """
+    Stand-in for the DocExplainer box regressor (`letxbe/DocExplainer`).
+
+    `predict` returns a deterministic [x0, y0, x1, y1] box in [0, 1] derived
+    from the image size and text.
+
+    Attributes:
+        latency (float): Seconds slept per prediction.
+        calls (int): Number of predictions made.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def predict(self, image: Image.Image, text: str) -> List[float]:
+        self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        digest = _digest(text, f"{image.size}")
+        x0, y0 = digest[0] / 320, digest[1] / 320
+        return [x0, y0, x0 + digest[2] / 1280 + 0.01, y0 + digest[3] / 2560 + 0.01]
+
+
+def get_model_and_processor_fake():
+    """
+    Get a fake model with no latency; the fake backend has no processor.
+
+    Returns:
+        model: A `FakeVLM` instance.
+        processor: None.
+    """
+    return FakeVLM(), None
+
+
+def generate_prediction_fake(
+    prompt: str, image: Image.Image, model: FakeVLM, processor: Any = None
+) -> Optional[dict]:
+    with stage("generation", backend="fake"):
+        text = model.generate(prompt, image)
+    if enabled():
+        # Whitespace-separated words stand in for tokens
+        count("input_tokens", len(prompt.split()), backend="fake")
+        count("output_tokens", len(text.split()), backend="fake")
+    with stage("json_parsing", backend="fake"):
+        return safe_json_parse(text)
+
+
+def generate_predictions_fake(
+    prompts: List[str],
+    images: List[Image.Image],
+    model: FakeVLM,
+    processor: Any = None,
+) -> List[Optional[dict]]:
+    with stage("generation", backend="fake"):
+        texts = model.generate_batch(prompts, images)
+    if enabled():
+        count("input_tokens", sum(len(p.split()) for p in prompts), backend="fake")
+        count("output_tokens", sum(len(t.split()) for t in texts), backend="fake")
+    with stage("json_parsing", backend="fake"):
+        return [safe_json_parse(text) for text in texts]
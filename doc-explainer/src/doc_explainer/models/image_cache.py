@@ -0,0 +1,269 @@
+import base64
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from PIL import Image
+
+from ..instrumentation import count, stage
+from .cache import image_hash
+from .utils import VLMModel
+
+# Label of the stages and counters of the Claude backend, the only one sending
+# encoded pages
+BACKEND = VLMModel.CLAUDE.value
+
+# Formats of `encode_page`; "auto" picks one from the content of the page
+IMAGE_FORMATS = ("auto", "jpeg", "png", "webp")
+
+MEDIA_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+# Pages with at most this many colors (rendered documents, binarized scans)
+# are sent losslessly as PNG, which is also the smallest format for them
+MAX_PALETTE_COLORS = 256
+
+# Side of the sample of pixels used to count the colors of a page
+COLOR_SAMPLE_SIDE = 256
+
+# Largest base64 payload accepted by the API for an image; larger PNG pages
+# are sent as JPEG instead
+MAX_PAYLOAD_BYTES = 5 * 2**20
+
+# Default memory bound of the encoded payloads kept by an `EncodedImageCache`
+ENCODED_CACHE_MAX_BYTES = 256 * 2**20
+
+
+class EncodedImage(NamedTuple):
+    """Base64 payload of a page, as sent to the API."""
+
+    data: str
+    media_type: str
+    # Time spent encoding the page, saved by every reuse of the payload
+    seconds: float
+
+
+def choose_format(image: Image.Image) -> str:
+    """
+    Format to send a page in: PNG for pages with few colors, where it is both
+    lossless and smaller than JPEG, and JPEG for scans and photos. WebP is
+    only used when asked for: on noisy scans it is larger than JPEG at its
+    default quality, and 10 to 40 times slower to encode.
+    """
+    sample = image.resize(
+        (
+            min(image.width, COLOR_SAMPLE_SIDE),
+            min(image.height, COLOR_SAMPLE_SIDE),
+        ),
+        Image.NEAREST,
+    )
+    if sample.getcolors(MAX_PALETTE_COLORS) is not None:
+        return "png"
+    return "jpeg"
+
+
+def encode_page(image: Image.Image, image_format: str = "jpeg") -> EncodedImage:
+    """
+    Base64 payload of a page.
+
+    Args:
+        image: Page image, in any mode.
+        image_format: One of `IMAGE_FORMATS`.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(
+            f"Unsupported image format: {image_format}, use one of {IMAGE_FORMATS}"
+        )
+    start = time.perf_counter()
+    if image_format == "auto":
+        image_format = choose_format(image)
+    data = _encode(image, image_format)
+    if image_format != "jpeg" and len(data) > MAX_PAYLOAD_BYTES:
+        image_format = "jpeg"
+        data = _encode(image, image_format)
+    return EncodedImage(data, MEDIA_TYPES[image_format], time.perf_counter() - start)
+
+
+def _encode(image: Image.Image, image_format: str) -> str:
+    if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    elif image_format == "webp" and image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    buffered = BytesIO()
+    image.save(buffered, format=image_format.upper())
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def _key(image: Image.Image) -> str:
+    with stage("image_hashing", backend=BACKEND):
+        return image_hash(image)
+
+
+class EncodedImageCache:
+    """
+    In-memory cache of the encoded payloads of the pages sent to Claude.
+
+    Datasets such as FATURA, VRDU or XFUND ask 10 to 35 questions about the
+    same page: the page is encoded once, keyed by the hash of its pixels, and
+    its payload reused by every question (see `image_hash`). When the payloads
+    exceed `max_bytes`, the least recently used ones are evicted. Pages are
+    encoded by a pool of `workers` threads (Pillow releases the GIL while
+    encoding), and concurrent requests for the same page wait for a single
+    encoding.
+
+    Encodings are timed as the "image_encoding" stage; hits and misses are
+    counted as "image_cache_hits" and "image_cache_misses", and the encoding
+    time saved by the hits as "image_encoding_seconds_saved" (see
+    `instrumentation`).
+
+    Example:
+        cache = EncodedImageCache(max_bytes=64 * 2**20)
+        payloads = cache.get_many(pages)
+
+    Attributes:
+        max_bytes (int): Memory bound of the cached payloads.
+        image_format (str): One of `IMAGE_FORMATS`.
+        workers (int): Threads encoding the pages of `get_many`.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = ENCODED_CACHE_MAX_BYTES,
+        image_format: str = "auto",
+        workers: int = 4,
+    ):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(
+                f"Unsupported image format: {image_format}, use one of {IMAGE_FORMATS}"
+            )
+        self.max_bytes = max_bytes
+        self.image_format = image_format
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, EncodedImage]" = OrderedDict()
+        self._encoding: Dict[str, Future] = {}
+        self._bytes = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "seconds_saved": 0.0}
+
+    def get(self, image: Image.Image) -> EncodedImage:
+        """Payload of a page, encoded in the calling thread on a miss."""
+        return self._get(_key(image), image).result()
+
+    def get_many(self, images: List[Image.Image]) -> List[EncodedImage]:
+        """Payloads of several pages, the distinct ones encoded in parallel."""
+        keys = [_key(image) for image in images]
+        futures = [
+            self._get(key, image, self._pool()) for key, image in zip(keys, images)
+        ]
+        return [future.result() for future in futures]
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="image-encoding"
+                )
+            return self._executor
+
+    def _get(
+        self,
+        key: str,
+        image: Image.Image,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> Future:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["seconds_saved"] += entry.seconds
+            else:
+                future = self._encoding.get(key)
+                waiting = future is not None
+                if not waiting:
+                    self._stats["misses"] += 1
+                    future = self._encoding[key] = Future()
+
+        if entry is not None:
+            count("image_cache_hits", backend=BACKEND)
+            count("image_encoding_seconds_saved", entry.seconds, backend=BACKEND)
+            future = Future()
+            future.set_result(entry)
+            return future
+        if waiting:
+            # Encoded by another caller
+            return future
+
+        count("image_cache_misses", backend=BACKEND)
+        if executor is None:
+            self._encode(key, image, future)
+        else:
+            executor.submit(self._encode, key, image, future)
+        return future
+
+    def _encode(self, key: str, image: Image.Image, future: Future) -> None:
+        try:
+            with stage("image_encoding", backend=BACKEND):
+                encoded = encode_page(image, self.image_format)
+        except BaseException as error:
+            with self._lock:
+                self._encoding.pop(key, None)
+            future.set_exception(error)
+            return
+        with self._lock:
+            self._encoding.pop(key, None)
+            if key not in self._entries:
+                self._entries[key] = encoded
+                self._bytes += len(encoded.data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.data)
+                self._stats["evictions"] += 1
+        future.set_result(encoded)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def close(self) -> None:
+        """Stop the encoding threads."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict with the number of hits, misses and evictions, the encoding
+            time saved by the hits, and the number and bytes of the cached
+            payloads.
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_image_cache = EncodedImageCache()
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> EncodedImageCache:
+    return _image_cache
+
+
+def set_image_cache(cache: EncodedImageCache) -> None:
+    """Replace the cache of encoded pages used by the Claude backend."""
+    global _image_cache
+    with _image_cache_lock:
+        previous, _image_cache = _image_cache, cache
+    if previous is not cache:
+        previous.close()
@@ -0,0 +1,23 @@
+import json
+import re
+
+
+def safe_json_parse(text):
+    # Remove leading/trailing spaces
+    text = text.strip()
+
+    # Extract JSON-like part
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        candidate = match.group(0)
+    else:
+        return None
+
+    # Fix common trailing comma issues
+    candidate = re.sub(r",\s*}", "}", candidate)
+    candidate = re.sub(r",\s*\]", "]", candidate)
+
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
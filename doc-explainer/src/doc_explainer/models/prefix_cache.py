@@ -0,0 +1,249 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+from PIL.Image import Image
+
+from ..instrumentation import count, stage
+from .cache import image_hash
+
+# Default memory bound of the cached prefixes. The prefix of a SmolVLM page
+# (about 1,500 tokens) takes about 300 MB in bfloat16.
+PREFIX_CACHE_MAX_BYTES = 2 * 2**30
+
+# Inputs aligned with the tokens, cut at the end of the prefix. The others
+# (pixel values, image grids...) describe the image of the prefix only.
+SEQUENCE_INPUTS = ("input_ids", "attention_mask", "mm_token_type_ids")
+
+# Attributes of the base model that depend on the prefix, saved with it.
+# Qwen2.5-VL keeps the offset of its multimodal rotary positions there.
+PREFIX_STATE = ("rope_deltas",)
+
+
+def prefix_length(input_ids: Any, image_token_ids: Sequence[int]) -> int:
+    """
+    Length of the prefix shared by every question about a page: the tokens up
+    to the last image token (system message and page), 0 without image.
+
+    Args:
+        input_ids: Token ids of one prompt, shape (1, length).
+        image_token_ids: Ids of the tokens standing for the image.
+    """
+    ids = input_ids[0].tolist()
+    positions = [i for i, token in enumerate(ids) if token in image_token_ids]
+    return positions[-1] + 1 if positions else 0
+
+
+def cache_bytes(cache: Any) -> int:
+    """Memory held by the keys and values of a `transformers` cache."""
+    total = 0
+    for layer in getattr(cache, "layers", []):
+        for tensor in (getattr(layer, "keys", None), getattr(layer, "values", None)):
+            if tensor is not None:
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class _Prefix:
+    __slots__ = ("model", "page", "cache", "length", "bytes", "state")
+
+    def __init__(self, model: Any, page: str, length: int):
+        self.model = weakref.ref(model)
+        self.page = page
+        self.cache = None
+        self.length = length
+        self.bytes = 0
+        self.state: Dict[str, Any] = {}
+
+
+class PrefixCache:
+    """
+    Key/value cache of the prompt prefix of each page, shared by the questions
+    about it.
+
+    The prompts of the local backends start with the system message and the
+    page, followed by the question. The first question about a page runs the
+    vision encoder and prefills the prefix once; every later question only
+    prefills its own suffix on top of the stored keys and values, which are
+    cropped back to the prefix after generation. The vision encoder outputs
+    are only consumed by the prefix, so they are reused along with it. Under
+    greedy decoding, the predictions are the same as without the cache.
+
+    Prefixes are keyed by model, page (`image_hash`) and prefix tokens. The least
+    recently used ones are evicted when they exceed `max_bytes`, and
+    `evict_pages` drops the prefixes of pages that will not be asked about
+    again, e.g. once a document is done.
+
+    Prefills are timed as the "prefix_prefill" stage; hits, misses and reused
+    tokens are counted as "prefix_cache_hits", "prefix_cache_misses" and
+    "prefix_tokens_reused" (see `instrumentation`).
+
+    The saved state (`PREFIX_STATE`) is restored on the model itself, so the
+    calls on a same model are serialized: the state of another page must not
+    be restored while a prompt is generating.
+
+    Example:
+        set_prefix_cache(PrefixCache(max_bytes=4 * 2**30))
+        predictions = generate_prediction_batch(prompts, pages, "smolvlm", model, processor)
+
+    Attributes:
+        max_bytes (int): Memory budget of the cached prefixes. The prefix in
+            use is always kept, even alone over the budget.
+    """
+
+    def __init__(self, max_bytes: int = PREFIX_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Prefix]" = OrderedDict()
+        # Lock of each model, held from restoring the state of a prefix to the
+        # end of the generation
+        self._model_locks: "weakref.WeakKeyDictionary[Any, threading.Lock]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def generate(
+        self,
+        model: Any,
+        inputs: Dict[str, Any],
+        page: Image,
+        length: int,
+        backend: str,
+        **params,
+    ) -> Any:
+        """
+        `model.generate(**inputs, **params)` of one prompt, reusing the cached
+        prefix of its page.
+
+        Args:
+            model: Local VLM.
+            inputs: Processor outputs of one prompt (batch of 1).
+            page: Image of the prompt.
+            length: Prefix length, see `prefix_length`.
+            backend: Label of the instrumentation.
+
+        Returns:
+            The generated ids, prompt included, as `generate` returns them.
+        """
+        with self._lock:
+            model_lock = self._model_locks.setdefault(model, threading.Lock())
+        if length <= 0 or length >= inputs["input_ids"].shape[1]:
+            # Also sets the state of the model, e.g. the rotary offset of Qwen
+            with model_lock:
+                return model.generate(**inputs, **params)
+
+        digest = hashlib.sha256(
+            inputs["input_ids"][0, :length].cpu().numpy().tobytes()
+        ).hexdigest()
+        key = (id(model), image_hash(page), digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.model() is not model:
+                entry = self._entries[key] = _Prefix(model, key[1], length)
+            self._entries.move_to_end(key)
+
+        with model_lock:
+            base = model.base_model
+            if entry.cache is None:
+                self._prefill(model, entry, inputs, key, backend)
+            else:
+                with self._lock:
+                    self._stats["hits"] += 1
+                count("prefix_cache_hits", backend=backend)
+            count("prefix_tokens_reused", length, backend=backend)
+
+            for name, value in entry.state.items():
+                setattr(base, name, value)
+            try:
+                return model.generate(
+                    **{
+                        name: inputs[name] for name in SEQUENCE_INPUTS if name in inputs
+                    },
+                    past_key_values=entry.cache,
+                    **params,
+                )
+            finally:
+                entry.cache.crop(entry.length - entry.cache.get_seq_length())
+
+    def _prefill(
+        self,
+        model: Any,
+        entry: _Prefix,
+        inputs: Dict[str, Any],
+        key: Hashable,
+        backend: str,
+    ) -> None:
+        import torch
+
+        prefix = {
+            name: value[:, : entry.length] if name in SEQUENCE_INPUTS else value
+            for name, value in inputs.items()
+        }
+        with stage("prefix_prefill", backend=backend), torch.no_grad():
+            # The base model, without the language modeling head on every token
+            outputs = model.base_model(**prefix, use_cache=True)
+        entry.cache = outputs.past_key_values
+        entry.bytes = cache_bytes(entry.cache)
+        entry.state = {
+            name: getattr(model.base_model, name)
+            for name in PREFIX_STATE
+            if getattr(model.base_model, name, None) is not None
+        }
+        with self._lock:
+            self._stats["misses"] += 1
+            self._evict(keep=key)
+        count("prefix_cache_misses", backend=backend)
+
+    def _evict(self, keep: Hashable) -> None:
+        # Called with the lock held
+        for key in list(self._entries):
+            if self.loaded_bytes() <= self.max_bytes:
+                break
+            if key != keep:
+                del self._entries[key]
+                self._stats["evictions"] += 1
+
+    def loaded_bytes(self) -> int:
+        return sum(entry.bytes for entry in self._entries.values())
+
+    def evict_pages(self, pages: List[Image]) -> int:
+        """Drop the prefixes of these pages, returns how many were dropped."""
+        hashes = {image_hash(page) for page in pages if page is not None}
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry.page in hashes]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict with the number of hits, misses and evictions, and the number
+            and bytes of the cached prefixes.
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self.loaded_bytes(),
+                "max_bytes": self.max_bytes,
+            }
+
+
+_prefix_cache: Optional[PrefixCache] = None
+
+
+def set_prefix_cache(cache: Optional[PrefixCache]) -> None:
+    """Reuse the page prefixes in the local backends (None to disable)."""
+    global _prefix_cache
+    _prefix_cache = cache
+
+
+def get_prefix_cache() -> Optional[PrefixCache]:
+    return _prefix_cache
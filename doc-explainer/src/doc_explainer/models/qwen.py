@@ -1,52 +1,44 @@
 import json
 import re
+from typing import List, Optional
 
 from PIL import Image
 from qwen_vl_utils import process_vision_info
 from transformers import AutoProcessor, Qwen2_5_VLForConditionalGeneration
 
-from .constants import SYSTEM_MESSAGE
+from ..instrumentation import count, stage
+from .constants import QWEN_GENERATION_PARAMS, QWEN_MODEL_ID, SYSTEM_MESSAGE
+from .device import load_options, quantize, resolve_device
+from .prefix_cache import get_prefix_cache, prefix_length
 
 
-def get_model_and_processor_qwen():
+def get_model_and_processor_qwen(
+    device: Optional[str] = "auto", quantization: Optional[str] = None
+):
     """
     Get the Qwen2.5-VL model and processor.
 
+    Args:
+        device: Device to load the model on, see `resolve_device`.
+        quantization: Precision of the model, see `load_options`.
+
     Returns:
         model: The loaded model instance.
         processor: The processor instance for the model.
     """
     model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
-        "Qwen/Qwen2.5-VL-7B-Instruct",
-        torch_dtype="auto",
-        device_map="auto",
-        attn_implementation="flash_attention_2",
+        QWEN_MODEL_ID,
+        **load_options(resolve_device(device), quantization, "auto"),
     )
+    model = quantize(model, quantization)
 
-    processor = AutoProcessor.from_pretrained("Qwen/Qwen2.5-VL-7B-Instruct")
+    processor = AutoProcessor.from_pretrained(QWEN_MODEL_ID)
 
     return model, processor
 
 
-def generate_prediction_qwen(
-    prompt: str,
-    image: Image,
-    model: Qwen2_5_VLForConditionalGeneration,
-    processor: AutoProcessor,
-):
-    """
-    Generate prediction using Qwen2.5-VL model.
-
-    Args:
-        prompt (str): The text prompt for the model
-        image (Image): PIL Image object
-        model: The Qwen2.5-VL model instance
-        processor: The processor instance
-
-    Returns:
-        dict or None: JSON response if valid, None if parsing fails
-    """
-    messages = [
+def _messages(prompt: str, image: Image) -> List[dict]:
+    return [
         {"role": "system", "content": [{"type": "text", "text": SYSTEM_MESSAGE}]},
         {
             "role": "user",
@@ -60,34 +52,9 @@ def generate_prediction_qwen(
         },
     ]
 
-    # Preparation for inference
-    text = processor.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True
-    )
-    image_inputs, video_inputs = process_vision_info(messages)
-    inputs = processor(
-        text=[text],
-        images=image_inputs,
-        videos=video_inputs,
-        padding=True,
-        return_tensors="pt",
-    )
-    inputs = inputs.to("cuda")
-
-    # Inference: Generation of the output
-    generated_ids = model.generate(**inputs, max_new_tokens=256)
-    generated_ids_trimmed = [
-        out_ids[len(in_ids) :]
-        for in_ids, out_ids in zip(inputs.input_ids, generated_ids, strict=False)
-    ]
-    output_text = processor.batch_decode(
-        generated_ids_trimmed,
-        skip_special_tokens=True,
-        clean_up_tokenization_spaces=False,
-    )
-
-    decoded_output = output_text[0].strip()
 
+def parse_qwen_output(decoded_output: str) -> Optional[dict]:
+    """Parse the JSON answer of Qwen, with or without a markdown code block."""
     # Extract JSON using regex to handle various markdown formats
     json_pattern = r"```(?:json)?\s*\n?(.*?)\n?```"
     match = re.search(json_pattern, decoded_output, re.DOTALL)
@@ -99,7 +66,121 @@ def generate_prediction_qwen(
         json_str = decoded_output
 
     try:
-        json_response = json.loads(json_str)
-        return json_response
+        return json.loads(json_str)
     except json.JSONDecodeError:
         return None
+
+
+def _inputs(
+    prompts: List[str],
+    images: List[Image],
+    model: Qwen2_5_VLForConditionalGeneration,
+    processor: AutoProcessor,
+):
+    conversations = [_messages(prompt, image) for prompt, image in zip(prompts, images)]
+    # Preparation for inference
+    with stage("prompt_processing", backend="qwen2.5-vl-7b"):
+        texts = [
+            processor.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+            for messages in conversations
+        ]
+        image_inputs, video_inputs = process_vision_info(conversations)
+        inputs = processor(
+            text=texts,
+            images=image_inputs,
+            videos=video_inputs,
+            padding=True,
+            return_tensors="pt",
+        )
+        return inputs.to(model.device)
+
+
+def generate_prediction_qwen(
+    prompt: str,
+    image: Image,
+    model: Qwen2_5_VLForConditionalGeneration,
+    processor: AutoProcessor,
+):
+    """
+    Generate prediction using Qwen2.5-VL model.
+
+    Args:
+        prompt (str): The text prompt for the model
+        image (Image): PIL Image object
+        model: The Qwen2.5-VL model instance
+        processor: The processor instance
+
+    Returns:
+        dict or None: JSON response if valid, None if parsing fails
+    """
+    return generate_predictions_qwen([prompt], [image], model, processor)[0]
+
+
+def generate_predictions_qwen(
+    prompts: List[str],
+    images: List[Image],
+    model: Qwen2_5_VLForConditionalGeneration,
+    processor: AutoProcessor,
+) -> List[Optional[dict]]:
+    """
+    Generate the predictions of several (prompt, image) pairs in one `generate` call.
+
+    Prompts are left-padded so that every sequence ends where generation starts.
+    Qwen encodes images at their native resolution, so images of similar sizes
+    waste less padding, see `bucket_by_image_size`.
+
+    When a `PrefixCache` is set, the prompts are generated one at a time on the
+    cached prefix (system message and page) of their page instead.
+
+    Returns:
+        List[Optional[dict]]: Parsed JSON response of each pair, None if parsing fails.
+    """
+    # Generation continues after the last token, so pad on the left
+    processor.tokenizer.padding_side = "left"
+
+    prefix_cache = get_prefix_cache()
+    if prefix_cache is None:
+        inputs = _inputs(prompts, images, model, processor)
+        # Inference: Generation of the output
+        with stage("generation", backend="qwen2.5-vl-7b"):
+            generated_ids = model.generate(**inputs, **QWEN_GENERATION_PARAMS)
+        generated_ids_trimmed = [
+            out_ids[len(in_ids) :]
+            for in_ids, out_ids in zip(inputs.input_ids, generated_ids, strict=False)
+        ]
+        input_tokens = int(inputs.attention_mask.sum())
+    else:
+        generated_ids_trimmed, input_tokens = [], 0
+        for prompt, image in zip(prompts, images):
+            inputs = _inputs([prompt], [image], model, processor)
+            length = prefix_length(inputs.input_ids, [model.config.image_token_id])
+            with stage("generation", backend="qwen2.5-vl-7b"):
+                generated_ids = prefix_cache.generate(
+                    model,
+                    inputs,
+                    image,
+                    length,
+                    "qwen2.5-vl-7b",
+                    **QWEN_GENERATION_PARAMS,
+                )
+            generated_ids_trimmed.append(generated_ids[0, inputs.input_ids.shape[1] :])
+            input_tokens += int(inputs.attention_mask.sum())
+
+    pad_token_id = processor.tokenizer.pad_token_id
+    count("input_tokens", input_tokens, backend="qwen2.5-vl-7b")
+    count(
+        "output_tokens",
+        sum(int((ids != pad_token_id).sum()) for ids in generated_ids_trimmed),
+        backend="qwen2.5-vl-7b",
+    )
+    with stage("decoding", backend="qwen2.5-vl-7b"):
+        output_text = processor.batch_decode(
+            generated_ids_trimmed,
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False,
+        )
+
+    with stage("json_parsing", backend="qwen2.5-vl-7b"):
+        return [parse_qwen_output(text.strip()) for text in output_text]
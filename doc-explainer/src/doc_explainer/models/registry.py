@@ -0,0 +1,230 @@
+import gc
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from ..instrumentation import count, stage
+from .constants import EXPLAINER_MODEL_ID
+from .device import resolve_device
+from .utils import VLMModel, get_model_and_processor
+
+
+def model_bytes(model: Any) -> int:
+    """
+    Memory held by the tensors of a model (parameters, buffers and quantized
+    weights), 0 for objects that are not torch modules.
+
+    Tuples and lists, such as a (model, processor) pair, are summed.
+    """
+    if isinstance(model, (tuple, list)):
+        return sum(model_bytes(item) for item in model)
+    if not isinstance(model, nn.Module):
+        return 0
+
+    def size(value: Any) -> int:
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(size(item) for item in value)
+        return 0
+
+    return sum(size(value) for value in model.state_dict(keep_vars=True).values())
+
+
+class _Entry:
+    __slots__ = ("value", "bytes", "load_seconds")
+
+    def __init__(self, value: Any, bytes: int, load_seconds: float):
+        self.value = value
+        self.bytes = bytes
+        self.load_seconds = load_seconds
+
+
+class ModelRegistry:
+    """
+    Process-wide store of loaded models, shared by every `DocExplainer`.
+
+    Each model is loaded once per key (model, device, precision) on first use,
+    and the least recently used models are evicted when the loaded ones exceed
+    `max_bytes`. Evicted models are reloaded on their next use; memory is only
+    given back once no caller holds a reference to them, which `DocExplainer`
+    avoids by looking its models up on every call.
+
+    Loads are timed as the "model_load" stage, see `instrumentation`, and
+    counted with the evictions in `stats`.
+
+    Example:
+        set_registry(ModelRegistry(max_bytes=20 * 2**30))
+        smol = DocExplainer("smolvlm")
+        qwen = DocExplainer("qwen2.5-vl-7b")  # shares the explainer of smol
+
+    Attributes:
+        max_bytes (Optional[int]): Memory budget of the loaded models, None for
+            no limit. The model being loaded is always kept, even alone over
+            the budget.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._loading: Dict[Hashable, threading.Lock] = {}
+        # Size of every model loaded so far, to make room before reloading one
+        self._known_bytes: Dict[Hashable, int] = {}
+        self._stats = {"hits": 0, "loads": 0, "evictions": 0, "load_seconds": 0.0}
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        The model stored under `key`, loaded with `loader()` if needed.
+
+        Concurrent calls for the same key wait for a single load.
+        """
+        with self._lock:
+            entry = self._hit(key)
+            if entry is not None:
+                return entry.value
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._hit(key)
+                if entry is not None:
+                    return entry.value
+                expected = self._known_bytes.get(key, 0)
+                evicted = self._evict(expected)
+            self._release(evicted)
+
+            start = time.perf_counter()
+            with stage(
+                "model_load", model=str(key[0] if isinstance(key, tuple) else key)
+            ):
+                value = loader()
+            seconds = time.perf_counter() - start
+
+            with self._lock:
+                entry = _Entry(value, model_bytes(value), seconds)
+                self._entries[key] = entry
+                self._known_bytes[key] = entry.bytes
+                self._stats["loads"] += 1
+                self._stats["load_seconds"] += seconds
+                evicted = self._evict(0, keep=key)
+                self._loading.pop(key, None)
+            self._release(evicted)
+            return value
+
+    def _hit(self, key: Hashable) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        return entry
+
+    def _evict(self, incoming: int, keep: Optional[Hashable] = None) -> list:
+        # Called with the lock held; returns the evicted models, released outside it
+        evicted = []
+        if self.max_bytes is None:
+            return evicted
+        for key in list(self._entries):
+            if self.loaded_bytes() + incoming <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            evicted.append(self._entries.pop(key).value)
+            self._stats["evictions"] += 1
+            count("model_evictions")
+        return evicted
+
+    @staticmethod
+    def _release(evicted: list) -> None:
+        if not evicted:
+            return
+        evicted.clear()
+        gc.collect()
+        # Only look at torch.cuda if a GPU is in use
+        if "torch" in sys.modules and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def loaded_bytes(self) -> int:
+        return sum(entry.bytes for entry in self._entries.values())
+
+    def evict(self, key: Hashable) -> bool:
+        """Drop a model, returns whether it was loaded."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            evicted = [self._entries.pop(key).value]
+        self._release(evicted)
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            evicted = [entry.value for entry in self._entries.values()]
+            self._entries.clear()
+        self._release(evicted)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict with the number of hits, loads and evictions, the total load
+            time, the loaded bytes and one entry per loaded model (key, bytes,
+            load_seconds), least recently used first.
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                "loaded_bytes": self.loaded_bytes(),
+                "max_bytes": self.max_bytes,
+                "models": [
+                    {
+                        "key": list(key) if isinstance(key, tuple) else key,
+                        "bytes": entry.bytes,
+                        "load_seconds": entry.load_seconds,
+                    }
+                    for key, entry in self._entries.items()
+                ],
+            }
+
+    def vlm(
+        self,
+        model_name: str,
+        device: Optional[str] = "auto",
+        quantization: Optional[str] = None,
+    ) -> Tuple[Any, Any]:
+        """The (model, processor) pair of a VLM, see `get_model_and_processor`."""
+        device = resolve_device(device)
+        return self.get(
+            (VLMModel(model_name).value, device, quantization),
+            lambda: get_model_and_processor(model_name, device, quantization),
+        )
+
+    def explainer(self) -> Any:
+        """The DocExplainer box regressor (`letxbe/DocExplainer`)."""
+        from transformers import AutoModel
+
+        return self.get(
+            (EXPLAINER_MODEL_ID,),
+            lambda: AutoModel.from_pretrained(
+                EXPLAINER_MODEL_ID, trust_remote_code=True
+            ),
+        )
+
+
+_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    return _registry
+
+
+def set_registry(registry: ModelRegistry) -> None:
+    """Replace the registry used by the `DocExplainer` instances created afterwards."""
+    global _registry
+    _registry = registry
@@ -0,0 +1,338 @@
+import math
+import threading
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from ..boxes import PIXELS, BoxArray, Scale
+from ..instrumentation import count, stage
+from .cache import image_hash
+
+# Backends are named after `VLMModel` values
+SMOLVLM, QWEN, CLAUDE = "smolvlm", "qwen2.5-vl-7b", "claude-sonnet-4"
+
+# Qwen2.5-VL: one token per 28x28 pixels (14 px patches merged 2x2), at most
+# 16384 tokens with the default `max_pixels` of `qwen_vl_utils`
+QWEN_TOKEN_PX = 28
+QWEN_MAX_TOKENS = 16384
+
+# SmolVLM2-2.2B: the processor resizes the longest side to 1536 px (upscaling
+# small pages too) and splits it into 384 px tiles of 81 tokens, plus the
+# whole page downscaled to one tile
+SMOL_MAX_SIDE = 1536
+SMOL_TILE_PX = 384
+SMOL_TILE_TOKENS = 81
+
+# Claude: about one token per 750 pixels. The API rejects images over 8000 px
+# and downscales those over 1568 px or 1.15 megapixels
+CLAUDE_PIXELS_PER_TOKEN = 750
+CLAUDE_MAX_SIDE = 8000
+CLAUDE_RESIZED_SIDE = 1568
+CLAUDE_RESIZED_PIXELS = 1_150_000
+
+# Largest side of the images accepted by each backend, enforced under any budget
+MAX_SIDES = {SMOLVLM: SMOL_MAX_SIDE, CLAUDE: CLAUDE_MAX_SIDE}
+
+# Longest side under which token budgets do not shrink a page: about 90 dpi on
+# a letter or A4 page, where body text stays readable
+LEGIBLE_SIDE = 1024
+
+
+class ResolutionBudget(NamedTuple):
+    """
+    Resolution of the pages sent to a backend.
+
+    Attributes:
+        max_tokens: Image tokens per page, None for no bound. Pages are
+            downscaled to the largest size within it, but not under `min_side`.
+        max_side: Longest side of the pages in pixels, None for no bound.
+        min_side: Longest side under which `max_tokens` does not shrink a page.
+        position_scale: Scale of the predicted "position" boxes: 1000 (or 1)
+            for boxes relative to the page, unchanged by resizing, "pixels" for
+            boxes in the pixels of the sent page, mapped back to the original.
+    """
+
+    max_tokens: Optional[int] = None
+    max_side: Optional[int] = None
+    min_side: int = LEGIBLE_SIDE
+    position_scale: Scale = 1000
+
+
+# Default budgets: about 130 dpi on a letter page for Qwen; SmolVLM within 12
+# tiles (3x3 on letter pages instead of 4x4); Claude at the side it downscales
+# to, which sends fewer bytes for the same tokens
+DEFAULT_BUDGETS = {
+    QWEN: ResolutionBudget(max_tokens=2048),
+    SMOLVLM: ResolutionBudget(max_tokens=13 * SMOL_TILE_TOKENS),
+    CLAUDE: ResolutionBudget(max_side=CLAUDE_RESIZED_SIDE),
+}
+
+
+class Resize(NamedTuple):
+    """Size a page is sent at, and the scale factors from the original."""
+
+    size: Tuple[int, int]
+    # (width, height) of the sent page divided by the original ones
+    scale: Tuple[float, float]
+    native_tokens: int
+    tokens: int
+
+
+def image_tokens(backend: str, size: Tuple[int, int]) -> int:
+    """Image tokens of a page of `size` (width, height) sent as is, 0 if unknown."""
+    width, height = size
+    if backend == QWEN:
+        tokens = max(1, round(width / QWEN_TOKEN_PX)) * max(
+            1, round(height / QWEN_TOKEN_PX)
+        )
+        if tokens > QWEN_MAX_TOKENS:
+            # Larger pages are downscaled by `qwen_vl_utils`, sides rounded down
+            ratio = math.sqrt(QWEN_MAX_TOKENS / (width * height))
+            tokens = math.floor(width * ratio) * math.floor(height * ratio)
+        return tokens
+    if backend == SMOLVLM:
+        # The longest side is rounded up to whole tiles first, the other one
+        # follows the aspect ratio and is rounded up in turn
+        long, short = max(size), min(size)
+        rows = math.ceil(long / SMOL_TILE_PX)
+        columns = math.ceil(int(rows * SMOL_TILE_PX * short / long) / SMOL_TILE_PX)
+        tiles = rows * columns
+        return SMOL_TILE_TOKENS * (tiles + 1 if tiles > 1 else 1)
+    if backend == CLAUDE:
+        pixels = width * height
+        shrink = min(
+            1.0,
+            CLAUDE_RESIZED_SIDE / max(size),
+            math.sqrt(CLAUDE_RESIZED_PIXELS / pixels),
+        )
+        return math.ceil(pixels * shrink**2 / CLAUDE_PIXELS_PER_TOKEN)
+    return 0
+
+
+def native_tokens(backend: str, size: Tuple[int, int]) -> int:
+    """Image tokens of a page sent without a `ResolutionPolicy`."""
+    if backend == SMOLVLM:
+        # Resized by the processor to its longest side, small pages included
+        size = _scaled(size, SMOL_MAX_SIDE)
+    return image_tokens(backend, size)
+
+
+def _scaled(size: Tuple[int, int], side: int) -> Tuple[int, int]:
+    # Size with the longest side brought to `side`, aspect ratio kept
+    width, height = size
+    ratio = side / max(size)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def fit(
+    size: Tuple[int, int], backend: str, budget: Optional[ResolutionBudget]
+) -> Resize:
+    """
+    Size to send a page of `size` (width, height) at, within the budget and the
+    limits of the backend. Pages are only downscaled, aspect ratio kept.
+    """
+    longest = max(size)
+    side = min(longest, MAX_SIDES.get(backend, longest))
+    if budget is not None:
+        if budget.max_side is not None:
+            side = min(side, budget.max_side)
+        if budget.max_tokens is not None:
+            floor = min(side, budget.min_side)
+            # Largest side within the budget, tokens grow with the side
+            low, high = floor, side
+            if image_tokens(backend, _scaled(size, high)) > budget.max_tokens:
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    if (
+                        image_tokens(backend, _scaled(size, middle))
+                        <= budget.max_tokens
+                    ):
+                        low = middle
+                    else:
+                        high = middle - 1
+                side = low
+    resized = size if side == longest else _scaled(size, side)
+    return Resize(
+        size=resized,
+        scale=(resized[0] / size[0], resized[1] / size[1]),
+        native_tokens=native_tokens(backend, size),
+        tokens=image_tokens(backend, resized),
+    )
+
+
+# Attribute caching the last resized copy of a page on the page, with the hash
+# of the page it was made from, see `ResolutionPolicy.apply`
+_RESIZED_ATTR = "_doc_explainer_resized"
+
+
+class ResolutionPolicy:
+    """
+    Resolution of the pages sent to the VLM backends.
+
+    Scans at 300 dpi make thousands of image tokens for Qwen, SmolVLM upscales
+    small pages to 16 tiles and Claude rejects pages over 8000 px. The policy
+    downscales each page to the largest size within the token budget of its
+    backend (see `ResolutionBudget`), with Lanczos filtering so that strokes
+    stay legible, and without going under the legibility floor. The hard limits
+    of the backends (`MAX_SIDES`) apply under any budget. With SmolVLM, the
+    processor no longer resizes the pages itself, so small pages keep their
+    size.
+
+    Budgets can be set per backend and per document source, e.g. to keep a
+    higher resolution for a source of small print.
+
+    Example:
+        set_resolution_policy(ResolutionPolicy(
+            budgets={"qwen2.5-vl-7b": ResolutionBudget(max_tokens=1280)},
+            sources={"docvqa": {"qwen2.5-vl-7b": ResolutionBudget(max_tokens=4096)}},
+        ))
+
+    Resizes are timed as the "image_resizing" stage; downscaled pages and the
+    image tokens saved are counted as "images_downscaled" and
+    "image_tokens_saved" (see `instrumentation`).
+
+    Attributes:
+        budgets (Dict[str, ResolutionBudget]): Budget of each backend, pages of
+            the others are only held to the hard limits.
+        sources (Dict[str, Dict[str, ResolutionBudget]]): Budgets of the
+            backends for the pages of a source, replacing `budgets`.
+    """
+
+    def __init__(
+        self,
+        budgets: Optional[Dict[str, ResolutionBudget]] = None,
+        sources: Optional[Dict[str, Dict[str, ResolutionBudget]]] = None,
+    ):
+        self.budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+        self.sources = sources or {}
+        self._lock = threading.Lock()
+        self._stats = {"pages": 0, "downscaled": 0, "native_tokens": 0, "tokens": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ResolutionPolicy":
+        """
+        Policy from a JSON-like config:
+        {"budgets": {backend: {"max_tokens": ...}}, "sources": {source: {backend: {...}}}}
+        """
+        return cls(
+            budgets={
+                backend: ResolutionBudget(**budget)
+                for backend, budget in config.get("budgets", {}).items()
+            },
+            sources={
+                source: {
+                    backend: ResolutionBudget(**budget)
+                    for backend, budget in budgets.items()
+                }
+                for source, budgets in config.get("sources", {}).items()
+            },
+        )
+
+    def budget(
+        self, backend: str, source: Optional[str] = None
+    ) -> Optional[ResolutionBudget]:
+        budget = self.sources.get(source, {}).get(backend)
+        return budget if budget is not None else self.budgets.get(backend)
+
+    def fit(
+        self, image: Image.Image, backend: str, source: Optional[str] = None
+    ) -> Resize:
+        """Size to send `image` at, see `fit`."""
+        return fit(image.size, backend, self.budget(backend, source))
+
+    def apply(self, image: Image.Image, resize: Resize, backend: str) -> Image.Image:
+        """
+        The page to send, resized if needed. The copy is kept on the page, so
+        the questions about a same page object resize it once; it is checked
+        against the hash of the pixels, since pages can be edited in place.
+        """
+        with self._lock:
+            self._stats["pages"] += 1
+            self._stats["native_tokens"] += resize.native_tokens
+            self._stats["tokens"] += resize.tokens
+            if resize.size != image.size:
+                self._stats["downscaled"] += 1
+        count(
+            "image_tokens_saved",
+            max(0, resize.native_tokens - resize.tokens),
+            backend=backend,
+        )
+        if resize.size == image.size:
+            return image
+
+        count("images_downscaled", backend=backend)
+        key = image_hash(image)
+        cached = getattr(image, _RESIZED_ATTR, None)
+        if cached is not None and cached[0] == key and cached[1].size == resize.size:
+            return cached[1]
+        with stage("image_resizing", backend=backend):
+            source = image
+            # Binary and palette pages are resampled in shades, so that thin
+            # strokes fade instead of disappearing
+            if source.mode == "1":
+                source = source.convert("L")
+            elif source.mode == "P":
+                source = source.convert("RGB")
+            resized = source.resize(
+                resize.size, Image.Resampling.LANCZOS, reducing_gap=3.0
+            )
+        setattr(image, _RESIZED_ATTR, (key, resized))
+        return resized
+
+    def restore(
+        self,
+        prediction: Any,
+        image: Image.Image,
+        resize: Resize,
+        backend: str,
+        source: Optional[str] = None,
+    ) -> Any:
+        """
+        Map the "position" of a prediction on the sent page back to the
+        original page, when the budget gives positions in pixels.
+        """
+        budget = self.budget(backend, source)
+        if (
+            budget is None
+            or budget.position_scale != PIXELS
+            or resize.size == image.size
+            or not isinstance(prediction, dict)
+        ):
+            return prediction
+        position = prediction.get("position")
+        if not (
+            isinstance(position, list)
+            and len(position) == 4
+            and all(isinstance(value, (int, float)) for value in position)
+        ):
+            return prediction
+        boxes = BoxArray(
+            [position], format="xywh", scale=PIXELS, image_size=resize.size
+        )
+        restored = boxes.to_scale(PIXELS, image.size).tolist()[0]
+        return {**prediction, "position": [round(value) for value in restored]}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict with the number of pages sent and downscaled, and their image
+            tokens at native resolution and as sent.
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                "tokens_saved": self._stats["native_tokens"] - self._stats["tokens"],
+            }
+
+
+_resolution_policy: Optional[ResolutionPolicy] = None
+
+
+def set_resolution_policy(policy: Optional[ResolutionPolicy]) -> None:
+    """Resize the pages sent to the backends (None to send them as they are)."""
+    global _resolution_policy
+    _resolution_policy = policy
+
+
+def get_resolution_policy() -> Optional[ResolutionPolicy]:
+    return _resolution_policy
@@ -1,58 +1,42 @@
-import json
-import re
+from typing import List, Optional
 
 import torch
 from PIL import Image
 from transformers import AutoModelForImageTextToText, AutoProcessor
 
-from .constants import SYSTEM_MESSAGE
+from ..instrumentation import count, stage
+from .constants import SMOL_GENERATION_PARAMS, SMOL_MODEL_ID, SYSTEM_MESSAGE
+from .device import load_options, quantize, resolve_device
+from .parsing import safe_json_parse
+from .prefix_cache import get_prefix_cache, prefix_length
+from .resolution import get_resolution_policy
 
 
-def safe_json_parse(text):
-    # Remove leading/trailing spaces
-    text = text.strip()
-
-    # Extract JSON-like part
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if match:
-        candidate = match.group(0)
-    else:
-        return None
-
-    # Fix common trailing comma issues
-    candidate = re.sub(r",\s*}", "}", candidate)
-    candidate = re.sub(r",\s*\]", "]", candidate)
-
-    try:
-        return json.loads(candidate)
-    except json.JSONDecodeError:
-        return None
+def get_model_and_processor_smol(
+    device: Optional[str] = "auto", quantization: Optional[str] = None
+):
+    """
+    Get the SMOL model and processor.
 
+    Args:
+        device: Device to load the model on, see `resolve_device`.
+        quantization: Precision of the model, see `load_options`.
 
-def get_model_and_processor_smol():
-    """
-    Get the SMOL model and processor.:
     Returns:
         model: The loaded model instance.
         processor: The processor instance for the model.
     """
     model = AutoModelForImageTextToText.from_pretrained(
-        "HuggingFaceTB/SmolVLM2-2.2B-Instruct",
-        torch_dtype=torch.bfloat16,
-        device_map="auto",
-        attn_implementation="flash_attention_2",
+        SMOL_MODEL_ID,
+        **load_options(resolve_device(device), quantization, torch.bfloat16),
     )
-    processor = AutoProcessor.from_pretrained("HuggingFaceTB/SmolVLM2-2.2B-Instruct")
+    model = quantize(model, quantization)
+    processor = AutoProcessor.from_pretrained(SMOL_MODEL_ID)
     return model, processor
 
 
-def generate_prediction_smol(
-    prompt: str,
-    image: Image,
-    model: AutoModelForImageTextToText,
-    processor: AutoProcessor,
-):
-    messages = [
+def _messages(prompt: str, image: Image) -> List[dict]:
+    return [
         {"role": "system", "content": [{"type": "system", "text": SYSTEM_MESSAGE}]},
         {
             "role": "user",
@@ -63,26 +47,92 @@ def generate_prediction_smol(
         },
     ]
 
-    # Output generation for SmolVLM2
-    inputs = processor.apply_chat_template(
-        messages,
-        tokenize=True,
-        return_dict=True,
-        return_tensors="pt",
-    ).to("cuda", dtype=torch.bfloat16)
-
-    input_length = inputs["input_ids"].shape[1]
-    generated_ids = model.generate(**inputs, do_sample=False, max_new_tokens=2056)
-
-    output_ids = generated_ids[:, input_length:]
-    generated_texts = processor.batch_decode(
-        output_ids,
-        skip_special_tokens=True,
+
+def _inputs(
+    prompts: List[str],
+    images: List[Image],
+    model: AutoModelForImageTextToText,
+    processor: AutoProcessor,
+):
+    # Pages sized by a `ResolutionPolicy` are not resized again (nor upscaled)
+    options = {} if get_resolution_policy() is None else {"do_resize": False}
+    with stage("prompt_processing", backend="smolvlm"):
+        return processor.apply_chat_template(
+            [_messages(prompt, image) for prompt, image in zip(prompts, images)],
+            tokenize=True,
+            return_dict=True,
+            return_tensors="pt",
+            padding=True,
+            **options,
+        ).to(model.device, dtype=model.dtype)
+
+
+def generate_prediction_smol(
+    prompt: str,
+    image: Image,
+    model: AutoModelForImageTextToText,
+    processor: AutoProcessor,
+):
+    return generate_predictions_smol([prompt], [image], model, processor)[0]
+
+
+def generate_predictions_smol(
+    prompts: List[str],
+    images: List[Image],
+    model: AutoModelForImageTextToText,
+    processor: AutoProcessor,
+) -> List[Optional[dict]]:
+    """
+    Generate the predictions of several (prompt, image) pairs in one `generate` call.
+
+    Prompts are left-padded so that every sequence ends where generation starts.
+    Images of similar sizes waste less padding, see `bucket_by_image_size`.
+
+    When a `PrefixCache` is set, the prompts are generated one at a time on the
+    cached prefix (system message and page) of their page instead.
+
+    Returns:
+        List[Optional[dict]]: Parsed JSON response of each pair, None if parsing fails.
+    """
+    # Generation continues after the last token, so pad on the left
+    processor.tokenizer.padding_side = "left"
+
+    prefix_cache = get_prefix_cache()
+    if prefix_cache is None:
+        inputs = _inputs(prompts, images, model, processor)
+        input_length = inputs["input_ids"].shape[1]
+        with stage("generation", backend="smolvlm"):
+            generated_ids = model.generate(**inputs, **SMOL_GENERATION_PARAMS)
+        output_ids = list(generated_ids[:, input_length:])
+        input_tokens = int(inputs["attention_mask"].sum())
+    else:
+        output_ids, input_tokens = [], 0
+        for prompt, image in zip(prompts, images):
+            inputs = _inputs([prompt], [image], model, processor)
+            input_length = inputs["input_ids"].shape[1]
+            length = prefix_length(inputs["input_ids"], [model.config.image_token_id])
+            with stage("generation", backend="smolvlm"):
+                generated_ids = prefix_cache.generate(
+                    model, inputs, image, length, "smolvlm", **SMOL_GENERATION_PARAMS
+                )
+            output_ids.append(generated_ids[0, input_length:])
+            input_tokens += int(inputs["attention_mask"].sum())
+
+    count("input_tokens", input_tokens, backend="smolvlm")
+    count(
+        "output_tokens",
+        sum(int((ids != processor.tokenizer.pad_token_id).sum()) for ids in output_ids),
+        backend="smolvlm",
     )
-    decoded_output = generated_texts[0].replace("Assistant:", "", 1).strip()
+    with stage("decoding", backend="smolvlm"):
+        generated_texts = processor.batch_decode(
+            output_ids,
+            skip_special_tokens=True,
+        )
 
-    try:
-        json_response = safe_json_parse(decoded_output)
-        return json_response
-    except json.JSONDecodeError:
-        return None
+    predictions = []
+    with stage("json_parsing", backend="smolvlm"):
+        for text in generated_texts:
+            decoded_output = text.replace("Assistant:", "", 1).strip()
+            predictions.append(safe_json_parse(decoded_output))
+    return predictions
@@ -1,43 +1,135 @@
+import asyncio
+import importlib
+from collections import defaultdict
 from enum import Enum
-from typing import Any, Optional
+from types import ModuleType
+from typing import Any, Generator, List, Optional, Sequence, Tuple
 
 from PIL.Image import Image
 
-from .claude import generate_prediction_claude
-from .qwen import generate_prediction_qwen, get_model_and_processor_qwen
-from .smol import generate_prediction_smol, get_model_and_processor_smol
+from ..instrumentation import count, stage
+from .cache import PredictionCache, prediction_key
+from .constants import (
+    CLAUDE_GENERATION_PARAMS,
+    CLAUDE_MODEL_ID,
+    QWEN_GENERATION_PARAMS,
+    QWEN_MODEL_ID,
+    SMOL_GENERATION_PARAMS,
+    SMOL_MODEL_ID,
+    SYSTEM_MESSAGE,
+)
+from .resolution import Resize, get_resolution_policy
 
 
 class VLMModel(str, Enum):
     SMOLVLM = "smolvlm"
     QWEN = "qwen2.5-vl-7b"
     CLAUDE = "claude-sonnet-4"
+    # Offline stand-in for benchmarks and tests, see `FakeVLM`
+    FAKE = "fake"
 
 
-def get_model_and_processor(model_name: str):
+# Model id and generation parameters of each backend, used in the cache key
+MODEL_CONFIGS = {
+    VLMModel.SMOLVLM: (SMOL_MODEL_ID, SMOL_GENERATION_PARAMS),
+    VLMModel.QWEN: (QWEN_MODEL_ID, QWEN_GENERATION_PARAMS),
+    VLMModel.CLAUDE: (CLAUDE_MODEL_ID, CLAUDE_GENERATION_PARAMS),
+}
+
+# Backends whose failed (None) predictions may be transient API errors and are
+# therefore not cached
+UNCACHED_FAILURES = {VLMModel.CLAUDE}
+
+# Module of each backend, imported when the backend is first used so that
+# torch, transformers, anthropic... are only imported by the backends needing them
+BACKEND_MODULES = {
+    VLMModel.SMOLVLM: "smol",
+    VLMModel.QWEN: "qwen",
+    VLMModel.CLAUDE: "claude",
+    VLMModel.FAKE: "fake",
+}
+
+# Backends that can generate several predictions in one call (one model call,
+# or concurrent requests for Claude), and the function of their module doing it
+BATCH_GENERATORS = {
+    VLMModel.SMOLVLM: "generate_predictions_smol",
+    VLMModel.QWEN: "generate_predictions_qwen",
+    VLMModel.CLAUDE: "generate_predictions_claude",
+    VLMModel.FAKE: "generate_predictions_fake",
+}
+
+# Backends whose requests are bounded by the backend itself (see
+# `ClaudeBackend`), sent in one call instead of batches of `batch_size`
+CONCURRENT_BACKENDS = {VLMModel.CLAUDE}
+
+DEFAULT_BATCH_SIZE = 8
+
+# Side of the image size buckets, in pixels, see `bucket_by_image_size`
+IMAGE_BUCKET_PX = 128
+
+_prediction_cache: Optional[PredictionCache] = None
+
+
+def set_prediction_cache(cache: Optional[PredictionCache]) -> None:
+    """Cache the predictions of every `generate_prediction` call (None to disable)."""
+    global _prediction_cache
+    _prediction_cache = cache
+
+
+def get_prediction_cache() -> Optional[PredictionCache]:
+    return _prediction_cache
+
+
+def backend_module(model_name: str) -> ModuleType:
+    """Import the module of a backend."""
+    if model_name not in BACKEND_MODULES:
+        raise ValueError(f"Unsupported model name: {model_name}")
+    return importlib.import_module(f".{BACKEND_MODULES[model_name]}", __package__)
+
+
+def get_model_and_processor(
+    model_name: str,
+    device: Optional[str] = "auto",
+    quantization: Optional[str] = None,
+    num_threads: Optional[int] = None,
+):
     """
     Get the model and processor based on the model name.
 
     Args:
         model_name (str): The name of the model to load.
+        device: Device of the local models: "auto" for the GPU when there is one
+            and the CPU otherwise, or a torch device such as "cpu" or "cuda:1".
+        quantization: Precision of the local models: None for the default of the
+            device, "bf16", or "int8" (dynamic quantization, CPU only).
+        num_threads: Number of threads used by torch on CPU.
 
     Returns:
         model: The loaded model instance.
         processor: The processor instance for the model.
     """
-    if model_name == VLMModel.SMOLVLM:
-        model, processor = get_model_and_processor_smol()
-    elif model_name == VLMModel.QWEN:
-        model, processor = get_model_and_processor_qwen()
-    elif model_name == VLMModel.CLAUDE:
+    if model_name == VLMModel.CLAUDE:
         return None, None
-    else:
-        raise ValueError(f"Unsupported model name: {model_name}")
-    return model, processor
+    backend = backend_module(model_name)
+    if model_name == VLMModel.FAKE:
+        return backend.get_model_and_processor_fake()
+
+    from .device import set_num_threads
+
+    set_num_threads(num_threads)
+    if model_name == VLMModel.SMOLVLM:
+        return backend.get_model_and_processor_smol(device, quantization)
+    return backend.get_model_and_processor_qwen(device, quantization)
 
 
 def generate_prediction(
-    prompt: str, image: Image, model_name: str, model: Any, processor: Any
+    prompt: str,
+    image: Image,
+    model_name: str,
+    model: Any,
+    processor: Any,
+    request_mode: Optional[str] = None,
+    source: Optional[str] = None,
 ) -> Optional[dict]:
     """
     Forward the prompt and image to the model to get a prediction.
@@ -48,13 +140,368 @@ def generate_prediction(
         model_name (str): The name of the model being used.
         model: The model instance.
         processor: The processor instance.
+        request_mode: How Claude requests are sent ("single", "cached" or
+            "multi", see `ClaudeBackend`), the mode of the shared backend by
+            default. Ignored by the other backends.
+        source: Source of the document, for the budgets of the resolution
+            policy per source.
+
+    When a cache is set with `set_prediction_cache`, predictions are looked up by
+    backend, model id, generation parameters, prompt and image before calling the
+    model. When a `ResolutionPolicy` is set, the image is downscaled to the
+    budget of the backend before being sent.
+
+    The call is timed as the "generate_prediction" stage, see `instrumentation`.
+    """
+    with stage("generate_prediction", backend=_backend(model_name)):
+        return _cached_prediction(
+            prompt, image, model_name, model, processor, request_mode, source
+        )
+
+
+async def agenerate_prediction(
+    prompt: str,
+    image: Image,
+    model_name: str,
+    model: Any,
+    processor: Any,
+    request_mode: Optional[str] = None,
+    source: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    Awaitable `generate_prediction`, to fan out many predictions with asyncio.
+
+    Claude requests are made on the shared `ClaudeBackend` without blocking a
+    thread; the local backends run in a worker thread.
+    """
+    if model_name != VLMModel.CLAUDE:
+        return await asyncio.to_thread(
+            generate_prediction,
+            prompt,
+            image,
+            model_name,
+            model,
+            processor,
+            source=source,
+        )
+
+    with stage("generate_prediction", backend=_backend(model_name)):
+        steps = _prediction_steps(
+            prompt, image, model_name, model, request_mode, source
+        )
+        try:
+            request_mode, resize = next(steps)
+            steps.send(
+                await _agenerate_prediction(
+                    prompt, image, model_name, request_mode, source, resize
+                )
+            )
+        except StopIteration as done:
+            return done.value
+
+
+def _backend(model_name: str) -> str:
+    return model_name.value if isinstance(model_name, Enum) else str(model_name)
+
+
+def _request_mode(model_name: str, request_mode: Optional[str]) -> Optional[str]:
+    """Request mode of a call to Claude, None for the other backends."""
+    if model_name != VLMModel.CLAUDE:
+        return None
+    return request_mode or backend_module(model_name).get_claude_backend().request_mode
+
+
+def _fit(image: Image, model_name: str, source: Optional[str]) -> Optional[Resize]:
+    """Size the image is sent at under the resolution policy, None without policy."""
+    policy = get_resolution_policy()
+    if policy is None:
+        return None
+    return policy.fit(image, _backend(model_name), source)
+
+
+def _resized(image: Image, resize: Optional[Resize], model_name: str) -> Image:
+    if resize is None:
+        return image
+    return get_resolution_policy().apply(image, resize, _backend(model_name))
+
+
+def _restore(
+    prediction: Optional[dict],
+    image: Image,
+    resize: Optional[Resize],
+    model_name: str,
+    source: Optional[str],
+) -> Optional[dict]:
+    if resize is None:
+        return prediction
+    return get_resolution_policy().restore(
+        prediction, image, resize, _backend(model_name), source
+    )
+
+
+def _prediction_steps(
+    prompt: str,
+    image: Image,
+    model_name: str,
+    model: Any,
+    request_mode: Optional[str] = None,
+    source: Optional[str] = None,
+) -> Generator[Tuple[Optional[str], Optional[Resize]], Optional[dict], Optional[dict]]:
     """
+    Steps around the backend call, shared by the sync and async predictions.
+
+    Fits the page to the resolution policy and looks the prediction up in the
+    cache. On a miss, yields the request mode and the size to send the page at,
+    and stores the prediction of the backend sent back. Returns the prediction.
+    """
+    request_mode = _request_mode(model_name, request_mode)
+    resize = _fit(image, model_name, source)
+    cache = _prediction_cache
+    if cache is None or model_name not in MODEL_CONFIGS:
+        return (yield request_mode, resize)
+
+    key = _cache_key(prompt, image, model_name, model, request_mode, resize)
+    prediction = cache.get(key)
+    if prediction is not PredictionCache.MISS:
+        count("cache_hits", backend=_backend(model_name))
+        return prediction
+    count("cache_misses", backend=_backend(model_name))
+
+    prediction = yield request_mode, resize
+    _store(cache, key, prediction, model_name)
+    return prediction
+
+
+def _cached_prediction(
+    prompt: str,
+    image: Image,
+    model_name: str,
+    model: Any,
+    processor: Any,
+    request_mode: Optional[str] = None,
+    source: Optional[str] = None,
+) -> Optional[dict]:
+    steps = _prediction_steps(prompt, image, model_name, model, request_mode, source)
+    try:
+        request_mode, resize = next(steps)
+        steps.send(
+            _generate_prediction(
+                prompt,
+                image,
+                model_name,
+                model,
+                processor,
+                request_mode,
+                source,
+                resize,
+            )
+        )
+    except StopIteration as done:
+        return done.value
+
+
+def _cache_key(
+    prompt: str,
+    image: Image,
+    model_name: str,
+    model: Any,
+    request_mode: Optional[str] = None,
+    resize: Optional[Resize] = None,
+) -> str:
+    model_id, params = MODEL_CONFIGS[model_name]
+    params = {**params, "system": SYSTEM_MESSAGE}
+    # Questions asked together can be answered differently; prompt caching
+    # does not change the predictions
+    if request_mode == "multi":
+        params["request_mode"] = request_mode
+    # Pages sent under a resolution policy, keys of the others are unchanged
+    if resize is not None:
+        params["resolution"] = list(resize.size)
+    # Quantized models give different predictions, keys of the others are unchanged
+    if model is not None:
+        from .device import quantization_of
+
+        quantization = quantization_of(model)
+        if quantization is not None:
+            params["quantization"] = quantization
+    return prediction_key(model_name, model_id, params, prompt, image)
+
+
+def _store(
+    cache: PredictionCache, key: str, prediction: Optional[dict], model_name: str
+) -> None:
+    if prediction is not None or model_name not in UNCACHED_FAILURES:
+        cache.put(key, prediction, model_name, MODEL_CONFIGS[model_name][0])
+
+
+def bucket_by_image_size(
+    images: Sequence[Image],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    bucket_px: int = IMAGE_BUCKET_PX,
+) -> List[List[int]]:
+    """
+    Group images of similar sizes into batches.
+
+    The number of image tokens grows with the resolution, so batching pages of
+    similar sizes limits the padding added to the shorter sequences.
+
+    Args:
+        images: Images to batch.
+        batch_size: Maximum number of images per batch.
+        bucket_px: Width and height are rounded to this many pixels to form buckets.
+
+    Returns:
+        List[List[int]]: Indexes of the images of each batch, in input order
+            within a batch.
+    """
+    buckets = defaultdict(list)
+    for index, image in enumerate(images):
+        width, height = image.size
+        buckets[(round(width / bucket_px), round(height / bucket_px))].append(index)
+    return [
+        indexes[start : start + batch_size]
+        for _, indexes in sorted(buckets.items())
+        for start in range(0, len(indexes), batch_size)
+    ]
+
+
+def generate_prediction_batch(
+    prompts: Sequence[str],
+    images: Sequence[Image],
+    model_name: str,
+    model: Any,
+    processor: Any,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    request_mode: Optional[str] = None,
+    source: Optional[str] = None,
+) -> List[Optional[dict]]:
+    """
+    Batched `generate_prediction`.
+
+    Cached predictions are looked up first. The other pairs are grouped by image
+    size (see `bucket_by_image_size`) and sent `batch_size` at a time to the
+    backends that support batching (SmolVLM, Qwen and the fake backend). Claude
+    requests are all sent at once, concurrently within the limits of the shared
+    `ClaudeBackend`, the prompts about a same page according to `request_mode`.
+
+    Args:
+        prompts: Text prompts.
+        images: Image of each prompt.
+        model_name (str): The name of the model being used.
+        model: The model instance.
+        processor: The processor instance.
+        batch_size: Maximum number of pairs per model call.
+        request_mode: See `generate_prediction`.
+        source: See `generate_prediction`.
+
+    Returns:
+        List[Optional[dict]]: Prediction of each pair, in input order.
+    """
+    if len(prompts) != len(images):
+        raise ValueError(f"Got {len(prompts)} prompts for {len(images)} images")
+    request_mode = _request_mode(model_name, request_mode)
+
+    with stage("generate_prediction_batch", backend=_backend(model_name)):
+        predictions: List[Optional[dict]] = [None] * len(prompts)
+        pending = list(range(len(prompts)))
+        resizes = [_fit(image, model_name, source) for image in images]
+
+        cache = _prediction_cache
+        keys = {}
+        if cache is not None and model_name in MODEL_CONFIGS:
+            missing = []
+            for index in pending:
+                key = _cache_key(
+                    prompts[index],
+                    images[index],
+                    model_name,
+                    model,
+                    request_mode,
+                    resizes[index],
+                )
+                prediction = cache.get(key)
+                if prediction is PredictionCache.MISS:
+                    count("cache_misses", backend=_backend(model_name))
+                    keys[index] = key
+                    missing.append(index)
+                else:
+                    count("cache_hits", backend=_backend(model_name))
+                    predictions[index] = prediction
+            pending = missing
+
+        generator = BATCH_GENERATORS.get(model_name)
+        if generator is None:
+            for index in pending:
+                predictions[index] = _generate_prediction(
+                    prompts[index],
+                    images[index],
+                    model_name,
+                    model,
+                    processor,
+                    request_mode,
+                    source,
+                    resizes[index],
+                )
+        else:
+            generate = getattr(backend_module(model_name), generator)
+            options = {"request_mode": request_mode} if request_mode else {}
+            sent = {i: _resized(images[i], resizes[i], model_name) for i in pending}
+            if model_name in CONCURRENT_BACKENDS:
+                batches = [list(range(len(pending)))] if pending else []
+            else:
+                batches = bucket_by_image_size([sent[i] for i in pending], batch_size)
+            for batch in batches:
+                indexes = [pending[i] for i in batch]
+                outputs = generate(
+                    [prompts[i] for i in indexes],
+                    [sent[i] for i in indexes],
+                    model,
+                    processor,
+                    **options,
+                )
+                for index, prediction in zip(indexes, outputs):
+                    predictions[index] = _restore(
+                        prediction, images[index], resizes[index], model_name, source
+                    )
+
+        for index, key in keys.items():
+            _store(cache, key, predictions[index], model_name)
+        return predictions
+
+
+def _generate_prediction(
+    prompt: str,
+    image: Image,
+    model_name: str,
+    model: Any,
+    processor: Any,
+    request_mode: Optional[str] = None,
+    source: Optional[str] = None,
+    resize: Optional[Resize] = None,
+) -> Optional[dict]:
+    backend = backend_module(model_name)
+    sent = _resized(image, resize, model_name)
     if model_name == VLMModel.SMOLVLM:
-        prediction = generate_prediction_smol(prompt, image, model, processor)
+        prediction = backend.generate_prediction_smol(prompt, sent, model, processor)
     elif model_name == VLMModel.QWEN:
-        prediction = generate_prediction_qwen(prompt, image, model, processor)
+        prediction = backend.generate_prediction_qwen(prompt, sent, model, processor)
     elif model_name == VLMModel.CLAUDE:
-        prediction = generate_prediction_claude(prompt, image)
+        prediction = backend.generate_prediction_claude(prompt, sent, request_mode)
     else:
-        raise ValueError(f"Unsupported model name: {model_name}")
-    return prediction
+        prediction = backend.generate_prediction_fake(prompt, sent, model, processor)
+    return _restore(prediction, image, resize, model_name, source)
+
+
+async def _agenerate_prediction(
+    prompt: str,
+    image: Image,
+    model_name: str,
+    request_mode: Optional[str] = None,
+    source: Optional[str] = None,
+    resize: Optional[Resize] = None,
+) -> Optional[dict]:
+    backend = backend_module(model_name)
+    prediction = await backend.agenerate_prediction_claude(
+        prompt, _resized(image, resize, model_name), request_mode
+    )
+    return _restore(prediction, image, resize, model_name, source)
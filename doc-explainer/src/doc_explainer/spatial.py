@@ -0,0 +1,258 @@
+import math
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .boxes import WordTable
+from .metrics import BBox
+
+# OCR words as returned by `OCRProcessor.extract_words_and_bboxes`:
+# {"page": int, "text": str, "bbox": [left, top, width, height]}
+Word = Dict[str, Any]
+
+
+class _PageGrid:
+    """
+    Uniform grid over the words of a single page.
+
+    Every word is registered in all the cells its box overlaps, so a query only
+    has to look at the cells overlapping the query region.
+    """
+
+    def __init__(self, word_ids: List[int], boxes: np.ndarray, cell_size: float):
+        self.word_ids = np.asarray(word_ids, dtype=np.int64)
+        self.boxes = boxes
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+        if len(boxes) == 0:
+            self.extent = (0, 0, 0, 0)
+            return
+
+        cells = np.floor(boxes / cell_size).astype(np.int64)
+        for local_id, (cx0, cy0, cx1, cy1) in enumerate(cells.tolist()):
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.cells[(cx, cy)].append(local_id)
+
+        self.extent = (
+            int(cells[:, 0].min()),
+            int(cells[:, 1].min()),
+            int(cells[:, 2].max()),
+            int(cells[:, 3].max()),
+        )
+
+    def _cell(self, value: float) -> int:
+        return math.floor(value / self.cell_size)
+
+    def candidates(self, bbox: BBox) -> np.ndarray:
+        x0, y0, x1, y1 = bbox
+        ex0, ey0, ex1, ey1 = self.extent
+        found = set()
+        for cx in range(max(self._cell(x0), ex0), min(self._cell(x1), ex1) + 1):
+            for cy in range(max(self._cell(y0), ey0), min(self._cell(y1), ey1) + 1):
+                found.update(self.cells.get((cx, cy), ()))
+        return np.fromiter(found, dtype=np.int64, count=len(found))
+
+    def ring(self, cx: int, cy: int, radius: int) -> List[int]:
+        if radius == 0:
+            return list(self.cells.get((cx, cy), ()))
+        found = []
+        for x in range(cx - radius, cx + radius + 1):
+            found.extend(self.cells.get((x, cy - radius), ()))
+            found.extend(self.cells.get((x, cy + radius), ()))
+        for y in range(cy - radius + 1, cy + radius):
+            found.extend(self.cells.get((cx - radius, y), ()))
+            found.extend(self.cells.get((cx + radius, y), ()))
+        return found
+
+
+class WordIndex:
+    """
+    Page-partitioned spatial index over OCR words.
+
+    Built once per document, it answers intersection, containment and k-nearest
+    queries by only looking at the grid cells around the query instead of every
+    word of the document. All query boxes are [x0, y0, x1, y1] in the same scale
+    as the indexed words (0-1000 for `OCRProcessor` output).
+
+    Example:
+        index = WordIndex.from_words(words_ocr)
+        words = index.intersecting(page=1, bbox=[100, 200, 300, 220])
+
+    Attributes:
+        words (WordTable): The indexed words, in their original order.
+        cell_size (float): Side of a grid cell.
+    """
+
+    def __init__(
+        self,
+        words: Union[Sequence[Word], WordTable],
+        cell_size: float = 25.0,
+        bbox_format: str = "xywh",
+    ):
+        table = WordTable.from_words(words, format=bbox_format)
+        self.words = table
+        self.cell_size = cell_size
+
+        boxes = table.boxes.to_format("xyxy").data.astype(np.float64)
+        per_page: Dict[int, List[int]] = defaultdict(list)
+        for word_id, page in enumerate(table.pages.tolist()):
+            per_page[page].append(word_id)
+        self.boxes = boxes
+
+        self._pages: Dict[int, _PageGrid] = {
+            page: _PageGrid(word_ids, boxes[word_ids], cell_size)
+            for page, word_ids in per_page.items()
+        }
+
+    @classmethod
+    def from_words(
+        cls, words: Union[Sequence[Word], WordTable], **kwargs
+    ) -> "WordIndex":
+        return cls(words, **kwargs)
+
+    @property
+    def pages(self) -> List[int]:
+        return sorted(self._pages)
+
+    def words_on_page(self, page: int) -> List[Word]:
+        grid = self._pages.get(page)
+        if grid is None:
+            return []
+        return [self.words[i] for i in grid.word_ids.tolist()]
+
+    def _query(self, page: int, bbox: BBox, contained: bool) -> List[int]:
+        grid = self._pages.get(page)
+        if grid is None:
+            return []
+
+        candidates = grid.candidates(bbox)
+        if len(candidates) == 0:
+            return []
+
+        boxes = grid.boxes[candidates]
+        x0, y0, x1, y1 = bbox
+        if contained:
+            mask = (
+                (boxes[:, 0] >= x0)
+                & (boxes[:, 1] >= y0)
+                & (boxes[:, 2] <= x1)
+                & (boxes[:, 3] <= y1)
+            )
+        else:
+            mask = (
+                (boxes[:, 0] <= x1)
+                & (boxes[:, 2] >= x0)
+                & (boxes[:, 1] <= y1)
+                & (boxes[:, 3] >= y0)
+            )
+        return sorted(grid.word_ids[candidates[mask]].tolist())
+
+    def intersecting_ids(self, page: int, bbox: BBox) -> List[int]:
+        """Return the ids of the words of `page` whose box intersects `bbox`."""
+        return self._query(page, bbox, contained=False)
+
+    def contained_ids(self, page: int, bbox: BBox) -> List[int]:
+        """Return the ids of the words of `page` whose box lies inside `bbox`."""
+        return self._query(page, bbox, contained=True)
+
+    def intersecting(self, page: int, bbox: BBox) -> List[Word]:
+        return [self.words[i] for i in self.intersecting_ids(page, bbox)]
+
+    def contained(self, page: int, bbox: BBox) -> List[Word]:
+        return [self.words[i] for i in self.contained_ids(page, bbox)]
+
+    def nearest_ids(
+        self, page: int, point: Tuple[float, float], k: int = 1
+    ) -> List[Tuple[float, int]]:
+        """
+        Return the k words of `page` closest to `point`.
+
+        The distance is the Euclidean distance from the point to the word box
+        (0 if the point is inside the box).
+
+        Returns:
+            List[Tuple[float, int]]: (distance, word id) pairs, closest first.
+        """
+        grid = self._pages.get(page)
+        if grid is None or k <= 0:
+            return []
+
+        px, py = point
+        cx, cy = grid._cell(px), grid._cell(py)
+        ex0, ey0, ex1, ey1 = grid.extent
+        max_radius = max(cx - ex0, ex1 - cx, cy - ey0, ey1 - cy, 0)
+
+        seen = set()
+        best: List[Tuple[float, int]] = []
+        for radius in range(max_radius + 1):
+            # Large words span several cells of the ring
+            ring = [
+                i for i in dict.fromkeys(grid.ring(cx, cy, radius)) if i not in seen
+            ]
+            if ring:
+                seen.update(ring)
+                boxes = grid.boxes[ring]
+                dx = np.maximum.reduce(
+                    [boxes[:, 0] - px, np.zeros(len(ring)), px - boxes[:, 2]]
+                )
+                dy = np.maximum.reduce(
+                    [boxes[:, 1] - py, np.zeros(len(ring)), py - boxes[:, 3]]
+                )
+                distances = np.sqrt(dx**2 + dy**2)
+                best.extend(
+                    zip(distances.tolist(), grid.word_ids[ring].tolist(), strict=True)
+                )
+                best = sorted(best)[:k]
+
+            # Words outside the rings searched so far are at least this far away
+            if len(best) == k and best[-1][0] <= radius * grid.cell_size:
+                break
+
+        return best
+
+    def nearest(self, page: int, point: Tuple[float, float], k: int = 1) -> List[Word]:
+        return [self.words[i] for _, i in self.nearest_ids(page, point, k)]
+
+    def snap(
+        self, page: int, bbox: BBox, min_overlap: float = 0.5
+    ) -> Optional[List[float]]:
+        """
+        Snap a box to the boundaries of the words it covers.
+
+        Args:
+            page: Page of the box.
+            bbox: Box to snap, [x0, y0, x1, y1].
+            min_overlap: Minimum fraction of a word's area that must be covered
+                by `bbox` for the word to be kept.
+
+        Returns:
+            Optional[List[float]]: Union of the covered words, or None if the box
+                does not cover any word.
+        """
+        word_ids = self.intersecting_ids(page, bbox)
+        if not word_ids:
+            return None
+
+        boxes = self.boxes[word_ids]
+        inter_w = np.minimum(boxes[:, 2], bbox[2]) - np.maximum(boxes[:, 0], bbox[0])
+        inter_h = np.minimum(boxes[:, 3], bbox[3]) - np.maximum(boxes[:, 1], bbox[1])
+        inter_area = np.maximum(0.0, inter_w) * np.maximum(0.0, inter_h)
+        area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        covered = (
+            np.divide(inter_area, area, out=np.ones_like(area), where=area > 0)
+            >= min_overlap
+        )
+
+        if not covered.any():
+            return None
+
+        kept = boxes[covered]
+        return [
+            float(kept[:, 0].min()),
+            float(kept[:, 1].min()),
+            float(kept[:, 2].max()),
+            float(kept[:, 3].max()),
+        ]
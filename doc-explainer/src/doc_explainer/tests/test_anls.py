@@ -0,0 +1,119 @@
+import random
+import warnings
+
+import pytest
+
+from doc_explainer.anls import batch_anls, compute_anls, levenshtein_distance
+
+anls_star = pytest.importorskip("anls_star")
+
+# (prediction, ground truth) samples in the style of each BoundingDocs source
+SOURCE_SAMPLES = {
+    "Deepform": [
+        ("WFAA", "WFAA"),
+        ("$12,500.00", "12500.00"),
+        ("Committee to Elect Jane Doe", "Committee To Elect Jane Doe"),
+    ],
+    "DUDE": [
+        ("march 3, 1998", "March 3 1998"),
+        ("Yes", "no"),
+    ],
+    "FATURA": [
+        ("INV-2021-0042", "INV-2021-0042"),
+        ("INV-2021-0042 ", "INV 2021 0043"),
+        ("Total: 1,250.00 USD", "1,250.00"),
+    ],
+    "Kleister Charity": [
+        (
+            "The Royal Society for the Protection of Birds",
+            "ROYAL SOCIETY FOR THE PROTECTION OF BIRDS",
+        ),
+        ("31/03/2016", "2016-03-31"),
+    ],
+    "Kleister NDA": [
+        ("Delaware", "Delaware"),
+        ("Acme Corporation", "ACME CORP."),
+    ],
+    "MP-DocVQA": [
+        ("1993", 1993),
+        ("Dr. John   Smith", "dr. john smith"),
+    ],
+    "SP-DocVQA": [
+        ("0.28", "0.28"),
+        ("", ""),
+        ("something", ""),
+    ],
+    "VRDU Ad Buy Form": [
+        ("10/21/2020", "10/21/20"),
+        ("KSHB-TV", "KSHB"),
+    ],
+    "VRDU Registration Form": [
+        (
+            "Akin Gump Strauss Hauer & Feld LLP",
+            "Akin, Gump, Strauss, Hauer & Feld, LLP",
+        ),
+        ("True", True),
+    ],
+    "XFUND": [
+        ("张三", "张三"),
+        ("2019年3月", "2019年03月"),
+        ("Müller", "Mueller"),
+    ],
+}
+
+
+@pytest.mark.parametrize("source", sorted(SOURCE_SAMPLES))
+def test_compute_anls_parity_per_source(source):
+    for prediction, ground_truth in SOURCE_SAMPLES[source]:
+        expected = anls_star.anls_score(ground_truth, prediction)
+        assert compute_anls(prediction, ground_truth) == expected
+
+
+def test_compute_anls_parity_random():
+    rng = random.Random(0)
+    alphabet = "abcde 12"
+    for _ in range(2000):
+        gt = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        pred = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        assert compute_anls(pred, gt) == anls_star.anls_score(gt, pred)
+
+
+def test_compute_anls_special_values():
+    cases = [
+        (None, None),
+        ("", None),
+        ("answer", None),
+        (None, "answer"),
+        ("answer", ("answer", "other")),
+        ("answr", ["answer", "other"]),
+        ("answer", [1, "answer"]),
+        ({"a": "b"}, "answer"),
+        # JSON answers of the VLM, scored as structures by ANLS*
+        (["answer", "other"], ["answer", "othr"]),
+        (["answer"], ("answer", "other")),
+        ({"a": "b"}, ["answer"]),
+        ({"total": "12.50", "currency": "EUR"}, {"total": "12.50"}),
+        ({"items": ["a", "b"]}, {"items": ["a", "c"]}),
+    ]
+    for prediction, ground_truth in cases:
+        with warnings.catch_warnings():
+            # anls_star warns when a list of strings is treated as options
+            warnings.simplefilter("ignore")
+            expected = anls_star.anls_score(ground_truth, prediction)
+        assert compute_anls(prediction, ground_truth) == expected
+
+
+def test_levenshtein_distance_early_exit():
+    assert levenshtein_distance("kitten", "sitting") == 3
+    assert levenshtein_distance("kitten", "sitting", max_distance=3) == 3
+    assert levenshtein_distance("kitten", "sitting", max_distance=1) == 2
+    assert levenshtein_distance("", "abc") == 3
+
+
+def test_batch_anls():
+    pairs = [(pred, gt) for samples in SOURCE_SAMPLES.values() for pred, gt in samples]
+    pairs += [("1", 1), (True, "true"), (1, "1")]
+
+    scores = batch_anls(pairs)
+
+    assert scores == [compute_anls(pred, gt) for pred, gt in pairs]
@@ -0,0 +1,88 @@
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from doc_explainer import DocExplainer
+from doc_explainer.models.fake import FakeExplainer, FakeVLM
+from doc_explainer.models.registry import ModelRegistry
+from doc_explainer.models.utils import (
+    bucket_by_image_size,
+    generate_prediction,
+    generate_prediction_batch,
+)
+
+
+def _image(size=(400, 600)):
+    return Image.new("RGB", size, (255, 255, 255))
+
+
+def test_bucket_by_image_size():
+    images = [_image((400, 600)), _image((800, 600)), _image((410, 590))]
+    images += [_image((400, 600))] * 3
+    assert bucket_by_image_size(images, batch_size=8) == [[0, 2, 3, 4, 5], [1]]
+    assert bucket_by_image_size(images, batch_size=2) == [[0, 2], [3, 4], [5], [1]]
+    assert bucket_by_image_size([]) == []
+
+
+def test_batch_matches_single_predictions():
+    prompts = [f"Question {i}?" for i in range(10)]
+    images = [_image((400 + 300 * (i % 2), 600)) for i in range(10)]
+    model = FakeVLM(failure_rate=0.3)
+
+    expected = [
+        generate_prediction(p, im, "fake", model, None)
+        for p, im in zip(prompts, images)
+    ]
+    batch = generate_prediction_batch(prompts, images, "fake", model, None, 4)
+    assert batch == expected
+    assert None in batch
+    assert model.batch_sizes == [4, 1, 4, 1]
+
+
+def test_forward_batch_matches_forward():
+    vlm = FakeVLM(failure_rate=0.5)
+    explainer = DocExplainer("fake", device="cpu", explainer=FakeExplainer())
+    explainer.vlm = vlm
+    documents = [[_image((400, 600)), _image((500, 600)), _image((600, 600))]] * 12
+    questions = [f"What is the value {i}?" for i in range(12)]
+
+    expected = [explainer(doc, q) for doc, q in zip(documents, questions)]
+    assert {r.page for r in expected if r} - {0}
+    assert explainer.forward_batch(documents, questions) == expected
+
+
+def test_given_vlm_replaces_the_registry_one():
+    registry = ModelRegistry()
+    explainer = DocExplainer("smolvlm", device="cpu", registry=registry)
+    model, processor = nn.Linear(2, 2), object()
+    explainer.set_vlm(model, processor)
+    assert explainer.vlm is model and explainer.processor is processor
+    assert registry.stats()["loads"] == 0
+
+    explainer.vlm = nn.Linear(3, 3)
+    assert explainer.vlm is not model and explainer.processor is processor
+    explainer.vlm = None
+    explainer.processor = None
+    assert list(explainer.parameters()) == []
+
+
+def test_assigned_models_are_submodules():
+    registry = ModelRegistry()
+    explainer = DocExplainer("fake", registry=registry)
+    explainer.explainer = nn.Linear(2, 1)
+    explainer.vlm = nn.Linear(2, 2)
+    assert isinstance(explainer.explainer, nn.Linear)
+    assert registry.stats()["loads"] == 0
+
+    # Reached by `to`, `eval` and `state_dict`, unlike the registry models
+    explainer.to(torch.float64).eval()
+    assert all(p.dtype == torch.float64 for p in explainer.parameters())
+    assert not explainer.explainer.training and not explainer.vlm.training
+    assert len(explainer.state_dict()) == 4
+
+    # A processor alone replaces the one of the registry
+    processor = object()
+    explainer = DocExplainer("fake", registry=registry)
+    explainer.processor = processor
+    assert explainer.processor is processor
+    assert isinstance(explainer.vlm, FakeVLM)
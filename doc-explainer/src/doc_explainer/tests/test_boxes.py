@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from doc_explainer.boxes import PIXELS, BoxArray, WordTable
+from doc_explainer.metrics import compute_iou
+
+
+def test_format_round_trip_keeps_ints():
+    boxes = BoxArray([[10, 20, 30, 40], [0, 0, 5, 5]], format="xywh")
+    xyxy = boxes.to_format("xyxy")
+    assert xyxy.tolist() == [[10, 20, 40, 60], [0, 0, 5, 5]]
+    assert xyxy.data.dtype == boxes.data.dtype
+    assert xyxy.to_format("whxy").tolist() == [[30, 40, 10, 20], [5, 5, 0, 0]]
+    assert xyxy.to_format("whxy").to_format("xywh").tolist() == boxes.tolist()
+    assert boxes.to_format("xywh") is boxes
+
+
+def test_whxy_matches_location_layout():
+    # BoundingDocs "location" is [width, height, left, top]
+    w, h, x1, y1 = 30, 40, 10, 20
+    box = BoxArray([w, h, x1, y1], format="whxy").to_format("xyxy")
+    assert box.tolist() == [[x1, y1, x1 + w, y1 + h]]
+
+
+def test_to_scale():
+    boxes = BoxArray([[100, 200, 300, 400]], scale=1000)
+    assert boxes.to_scale(1).tolist() == [[0.1, 0.2, 0.3, 0.4]]
+    assert boxes.to_scale(1000) is boxes
+
+    pixels = boxes.to_scale(PIXELS, (800, 600))
+    np.testing.assert_allclose(pixels.data, [[80, 120, 240, 240]])
+    np.testing.assert_allclose(pixels.to_scale(1000).data, boxes.data)
+    with pytest.raises(ValueError):
+        boxes.to_scale(PIXELS)
+
+
+def test_union_and_areas():
+    boxes = BoxArray([[10, 10, 20, 20], [5, 15, 30, 25]])
+    assert boxes.union().tolist() == [[5, 10, 30, 25]]
+    assert boxes.areas().tolist() == [100, 250]
+    with pytest.raises(ValueError):
+        boxes[0:0].union()
+
+
+def test_indexing_is_a_view():
+    data = np.arange(12).reshape(3, 4)
+    boxes = BoxArray(data)
+    assert boxes[1].tolist() == [[4, 5, 6, 7]]
+    assert boxes[-1].tolist() == [[8, 9, 10, 11]]
+    assert np.shares_memory(boxes[1:].data, data)
+
+
+def test_invalid_boxes():
+    with pytest.raises(ValueError):
+        BoxArray([1, 2, 3])
+    with pytest.raises(ValueError):
+        BoxArray([[1, 2, 3, 4]], format="cxcywh")
+    assert len(BoxArray([])) == 0
+
+
+def test_metrics_accept_box_arrays():
+    a = BoxArray([0, 0, 10, 10], format="xywh")
+    assert compute_iou(a, [0, 0, 10, 10]) == 1.0
+
+
+def test_word_table():
+    words = [
+        {"page": 1, "text": "a", "bbox": [0, 0, 10, 10]},
+        {"page": 1, "text": "b", "bbox": [20, 0, 10, 10]},
+        {"page": 2, "text": "c", "bbox": [0, 0, 5, 5]},
+    ]
+    table = WordTable.from_words(words)
+    assert len(table) == 3
+    assert table.to_words() == words
+    assert table[2] == words[2]
+    assert WordTable.from_words(table) is table
+
+    page = table.page(1)
+    assert page.texts == ["a", "b"]
+    assert np.shares_memory(page.boxes.data, table.boxes.data)
+    assert len(table.page(3)) == 0
+
+
+def test_word_table_non_contiguous_page():
+    table = WordTable([1, 2, 1], ["a", "b", "c"], BoxArray(np.zeros((3, 4), int)))
+    assert table.page(1).texts == ["a", "c"]
+    with pytest.raises(ValueError):
+        WordTable([1], ["a", "b"], BoxArray(np.zeros((2, 4))))
@@ -0,0 +1,125 @@
+import threading
+
+from PIL import Image, ImageDraw
+
+from doc_explainer.models import utils
+from doc_explainer.models.cache import PredictionCache, prediction_key
+
+
+def _image(color=0, size=(8, 8)):
+    return Image.new("RGB", size, (color, color, color))
+
+
+def _key(prompt="Q", image=None, params=None, model_id="m"):
+    return prediction_key(
+        "smolvlm", model_id, params or {"max_new_tokens": 8}, prompt, image or _image()
+    )
+
+
+def test_key_depends_on_every_input():
+    base = _key()
+    assert _key() == base
+    assert _key(prompt="Q2") != base
+    assert _key(image=_image(1)) != base
+    assert _key(image=_image(size=(8, 9))) != base
+    assert _key(params={"max_new_tokens": 9}) != base
+    assert _key(model_id="m2") != base
+
+
+def test_key_follows_pages_edited_in_place():
+    page = _image(size=(40, 40))
+    before = _key(image=page)
+    ImageDraw.Draw(page).rectangle([5, 5, 20, 20], outline="red")
+    assert _key(image=page) != before
+    assert _key(image=page) == _key(image=page.copy())
+
+
+def test_get_put_and_stats(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    with PredictionCache(path) as cache:
+        assert cache.get("a") is PredictionCache.MISS
+        cache.put("a", {"content": "x", "position": [1, 2, 3, 4]}, "smolvlm", "m")
+        cache.put("b", None, "smolvlm", "m")
+        assert cache.get("a") == {"content": "x", "position": [1, 2, 3, 4]}
+        assert cache.get("b") is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["writes"]) == (2, 1, 2)
+        assert stats["entries"] == 2
+
+    # Persisted across instances
+    with PredictionCache(path) as cache:
+        assert cache.get("a")["content"] == "x"
+
+
+def test_lru_eviction(tmp_path):
+    value = {"content": "x" * 100}
+    with PredictionCache(str(tmp_path / "cache.sqlite"), max_bytes=350) as cache:
+        for key in "abc":
+            cache.put(key, value, "smolvlm", "m")
+        assert len(cache) == 3
+        cache.get("a")  # "b" is now the least recently used
+        cache.put("d", value, "smolvlm", "m")
+        assert "b" not in cache
+        assert all(key in cache for key in "acd")
+        assert cache.size <= 350
+        assert cache.evictions == 1
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    PredictionCache(path).close()
+
+    def worker(worker_id):
+        with PredictionCache(path) as cache:
+            for i in range(50):
+                cache.put(f"{worker_id}-{i}", {"i": i}, "smolvlm", "m")
+                cache.put("shared", {"i": i}, "smolvlm", "m")
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with PredictionCache(path) as cache:
+        assert len(cache) == 4 * 50 + 1
+        assert cache.get("3-49") == {"i": 49}
+
+
+def test_generate_prediction_uses_cache(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_generate(
+        prompt, image, model_name, model, processor, request_mode=None, *args
+    ):
+        calls.append(prompt)
+        return {"content": prompt}
+
+    monkeypatch.setattr(utils, "_generate_prediction", fake_generate)
+    with PredictionCache(str(tmp_path / "cache.sqlite")) as cache:
+        utils.set_prediction_cache(cache)
+        try:
+            image = _image()
+            for _ in range(3):
+                prediction = utils.generate_prediction(
+                    "Q", image, "smolvlm", None, None
+                )
+            assert prediction == {"content": "Q"}
+            utils.generate_prediction("Q", _image(5), "smolvlm", None, None)
+            utils.generate_prediction("Q", image, "qwen2.5-vl-7b", None, None)
+        finally:
+            utils.set_prediction_cache(None)
+        assert len(calls) == 3
+        assert cache.hits == 2
+
+
+def test_transient_failures_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "_generate_prediction", lambda *args: None)
+    with PredictionCache(str(tmp_path / "cache.sqlite")) as cache:
+        utils.set_prediction_cache(cache)
+        try:
+            utils.generate_prediction("Q", _image(), "claude-sonnet-4", None, None)
+            utils.generate_prediction("Q", _image(), "smolvlm", None, None)
+        finally:
+            utils.set_prediction_cache(None)
+        assert len(cache) == 1
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from doc_explainer import DocExplainer
+from doc_explainer.instrumentation import MetricsCollector, instrument
+from doc_explainer.models.claude import (
+    AdaptiveRateLimiter,
+    ClaudeBackend,
+    parse_json_list,
+    set_claude_backend,
+)
+from doc_explainer.models.fake import FakeExplainer
+from doc_explainer.models.utils import generate_prediction_batch
+
+
+class MockAPI(ThreadingHTTPServer):
+    """
+    Local stand-in for the Messages API.
+
+    Answers {"content": <prompt>} after `latency` seconds, or the statuses of
+    `failures` (with their retry-after header) for the first requests. Prompts
+    asking several tasks get a list of {"content": <task>}, one object short
+    with `short_lists`. Images marked for prompt caching are reported as
+    cache writes the first time and cache reads afterwards.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, failures=(), short_lists=False):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.failures = list(failures)
+        self.short_lists = short_lists
+        self.prompts = []
+        self.cached = set()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.clients = set()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests += 1
+            server.clients.add(self.client_address)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            failure = server.failures.pop(0) if server.failures else None
+        try:
+            time.sleep(server.latency)
+            if failure is not None:
+                status, retry_after = failure
+                payload = {
+                    "type": "error",
+                    "error": {"type": "rate_limit_error", "message": "slow down"},
+                }
+                headers = {"retry-after": str(retry_after)} if retry_after else {}
+            else:
+                status, headers = 200, {}
+                image, text = body["messages"][0]["content"]
+                answer, usage = _answer(server, text["text"], image)
+                payload = {
+                    "id": "msg_1",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": body["model"],
+                    "content": [{"type": "text", "text": json.dumps(answer)}],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": usage,
+                }
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def _answer(server, prompt, image):
+    usage = {"input_tokens": 10, "output_tokens": 5}
+    with server.lock:
+        server.prompts.append(prompt)
+        if "cache_control" in image:
+            data = image["source"]["data"]
+            cached = data in server.cached
+            server.cached.add(data)
+            usage[
+                "cache_read_input_tokens" if cached else "cache_creation_input_tokens"
+            ] = 100
+    tasks = re.findall(r"### Task \d+\n(.*?)(?=\n\n|$)", prompt)
+    if not tasks:
+        return {"content": prompt}, usage
+    answers = [{"content": task} for task in tasks]
+    return answers[:-1] if server.short_lists else answers, usage
+
+
+@pytest.fixture
+def api():
+    server = MockAPI(latency=0.02)
+    yield server
+    server.close()
+
+
+def _backend(api, **kwargs):
+    kwargs.setdefault("requests_per_second", 1000)
+    return ClaudeBackend(base_url=api.url, api_key="test", **kwargs)
+
+
+def _image():
+    return Image.new("RGB", (40, 60), (255, 255, 255))
+
+
+def test_concurrent_predictions_share_connections(api):
+    backend = _backend(api, max_concurrency=4)
+
+    async def run():
+        prompts = [f"Q{i}" for i in range(20)]
+        return prompts, await asyncio.gather(
+            *(backend.agenerate_prediction(prompt, _image()) for prompt in prompts)
+        )
+
+    try:
+        prompts, predictions = asyncio.run(run())
+    finally:
+        backend.close()
+    assert predictions == [{"content": prompt} for prompt in prompts]
+    assert api.requests == 20
+    assert 1 < api.max_in_flight <= 4
+    assert len(api.clients) <= 4
+
+
+def test_rate_limits_are_retried_after_the_header():
+    api = MockAPI(failures=[(429, 0.2), (529, 0.01)])
+    backend = _backend(api, max_concurrency=1)
+    collector = MetricsCollector()
+    try:
+        start = time.perf_counter()
+        with instrument(collector):
+            assert backend.generate_prediction("Q", _image()) == {"content": "Q"}
+        assert time.perf_counter() - start >= 0.2
+        # Halved on the rate limit, raised back on the success
+        assert backend.limiter.rate == pytest.approx(1000 * 0.55)
+    finally:
+        backend.close()
+        api.close()
+    assert api.requests == 3
+    retries = {
+        c["labels"]["reason"]: c["value"]
+        for c in collector.to_dict()["counters"]
+        if c["name"] == "retries"
+    }
+    assert retries == {"rate_limit": 1, "server_error": 1}
+
+
+def test_client_errors_are_not_retried():
+    api = MockAPI(failures=[(400, None)])
+    backend = _backend(api)
+    try:
+        assert backend.generate_prediction("Q", _image()) is None
+    finally:
+        backend.close()
+        api.close()
+    assert api.requests == 1
+
+
+def test_rate_limiter():
+    async def run(limiter, n):
+        start = time.perf_counter()
+        for _ in range(n):
+            await limiter.acquire()
+        return time.perf_counter() - start
+
+    limiter = AdaptiveRateLimiter(rate=50, burst=2)
+    # 2 tokens of burst, then 4 at 50 per second
+    assert 0.07 <= asyncio.run(run(limiter, 6)) < 0.5
+
+    limiter.on_rate_limit(retry_after=0.1)
+    assert limiter.rate == 25
+    assert asyncio.run(run(limiter, 1)) >= 0.09
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.rate == 50
+
+
+def test_batches_and_docexplainer_fan_out(api):
+    backend = _backend(api, max_concurrency=8)
+    set_claude_backend(backend)
+    try:
+        prompts = [f"Q{i}" for i in range(12)]
+        predictions = generate_prediction_batch(
+            prompts, [_image()] * 12, "claude-sonnet-4", None, None, batch_size=2
+        )
+        assert predictions == [{"content": prompt} for prompt in prompts]
+        assert api.max_in_flight > 2
+
+        explainer = DocExplainer(
+            "claude-sonnet-4", device="cpu", explainer=FakeExplainer()
+        )
+
+        async def run():
+            return await asyncio.gather(
+                *(explainer.aforward([_image()], f"Q{i}") for i in range(6))
+            )
+
+        results = asyncio.run(run())
+        assert all(result is not None and result.page == 0 for result in results)
+        assert explainer([_image()], "Q0") == results[0]
+    finally:
+        set_claude_backend(None)
+
+
+def _page(color):
+    return Image.new("RGB", (40, 60), (color, color, color))
+
+
+def _tokens(collector):
+    return {
+        c["name"]: c["value"]
+        for c in collector.to_dict()["counters"]
+        if c["name"].startswith("prompt_cache")
+    }
+
+
+def test_cached_mode_writes_one_prefix_per_page(api):
+    backend = _backend(api, request_mode="cached")
+    collector = MetricsCollector()
+    prompts = [f"Q{i}" for i in range(7)]
+    images = [_page(0)] * 4 + [_page(255)] * 3
+    try:
+        with instrument(collector):
+            predictions = backend.generate_predictions(prompts, images)
+    finally:
+        backend.close()
+    assert predictions == [{"content": prompt} for prompt in prompts]
+    assert api.requests == 7
+    # The first question of each page writes the prefix, the others read it
+    assert _tokens(collector) == {
+        "prompt_cache_creation_input_tokens": 200,
+        "prompt_cache_read_input_tokens": 500,
+    }
+
+
+def test_multi_mode_asks_the_questions_of_a_page_at_once(api):
+    backend = _backend(api, request_mode="multi")
+    prompts = [f"Q{i}" for i in range(7)]
+    images = [_page(0)] * 4 + [_page(255)] * 2 + [_page(128)]
+    try:
+        predictions = backend.generate_predictions(prompts, images)
+        # Per call, whatever the mode of the backend
+        assert backend.generate_prediction("Q", _page(0), "single") == {"content": "Q"}
+    finally:
+        backend.close()
+    assert predictions == [{"content": prompt} for prompt in prompts]
+    assert api.requests == 4
+    assert sum("### Task" in prompt for prompt in api.prompts) == 2
+
+
+def test_multi_mode_falls_back_on_incomplete_lists():
+    api = MockAPI(short_lists=True)
+    backend = _backend(api, request_mode="multi")
+    collector = MetricsCollector()
+    prompts = [f"Q{i}" for i in range(3)]
+    try:
+        with instrument(collector):
+            predictions = backend.generate_predictions(prompts, [_page(0)] * 3)
+    finally:
+        backend.close()
+        api.close()
+    assert predictions == [{"content": prompt} for prompt in prompts]
+    assert api.requests == 4
+    counters = {c["name"]: c["value"] for c in collector.to_dict()["counters"]}
+    assert counters["multi_question_fallbacks"] == 1
+
+
+def test_parse_json_list():
+    assert parse_json_list('```json\n[{"content": "a"}, {"content": "b"},]\n```') == [
+        {"content": "a"},
+        {"content": "b"},
+    ]
+    assert parse_json_list('{"content": "a"}') is None
+    assert parse_json_list("[not json]") is None
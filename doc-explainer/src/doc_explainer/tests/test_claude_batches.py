@@ -0,0 +1,254 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import anthropic
+import pytest
+from PIL import Image
+
+from doc_explainer.instrumentation import MetricsCollector, instrument
+from doc_explainer.models.claude_batches import (
+    MessageBatchJob,
+    custom_id,
+    request_hash,
+)
+
+
+class MockBatchAPI(ThreadingHTTPServer):
+    """
+    Local stand-in for the Message Batches API.
+
+    Batches end after `polls` status checks. Their results answer
+    {"content": <prompt>}, except for the prompts in `errored`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, polls=1, errored=()):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.polls = polls
+        self.errored = set(errored)
+        self.lock = threading.Lock()
+        self.batches = {}
+        self.checks = {}
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+    def batch(self, batch_id):
+        ended = self.checks[batch_id] >= self.polls
+        size = len(self.batches[batch_id])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else size,
+                "succeeded": size if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "results_url": f"{self.url}/results/{batch_id}" if ended else None,
+            "created_at": "2024-01-01T00:00:00Z",
+            "expires_at": "2024-01-02T00:00:00Z",
+            "ended_at": "2024-01-01T01:00:00Z" if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+        }
+
+    def result(self, request):
+        prompt = request["params"]["messages"][0]["content"][1]["text"]
+        if prompt in self.errored:
+            result = {
+                "type": "errored",
+                "error": {
+                    "type": "error",
+                    "error": {"type": "api_error", "message": "overloaded"},
+                },
+            }
+        else:
+            result = {
+                "type": "succeeded",
+                "message": {
+                    "id": "msg_1",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": request["params"]["model"],
+                    "content": [
+                        {"type": "text", "text": json.dumps({"content": prompt})}
+                    ],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": 10, "output_tokens": 5},
+                },
+            }
+        return {"custom_id": request["custom_id"], "result": result}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, data, content_type="application/json"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            batch_id = f"msgbatch_{len(server.batches)}"
+            server.batches[batch_id] = body["requests"]
+            server.checks[batch_id] = 0
+            payload = server.batch(batch_id)
+        self._send(json.dumps(payload).encode())
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        match = re.fullmatch(r"/results/(\w+)", path)
+        if match:
+            requests = server.batches[match.group(1)]
+            lines = [json.dumps(server.result(request)) for request in requests]
+            self._send(("\n".join(lines) + "\n").encode(), "application/x-jsonl")
+            return
+        batch_id = path.rsplit("/", 1)[-1]
+        with server.lock:
+            server.checks[batch_id] += 1
+            payload = server.batch(batch_id)
+        self._send(json.dumps(payload).encode())
+
+
+def _client(api):
+    return anthropic.Anthropic(base_url=api.url, api_key="test", max_retries=0)
+
+
+def _image():
+    return Image.new("RGB", (40, 60), (255, 255, 255))
+
+
+def _job(api, path, **kwargs):
+    kwargs.setdefault("poll_interval", 0.01)
+    return MessageBatchJob(str(path), client=_client(api), **kwargs)
+
+
+@pytest.fixture
+def api():
+    server = MockBatchAPI(polls=2, errored=["Q3"])
+    yield server
+    server.close()
+
+
+def test_batches_are_packed_and_mapped_back_to_keys(api, tmp_path):
+    collector = MetricsCollector()
+    keys = [("docvqa", f"doc{i // 2}", f"q{i % 2}") for i in range(5)]
+    with (
+        instrument(collector),
+        _job(api, tmp_path / "jobs.jsonl", max_requests=2) as job,
+    ):
+        assert all(job.add(key, f"Q{i}", _image()) for i, key in enumerate(keys))
+        # Submitted as soon as a batch is full
+        assert len(api.batches) == 2
+        job.wait(timeout=5)
+
+    assert sorted(len(requests) for requests in api.batches.values()) == [1, 2, 2]
+    assert job.unfinished_batches == []
+    for i, key in enumerate(keys):
+        if i == 3:
+            assert not job.has_prediction(key)
+        else:
+            assert job.prediction(key) == {"content": f"Q{i}"}
+    assert job.failures == {keys[3]: "errored"}
+
+    counters = {c["name"]: c["value"] for c in collector.to_dict()["counters"]}
+    assert counters["batch_requests"] == 5
+    assert counters["batch_failures"] == 1
+    assert counters["input_tokens"] == 40
+
+
+def test_resume_after_interruption(api, tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    keys = [("docvqa", "doc", f"q{i}") for i in range(3)]
+    with _job(api, path, max_requests=2) as job:
+        for i, key in enumerate(keys):
+            job.add(key, f"Q{i}", _image())
+        job.flush()
+    # Interrupted before any result, with a record cut by the crash
+    with open(path, "a") as f:
+        f.write('{"id": "')
+
+    with _job(api, path, max_requests=2) as job:
+        assert len(job.unfinished_batches) == 2
+        assert not any(job.add(key, f"Q{i}", _image()) for i, key in enumerate(keys))
+        job.wait(timeout=5)
+        assert job.prediction(keys[2]) == {"content": "Q2"}
+    assert len(api.batches) == 2
+
+    # Everything is replayed from the journal, without calling the API
+    api.close()
+    job = _job(api, path)
+    assert job.unfinished_batches == []
+    assert [job.prediction(key) for key in keys] == [
+        {"content": f"Q{i}"} for i in range(3)
+    ]
+    # Nothing written, the journal was not opened
+    assert job._journal is None
+
+
+def test_changed_requests_are_sent_again(api, tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    keys = [("docvqa", "doc", f"q{i}") for i in range(2)]
+    with _job(api, path) as job:
+        for i, key in enumerate(keys):
+            job.add(key, f"Q{i}", _image())
+        job.wait(timeout=5)
+
+    with _job(api, path) as job:
+        assert job.submitted(keys[0])
+        # Another prompt, then another page size
+        assert job.add(keys[0], "Q0 v2", _image())
+        assert job.add(keys[1], "Q1", Image.new("RGB", (60, 40), "white"))
+        assert not job.add(keys[0], "Q0 v2", _image())
+        job.wait(timeout=5)
+        assert job.prediction(keys[0]) == {"content": "Q0 v2"}
+    assert len(api.batches) == 2
+
+    # A failed new request does not fall back to the result of the previous one
+    with _job(api, path) as job:
+        assert job.add(keys[0], "Q3", _image())
+        job.wait(timeout=5)
+        assert not job.has_prediction(keys[0])
+        assert job.failures == {keys[0]: "errored"}
+
+    api.close()
+    job = _job(api, path)
+    assert not job.has_prediction(keys[0])
+    assert job.prediction(keys[1]) == {"content": "Q1"}
+
+
+def test_custom_id():
+    cid = custom_id(("docvqa", "doc 1", "q/1"))
+    assert re.fullmatch(r"[a-zA-Z0-9_-]{1,64}", cid)
+    assert cid == custom_id(["docvqa", "doc 1", "q/1"])
+    assert cid != custom_id(("docvqa", "doc 1", "q/2"))
+
+    params = request_hash("Where is the total?", (40, 60))
+    assert params == request_hash("Where is the total?", (40, 60))
+    assert params != request_hash("Where is the total?", (60, 40))
+    assert params != request_hash("Where is the date?", (40, 60))
+    assert re.fullmatch(r"[a-zA-Z0-9_-]{1,64}", custom_id(("docvqa",), params))
+    assert custom_id(("docvqa",), params) != custom_id(("docvqa",))
@@ -0,0 +1,79 @@
+import pytest
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from doc_explainer.models import utils
+from doc_explainer.models.device import (
+    attention_implementation,
+    load_options,
+    quantization_of,
+    quantize,
+    resolve_device,
+    set_num_threads,
+)
+
+
+def test_resolve_device(monkeypatch):
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: False)
+    assert resolve_device("auto") == "cpu"
+    assert resolve_device(None) == "cpu"
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: True)
+    assert resolve_device("auto") == "cuda"
+    assert resolve_device("cpu") == "cpu"
+
+
+def test_attention_falls_back_to_sdpa_on_cpu():
+    assert attention_implementation("cpu") == "sdpa"
+
+
+def test_load_options():
+    options = load_options("cpu")
+    assert options["torch_dtype"] == torch.float32
+    assert options["device_map"] == "cpu"
+    assert load_options("cpu", "int8")["torch_dtype"] == torch.float32
+    assert load_options("cpu", "bf16")["torch_dtype"] == torch.bfloat16
+    options = load_options("cuda", default_dtype=torch.bfloat16)
+    assert options["torch_dtype"] == torch.bfloat16
+    assert options["device_map"] == "auto"
+    assert load_options("cuda:1")["device_map"] == "cuda:1"
+
+    with pytest.raises(ValueError):
+        load_options("cuda", "int8")
+    with pytest.raises(ValueError):
+        load_options("cpu", "int4")
+
+
+def test_int8_quantization():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Linear(64, 64), nn.ReLU(), nn.Linear(64, 8))
+    inputs = torch.randn(4, 64)
+    expected = model(inputs)
+
+    assert quantize(model, None) is model and quantization_of(model) is None
+    model = quantize(model, "int8")
+    assert quantization_of(model) == "int8"
+    assert type(model[0]) is not nn.Linear
+    assert torch.allclose(model(inputs), expected, atol=0.05)
+
+
+def test_set_num_threads():
+    threads = torch.get_num_threads()
+    try:
+        set_num_threads(1)
+        assert torch.get_num_threads() == 1
+        set_num_threads(None)
+        assert torch.get_num_threads() == 1
+    finally:
+        torch.set_num_threads(threads)
+    with pytest.raises(ValueError):
+        set_num_threads(0)
+
+
+def test_quantized_models_have_their_own_cache_keys():
+    image = Image.new("RGB", (8, 8))
+    model = nn.Linear(2, 2)
+    key = utils._cache_key("Q", image, utils.VLMModel.SMOLVLM, model)
+    assert utils._cache_key("Q", image, utils.VLMModel.SMOLVLM, None) == key
+    quantize(model, "int8")
+    assert utils._cache_key("Q", image, utils.VLMModel.SMOLVLM, model) != key
@@ -0,0 +1,41 @@
+from PIL import Image
+
+from doc_explainer import DocExplainer
+from doc_explainer.models.fake import FakeExplainer, FakeVLM
+from doc_explainer.models.utils import generate_prediction, get_model_and_processor
+
+
+def _image(size=(40, 60)):
+    return Image.new("RGB", size, (255, 255, 255))
+
+
+def test_fake_backend_is_deterministic():
+    model, processor = get_model_and_processor("fake")
+    assert isinstance(model, FakeVLM) and processor is None
+
+    first = generate_prediction("Q", _image(), "fake", model, processor)
+    assert generate_prediction("Q", _image(), "fake", model, processor) == first
+    assert generate_prediction("Q2", _image(), "fake", model, processor) != first
+    assert isinstance(first["content"], str)
+    x, y, w, h = first["position"]
+    assert 0 <= x <= 1000 and 0 <= y <= 1000 and w > 0 and h > 0
+    assert model.calls == 3
+
+
+def test_fake_backend_canned_response_and_failures():
+    canned = {"content": "42", "position": [1, 2, 3, 4]}
+    model = FakeVLM(response=canned)
+    assert generate_prediction("Q", _image(), "fake", model, None) == canned
+
+    model = FakeVLM(failure_rate=1.0)
+    assert generate_prediction("Q", _image(), "fake", model, None) is None
+
+
+def test_docexplainer_with_stub_explainer():
+    explainer = DocExplainer("fake", device="cpu", explainer=FakeExplainer())
+    result = explainer([_image(), _image()], "What is the total?")
+    assert result.page == 0
+    x0, y0, x1, y1 = result.bbox
+    assert 0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1
+    assert explainer.explainer.calls == 1
+    assert explainer([_image()], "What is the total?") == result
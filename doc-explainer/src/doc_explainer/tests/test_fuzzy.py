@@ -0,0 +1,100 @@
+import random
+from difflib import SequenceMatcher
+
+from doc_explainer.fuzzy import FuzzyMatcher
+
+VOCABULARY = [
+    "Invoice",
+    "INV-2021-0042",
+    "Total",
+    "1,250.00",
+    "USD",
+    "Date",
+    "2021-03-04",
+    "Acme",
+    "Corp.",
+    "Due",
+    "Amount",
+    "Tax",
+    "VAT",
+    "12%",
+    "Page",
+    "of",
+    "2",
+]
+
+
+def _random_words(seed, n, pages=2):
+    rng = random.Random(seed)
+    return [
+        {
+            "page": rng.randint(1, pages),
+            "text": rng.choice(VOCABULARY),
+            "bbox": [
+                rng.randint(0, 900),
+                rng.randint(0, 950),
+                rng.randint(1, 90),
+                rng.randint(1, 40),
+            ],
+        }
+        for _ in range(n)
+    ]
+
+
+def _scan(target, words, page):
+    # Linear scan of 02_ocr_naive.find_best_word_bbox
+    target = str(target).strip()
+    best_match, best_score = None, 0
+    for w in words:
+        if w["page"] != page:
+            continue
+        ocr_word = str(w.get("text", "")).strip()
+        score = SequenceMatcher(None, target.lower(), ocr_word.lower()).ratio()
+        if score > best_score and score >= 0.6:
+            best_score = score
+            x, y, w_, h_ = w["bbox"]
+            best_match = [x, y, x + w_, y + h_]
+    return best_match, best_score
+
+
+def test_match_same_as_linear_scan():
+    words = _random_words(0, 300)
+    matcher = FuzzyMatcher(words)
+    targets = VOCABULARY + [
+        "invoice 42",
+        "1250",
+        "acme corporation",
+        "tota",
+        "xyz",
+        "",
+        2021,
+    ]
+
+    for target in targets:
+        for page in (1, 2, 3):
+            expected_bbox, expected_score = _scan(target, words, page)
+            match = matcher.match(target, page)
+            if expected_bbox is None:
+                assert match is None
+            else:
+                assert match.bbox == expected_bbox
+                assert match.score == expected_score
+
+
+def test_match_span():
+    words = [
+        {"page": 1, "text": "Total", "bbox": [100, 500, 50, 20]},
+        {"page": 1, "text": "amount", "bbox": [160, 500, 70, 20]},
+        {"page": 1, "text": "due", "bbox": [240, 500, 40, 20]},
+        {"page": 1, "text": "1,250.00", "bbox": [400, 500, 80, 20]},
+    ]
+    matcher = FuzzyMatcher(words)
+
+    single = matcher.match("Total amount due", page=1)
+    span = matcher.match("Total amount due", page=1, max_span=3)
+
+    assert single is None
+    assert span.score == 1.0
+    assert span.word_ids == [0, 1, 2]
+    assert span.bbox == [100.0, 500.0, 280.0, 520.0]
+    assert span.page == 1
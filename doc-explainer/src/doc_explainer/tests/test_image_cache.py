@@ -0,0 +1,106 @@
+import base64
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from doc_explainer.instrumentation import MetricsCollector, instrument
+from doc_explainer.models.claude import encode_images
+from doc_explainer.models.image_cache import (
+    EncodedImageCache,
+    choose_format,
+    encode_page,
+    set_image_cache,
+)
+
+
+def _page(color=255, size=(200, 300)):
+    return Image.new("RGB", size, (color, color, color))
+
+
+def _scan(seed=0, size=(200, 300)):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), np.uint8))
+
+
+def _decode(encoded):
+    return Image.open(BytesIO(base64.b64decode(encoded.data)))
+
+
+def test_format_follows_the_content_of_the_page():
+    assert choose_format(_page()) == "png"
+    assert choose_format(_scan()) == "jpeg"
+
+    encoded = encode_page(_page().convert("RGBA"), "auto")
+    assert encoded.media_type == "image/png"
+    assert _decode(encoded).format == "PNG"
+    for image_format in ("jpeg", "webp"):
+        encoded = encode_page(_scan().convert("P"), image_format)
+        assert encoded.media_type == f"image/{image_format}"
+        assert _decode(encoded).size == (200, 300)
+    with pytest.raises(ValueError):
+        encode_page(_page(), "gif")
+
+
+def test_pages_are_encoded_once():
+    cache = EncodedImageCache()
+    collector = MetricsCollector()
+    # Equal pixels in distinct objects, as pages decoded once per question
+    pages = [_page(), _scan(), _page(), _scan(), _page(0)]
+    try:
+        with instrument(collector):
+            first = cache.get_many(pages)
+            assert [cache.get(page) for page in pages] == first
+    finally:
+        cache.close()
+    assert first[0] == first[2] and first[1] == first[3]
+    assert first[0] != first[4]
+
+    stats = cache.stats()
+    assert (stats["misses"], stats["entries"]) == (3, 3)
+    # Duplicates within get_many wait for the same encoding
+    assert stats["hits"] >= 5
+    counters = {c["name"]: c["value"] for c in collector.to_dict()["counters"]}
+    assert counters["image_cache_misses"] == 3
+    assert counters["image_encoding_seconds_saved"] > 0
+    encodings = [
+        s for s in collector.to_dict()["stages"] if s["stage"] == "image_encoding"
+    ]
+    assert sum(s["calls"] for s in encodings) == 3
+
+
+def test_pages_edited_in_place_are_encoded_again():
+    cache = EncodedImageCache()
+    page = _page()
+    try:
+        before = cache.get(page)
+        ImageDraw.Draw(page).rectangle([10, 10, 50, 50], fill="black")
+        after = cache.get(page)
+    finally:
+        cache.close()
+    assert after != before
+    assert _decode(after).getpixel((20, 20)) == (0, 0, 0)
+
+
+def test_least_recently_used_pages_are_evicted():
+    size = len(encode_page(_scan(0), "auto").data)
+    cache = EncodedImageCache(max_bytes=int(size * 2.5))
+    for seed in (0, 1, 0, 2):
+        cache.get(_scan(seed))
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"]) == (2, 1)
+    assert stats["bytes"] <= cache.max_bytes
+    cache.get(_scan(0))
+    assert cache.stats()["misses"] == 3
+
+
+def test_claude_payloads_skip_oversized_pages():
+    set_image_cache(EncodedImageCache(image_format="jpeg"))
+    try:
+        encoded = encode_images([_page(), _page(size=(10, 9000)), _page()])
+    finally:
+        set_image_cache(EncodedImageCache())
+    assert encoded[1] is None
+    assert encoded[0] == encoded[2]
+    assert encoded[0].media_type == "image/jpeg"
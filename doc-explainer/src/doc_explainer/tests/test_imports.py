@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules of the VLM backends, that lightweight imports must not pull in
+HEAVY_MODULES = ["torch", "transformers", "anthropic", "qwen_vl_utils"]
+
+# Generous bound on the import time; the heavy modules alone take seconds
+MAX_IMPORT_SECONDS = 2.0
+
+SRC = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _import_in_subprocess(code: str) -> dict:
+    script = f"""
+import json, sys, time
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+heavy = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "heavy": heavy}}))
+"""
+    env = dict(os.environ, PYTHONPATH=SRC)
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import doc_explainer",
+        "from doc_explainer import ExplainableAnswer",
+        "import doc_explainer.metrics, doc_explainer.anls, doc_explainer.spatial",
+        "from doc_explainer.models.utils import generate_prediction",
+    ],
+)
+def test_lightweight_imports(code):
+    result = _import_in_subprocess(code)
+    assert result["heavy"] == []
+    assert result["seconds"] < MAX_IMPORT_SECONDS
+
+
+def test_fake_backend_does_not_import_torch():
+    result = _import_in_subprocess(
+        "from PIL import Image\n"
+        "from doc_explainer.models.utils import generate_prediction, get_model_and_processor\n"
+        "model, processor = get_model_and_processor('fake')\n"
+        "generate_prediction('Q', Image.new('RGB', (8, 8)), 'fake', model, processor)"
+    )
+    assert result["heavy"] == []
+
+
+def test_backends_are_imported_on_first_use():
+    result = _import_in_subprocess("from doc_explainer import DocExplainer")
+    assert "torch" in result["heavy"]
+    assert "anthropic" not in result["heavy"]
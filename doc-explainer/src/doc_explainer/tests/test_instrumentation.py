@@ -0,0 +1,93 @@
+import json
+
+from PIL import Image
+
+from doc_explainer import DocExplainer, instrumentation
+from doc_explainer.instrumentation import MetricsCollector, count, instrument, stage
+from doc_explainer.models.fake import FakeExplainer
+
+
+def _stages(collector):
+    return {
+        (s["stage"], s["labels"].get("backend")): s
+        for s in collector.to_dict()["stages"]
+    }
+
+
+def test_disabled_is_a_no_op():
+    assert not instrumentation.enabled()
+    assert stage("a") is stage("b", backend="x")
+    count("tokens", 3)
+
+
+def test_collects_docexplainer_stages_and_tokens():
+    explainer = DocExplainer("fake", device="cpu", explainer=FakeExplainer())
+    image = Image.new("RGB", (32, 32))
+    collector = MetricsCollector()
+    with instrument(collector):
+        for _ in range(3):
+            explainer([image], "What is the total?")
+    assert not instrumentation.enabled()
+
+    stages = _stages(collector)
+    assert stages[("docexplainer.forward", None)]["calls"] == 3
+    assert stages[("explainer.predict", None)]["calls"] == 3
+    for name in ("generate_prediction", "generation", "json_parsing"):
+        assert stages[(name, "fake")]["calls"] == 3
+    forward = stages[("docexplainer.forward", None)]
+    assert forward["seconds"] >= stages[("generation", "fake")]["seconds"]
+    assert forward["max_seconds"] <= forward["seconds"]
+
+    counters = {c["name"]: c for c in collector.to_dict()["counters"]}
+    assert counters["input_tokens"]["labels"] == {"backend": "fake"}
+    assert counters["input_tokens"]["value"] > 0
+    assert counters["output_tokens"]["value"] > 0
+
+
+def test_peak_memory_of_nested_stages():
+    collector = MetricsCollector(track_memory=True)
+    try:
+        with instrument(collector):
+            with stage("outer"):
+                with stage("inner"):
+                    data = bytearray(4 << 20)
+                del data
+                with stage("small"):
+                    pass
+    finally:
+        collector.close()
+
+    stages = _stages(collector)
+    inner = stages[("inner", None)]["peak_bytes"]
+    assert inner >= 4 << 20
+    assert stages[("outer", None)]["peak_bytes"] >= inner
+    assert stages[("small", None)]["peak_bytes"] < 4 << 20
+
+
+def test_exports():
+    collector = MetricsCollector()
+    with instrument(collector):
+        with stage("generation", backend='we"ird'):
+            pass
+        count("retries", 2, backend="claude-sonnet-4", reason="rate_limit")
+
+    data = json.loads(collector.to_json())
+    assert data["stages"][0]["calls"] == 1
+    assert data["counters"] == [
+        {
+            "name": "retries",
+            "labels": {"backend": "claude-sonnet-4", "reason": "rate_limit"},
+            "value": 2,
+        }
+    ]
+
+    text = collector.to_prometheus()
+    assert "# TYPE docexplainer_stage_seconds_total counter" in text
+    assert (
+        'docexplainer_stage_calls_total{backend="we\\"ird",stage="generation"} 1'
+        in text
+    )
+    assert (
+        'docexplainer_retries_total{backend="claude-sonnet-4",reason="rate_limit"} 2'
+        in text
+    )
@@ -1,9 +1,19 @@
+import numpy as np
+
 from doc_explainer.metrics import (
+    IOU_SWEEP_THRESHOLDS,
+    batch_iou,
+    batch_iou_with_threshold,
+    batch_normalized_center_distance,
     bbox_area,
     bbox_center,
     compute_iou,
     compute_iou_with_threshold,
     compute_normalized_center_distance,
+    iou_threshold_sweep,
+    mean_iou_over_thresholds,
+    pairwise_iou,
+    pairwise_normalized_center_distance,
 )
 
 
@@ -37,3 +47,78 @@ def test_compute_normalized_center_distance():
     bbox1 = [0.0, 0.0, 1.0, 1.0]
     bbox2 = [2.0, 2.0, 3.0, 3.0]
     assert abs(compute_normalized_center_distance(bbox1, bbox2) - 2 / 3) < 1e-10
+
+
+def _reference_iou(b1, b2):
+    x0, y0 = max(b1[0], b2[0]), max(b1[1], b2[1])
+    x1, y1 = min(b1[2], b2[2]), min(b1[3], b2[3])
+    inter_area = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    union_area = bbox_area(b1) + bbox_area(b2) - inter_area
+    return inter_area / union_area if union_area > 0 else 0.0
+
+
+def _random_boxes(rng, n):
+    xy = rng.integers(0, 900, size=(n, 2))
+    wh = rng.integers(0, 100, size=(n, 2))
+    return np.concatenate([xy, xy + wh], axis=1)
+
+
+def test_batch_iou_matches_scalar():
+    rng = np.random.default_rng(0)
+    b1 = _random_boxes(rng, 200)
+    b2 = _random_boxes(rng, 200)
+
+    ious = batch_iou(b1, b2)
+
+    assert ious.shape == (200,)
+    for i in range(200):
+        assert ious[i] == _reference_iou(b1[i].tolist(), b2[i].tolist())
+        assert compute_iou(b1[i].tolist(), b2[i].tolist()) == ious[i]
+
+
+def test_pairwise_iou():
+    rng = np.random.default_rng(1)
+    b1 = _random_boxes(rng, 5)
+    b2 = _random_boxes(rng, 7)
+
+    matrix = pairwise_iou(b1, b2)
+
+    assert matrix.shape == (5, 7)
+    for i in range(5):
+        assert np.array_equal(matrix[i], batch_iou(np.repeat(b1[i : i + 1], 7, 0), b2))
+
+
+def test_batch_iou_with_threshold():
+    b1 = [[0.0, 0.0, 1.0, 1.0], [0.0, 0.0, 1.0, 1.0]]
+    b2 = [[0.0, 0.0, 1.0, 1.0], [2.0, 2.0, 3.0, 3.0]]
+    assert batch_iou_with_threshold(b1, b2).tolist() == [True, False]
+
+
+def test_normalized_center_distance_batch_and_pairwise():
+    rng = np.random.default_rng(2)
+    b1 = _random_boxes(rng, 4)
+    b2 = _random_boxes(rng, 4)
+
+    distances = batch_normalized_center_distance(b1, b2)
+    matrix = pairwise_normalized_center_distance(b1, b2)
+
+    assert np.array_equal(np.diag(matrix), distances)
+    for i in range(4):
+        expected = compute_normalized_center_distance(b1[i].tolist(), b2[i].tolist())
+        assert distances[i] == expected
+
+
+def test_iou_threshold_sweep():
+    ious = [0.4, 0.5, 0.8, 1.0]
+
+    curve = iou_threshold_sweep(ious)
+
+    assert curve.shape == IOU_SWEEP_THRESHOLDS.shape
+    assert curve[0] == 0.75  # IoU >= 0.5
+    assert curve[-1] == 0.25  # IoU >= 0.95
+    assert mean_iou_over_thresholds(ious) == curve.mean()
+    assert iou_threshold_sweep([], [0.5]).tolist() == [0.0]
+
+
+def test_compute_iou_with_malformed_bbox():
+    assert compute_iou([0.0, 0.0], [0.0, 0.0, 1.0, 1.0]) == 0.0
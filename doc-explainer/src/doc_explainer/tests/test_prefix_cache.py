@@ -0,0 +1,177 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image
+from transformers import (
+    Qwen2_5_VLConfig,
+    Qwen2_5_VLForConditionalGeneration,
+    SmolVLMConfig,
+    SmolVLMForConditionalGeneration,
+)
+
+from doc_explainer.instrumentation import MetricsCollector, instrument
+from doc_explainer.models.prefix_cache import PrefixCache, prefix_length
+
+GREEDY = {"max_new_tokens": 6, "do_sample": False}
+SMOL_IMAGE, QWEN_IMAGE = 60, 70
+
+
+def _smol():
+    torch.manual_seed(0)
+    config = SmolVLMConfig(
+        vision_config=dict(
+            hidden_size=32,
+            num_hidden_layers=1,
+            num_attention_heads=2,
+            intermediate_size=64,
+            image_size=32,
+            patch_size=8,
+        ),
+        text_config=dict(
+            model_type="llama",
+            vocab_size=64,
+            hidden_size=32,
+            intermediate_size=64,
+            num_hidden_layers=2,
+            num_attention_heads=4,
+            num_key_value_heads=2,
+            max_position_embeddings=256,
+        ),
+        scale_factor=2,
+        image_token_id=SMOL_IMAGE,
+    )
+    return SmolVLMForConditionalGeneration(config).eval()
+
+
+def _qwen():
+    torch.manual_seed(0)
+    config = Qwen2_5_VLConfig(
+        vision_config=dict(
+            depth=1,
+            hidden_size=32,
+            intermediate_size=64,
+            num_heads=2,
+            out_hidden_size=32,
+            patch_size=2,
+            spatial_merge_size=2,
+            temporal_patch_size=2,
+            window_size=8,
+            fullatt_block_indexes=[0],
+        ),
+        text_config=dict(
+            vocab_size=80,
+            hidden_size=32,
+            intermediate_size=64,
+            num_hidden_layers=2,
+            num_attention_heads=4,
+            num_key_value_heads=2,
+            max_position_embeddings=256,
+            rope_scaling={"type": "mrope", "mrope_section": [1, 1, 2]},
+        ),
+        image_token_id=QWEN_IMAGE,
+        video_token_id=71,
+        vision_start_token_id=72,
+        vision_end_token_id=73,
+    )
+    return Qwen2_5_VLForConditionalGeneration(config).eval()
+
+
+def _smol_inputs(page, question):
+    ids = torch.tensor([[1, 5, 6, *[SMOL_IMAGE] * 4, *question]])
+    torch.manual_seed(page)
+    return {
+        "input_ids": ids,
+        "attention_mask": torch.ones_like(ids),
+        "pixel_values": torch.randn(1, 1, 3, 32, 32),
+    }
+
+
+def _qwen_inputs(page, question):
+    ids = torch.tensor([[1, 5, 72, *[QWEN_IMAGE] * 4, 73, *question]])
+    torch.manual_seed(page)
+    return {
+        "input_ids": ids,
+        "attention_mask": torch.ones_like(ids),
+        "mm_token_type_ids": (ids == QWEN_IMAGE).long(),
+        "pixel_values": torch.randn(16, 24),
+        "image_grid_thw": torch.tensor([[1, 4, 4]]),
+    }
+
+
+def _page(page):
+    return Image.new("RGB", (8, 8), (page, page, page))
+
+
+def _check_same_predictions(model, make_inputs, image_token):
+    cache = PrefixCache()
+    collector = MetricsCollector()
+    # Pages interleaved, so that the prefix of another page is restored in between
+    calls = [(0, [7, 8]), (1, [7, 8]), (0, [9, 10, 11]), (1, [12]), (0, [7, 8])]
+    with instrument(collector):
+        for page, question in calls:
+            inputs = make_inputs(page, question)
+            length = prefix_length(inputs["input_ids"], [image_token])
+            expected = model.generate(**inputs, **GREEDY)
+            generated = cache.generate(
+                model, inputs, _page(page), length, "test", **GREEDY
+            )
+            assert torch.equal(generated, expected)
+
+    stats = cache.stats()
+    assert (stats["misses"], stats["hits"], stats["entries"]) == (2, 3, 2)
+    counters = {c["name"]: c["value"] for c in collector.to_dict()["counters"]}
+    assert counters["prefix_cache_hits"] == 3
+    assert counters["prefix_tokens_reused"] == 5 * length
+    return cache
+
+
+def test_prefix_length_ends_after_the_last_image_token():
+    assert prefix_length(torch.tensor([[1, 2, 60, 60, 3, 4]]), [60]) == 4
+    assert prefix_length(torch.tensor([[1, 2, 3]]), [60]) == 0
+
+
+def test_smolvlm_predictions_are_unchanged():
+    _check_same_predictions(_smol(), _smol_inputs, SMOL_IMAGE)
+
+
+def test_qwen_predictions_are_unchanged():
+    _check_same_predictions(_qwen(), _qwen_inputs, QWEN_IMAGE)
+
+
+def test_prefixes_are_evicted():
+    model = _smol()
+    cache = _check_same_predictions(model, _smol_inputs, SMOL_IMAGE)
+    assert cache.evict_pages([_page(0), _page(5)]) == 1
+    assert cache.stats()["entries"] == 1
+
+    # Room for a single prefix: the least recently used one goes
+    cache = PrefixCache(max_bytes=cache.loaded_bytes())
+    for page in (0, 1, 2):
+        inputs = _smol_inputs(page, [7])
+        length = prefix_length(inputs["input_ids"], [SMOL_IMAGE])
+        cache.generate(model, inputs, _page(page), length, "test", **GREEDY)
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"]) == (1, 2)
+    assert stats["bytes"] <= cache.max_bytes
+
+
+def test_concurrent_pages_on_one_model():
+    # Pages of different grids, whose rotary offsets differ on the shared model
+    def inputs_of(page, question):
+        inputs = _qwen_inputs(page, question)
+        inputs["image_grid_thw"] = torch.tensor([[1, 4, 4] if page % 2 else [1, 2, 8]])
+        return inputs
+
+    model = _qwen()
+    cache = PrefixCache()
+    calls = [(page % 4, [7 + page % 3]) for page in range(16)]
+    expected = [model.generate(**inputs_of(*call), **GREEDY) for call in calls]
+
+    def run(call):
+        inputs = inputs_of(*call)
+        length = prefix_length(inputs["input_ids"], [QWEN_IMAGE])
+        return cache.generate(model, inputs, _page(call[0]), length, "test", **GREEDY)
+
+    with ThreadPoolExecutor(4) as pool:
+        generated = list(pool.map(run, calls))
+    assert all(torch.equal(g, e) for g, e in zip(generated, expected))
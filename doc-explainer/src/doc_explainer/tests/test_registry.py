@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+import torch.nn as nn
+from PIL import Image
+
+from doc_explainer import DocExplainer
+from doc_explainer.instrumentation import MetricsCollector, instrument
+from doc_explainer.models.fake import FakeExplainer, FakeVLM
+from doc_explainer.models.registry import ModelRegistry, model_bytes
+
+
+def _linear(n=10):
+    # n x n float32 weights and n biases
+    return nn.Linear(n, n)
+
+
+def test_model_bytes():
+    assert model_bytes(_linear()) == (100 + 10) * 4
+    assert model_bytes((_linear(), None)) == 440
+    assert model_bytes(FakeVLM()) == 0
+
+
+def test_models_are_loaded_once():
+    registry = ModelRegistry()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return _linear()
+
+    first = registry.get("a", loader)
+    assert registry.get("a", loader) is first
+    assert len(loads) == 1
+    stats = registry.stats()
+    assert stats["loads"] == 1 and stats["hits"] == 1
+    assert stats["models"] == [
+        {"key": "a", "bytes": 440, "load_seconds": stats["load_seconds"]}
+    ]
+
+
+def test_concurrent_gets_share_one_load():
+    registry = ModelRegistry()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        time.sleep(0.05)
+        return _linear()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.get("a", loader)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_least_recently_used_models_are_evicted():
+    registry = ModelRegistry(max_bytes=1000)
+    collector = MetricsCollector()
+    with instrument(collector):
+        registry.get("a", _linear)
+        registry.get("b", _linear)
+        registry.get("a", _linear)
+        registry.get("c", _linear)  # 3 x 440 bytes, "b" goes
+
+    assert "a" in registry and "c" in registry and "b" not in registry
+    assert registry.loaded_bytes() == 880
+    assert registry.stats()["evictions"] == 1
+    counters = collector.to_dict()["counters"]
+    assert counters == [{"name": "model_evictions", "labels": {}, "value": 1}]
+    loads = [(s["stage"], s["labels"]["model"]) for s in collector.to_dict()["stages"]]
+    assert loads == [("model_load", "a"), ("model_load", "b"), ("model_load", "c")]
+
+    # Too large for the budget: kept alone
+    registry.get("big", lambda: _linear(20))
+    assert [m["key"] for m in registry.stats()["models"]] == ["big"]
+
+    assert registry.evict("big") and not registry.evict("big")
+    assert registry.loaded_bytes() == 0
+
+
+def test_failed_loads_are_not_stored():
+    registry = ModelRegistry()
+
+    def loader():
+        raise OSError("no weights")
+
+    with pytest.raises(OSError):
+        registry.get("a", loader)
+    assert "a" not in registry
+    assert registry.get("a", _linear) is not None
+
+
+def test_docexplainers_share_their_models():
+    registry = ModelRegistry()
+    registry.get(("letxbe/DocExplainer",), FakeExplainer)
+    first = DocExplainer("fake", device="cpu", registry=registry)
+    second = DocExplainer("fake", device="cpu", registry=registry)
+    assert registry.stats()["loads"] == 1  # models are loaded on first use
+
+    image = Image.new("RGB", (40, 60))
+    assert first([image], "Q") == second([image], "Q")
+    assert first.vlm is second.vlm
+    assert first.explainer is second.explainer
+    assert registry.stats()["loads"] == 2
+    assert first.explainer.calls == 2
+
+    # Reloaded after an eviction
+    registry.evict(("fake", "cpu", None))
+    assert first([image], "Q") == second([image], "Q")
+    assert registry.stats()["loads"] == 3
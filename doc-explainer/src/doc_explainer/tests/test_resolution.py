@@ -0,0 +1,109 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from doc_explainer.instrumentation import MetricsCollector, instrument
+from doc_explainer.models.fake import FakeVLM
+from doc_explainer.models.resolution import (
+    ResolutionBudget,
+    ResolutionPolicy,
+    fit,
+    image_tokens,
+    native_tokens,
+    set_resolution_policy,
+)
+from doc_explainer.models.utils import (
+    _cache_key,
+    generate_prediction,
+    generate_prediction_batch,
+)
+
+# A letter page scanned at 300 dpi
+SCAN = (2550, 3300)
+
+
+@pytest.fixture
+def policy():
+    def use(**kwargs):
+        policy = ResolutionPolicy(**kwargs)
+        set_resolution_policy(policy)
+        return policy
+
+    yield use
+    set_resolution_policy(None)
+
+
+def test_token_estimates_follow_the_processors():
+    # Qwen: 28 px per token; SmolVLM: 384 px tiles of 81 tokens plus the page
+    assert image_tokens("qwen2.5-vl-7b", SCAN) == 91 * 118
+    assert image_tokens("smolvlm", (700, 900)) == 81 * (3 * 3 + 1)
+    assert native_tokens("smolvlm", (700, 900)) == 81 * (4 * 4 + 1)
+    # Claude downscales large pages itself
+    assert image_tokens("claude-sonnet-4", SCAN) == image_tokens(
+        "claude-sonnet-4", (2550 * 2, 3300 * 2)
+    )
+
+
+def test_pages_are_downscaled_within_the_budget():
+    for backend in ("qwen2.5-vl-7b", "smolvlm"):
+        resize = fit(SCAN, backend, ResolutionBudget(max_tokens=1000, min_side=0))
+        assert resize.tokens <= 1000 < resize.native_tokens
+        assert resize.scale[0] == pytest.approx(resize.scale[1], rel=0.01)
+
+    # Not under the legibility floor, never upscaled
+    resize = fit(SCAN, "qwen2.5-vl-7b", ResolutionBudget(max_tokens=100))
+    assert max(resize.size) == 1024
+    assert fit((300, 400), "qwen2.5-vl-7b", ResolutionBudget(max_tokens=100)).size == (
+        300,
+        400,
+    )
+    # Hard limit of the API under any budget
+    assert max(fit((1000, 9000), "claude-sonnet-4", None).size) == 8000
+
+
+def test_budgets_per_source(policy):
+    policy = policy(sources={"docvqa": {"smolvlm": ResolutionBudget(max_side=500)}})
+    page = Image.new("RGB", (1000, 2000), "white")
+    assert max(policy.fit(page, "smolvlm", "docvqa").size) == 500
+    assert max(policy.fit(page, "smolvlm", "other").size) == 1536
+
+
+def test_positions_are_mapped_back_to_the_page(policy):
+    response = {"content": "a", "position": [10, 20, 30, 40]}
+    model = FakeVLM(response=response)
+    page = Image.new("1", (400, 200), 1)
+
+    policy(budgets={"fake": ResolutionBudget(max_side=100)})
+    assert generate_prediction("Q", page, "fake", model, None) == response
+
+    policy = policy(
+        budgets={"fake": ResolutionBudget(max_side=100, position_scale="pixels")}
+    )
+    page = Image.new("1", (400, 200), 1)
+    collector = MetricsCollector()
+    with instrument(collector):
+        prediction = generate_prediction("Q", page, "fake", model, None)
+        batch = generate_prediction_batch(["Q", "Q"], [page, page], "fake", model, None)
+    assert prediction["position"] == [40, 80, 120, 160]
+    assert batch == [prediction, prediction]
+
+    # The page is resized once, in shades of gray
+    stages = {s["stage"]: s for s in collector.to_dict()["stages"]}
+    assert stages["image_resizing"]["calls"] == 1
+    assert page._doc_explainer_resized[1].mode == "L"
+    assert policy.stats()["downscaled"] == 3
+
+
+def test_pages_edited_in_place_are_resized_again(policy):
+    policy = policy(budgets={"fake": ResolutionBudget(max_side=100)})
+    page = Image.new("RGB", (400, 200), "white")
+    resize = policy.fit(page, "fake")
+    assert policy.apply(page, resize, "fake").getpixel((10, 10)) == (255, 255, 255)
+    ImageDraw.Draw(page).rectangle([0, 0, 400, 200], fill="black")
+    assert policy.apply(page, resize, "fake").getpixel((10, 10)) == (0, 0, 0)
+
+
+def test_cache_keys_change_with_the_resolution():
+    page = Image.new("RGB", SCAN, "white")
+    resize = fit(page.size, "qwen2.5-vl-7b", ResolutionBudget(max_tokens=2048))
+    native = _cache_key("Q", page, "qwen2.5-vl-7b", None)
+    assert _cache_key("Q", page, "qwen2.5-vl-7b", None, resize=resize) != native
@@ -0,0 +1,99 @@
+import math
+import random
+
+import pytest
+
+from doc_explainer.spatial import WordIndex
+
+
+def _random_words(seed, n, pages=3):
+    rng = random.Random(seed)
+    return [
+        {
+            "page": rng.randint(1, pages),
+            "text": f"word{i}",
+            "bbox": [
+                rng.randint(0, 950),
+                rng.randint(0, 980),
+                rng.randint(1, 60),
+                rng.randint(1, 20),
+            ],
+        }
+        for i in range(n)
+    ]
+
+
+def _xyxy(word):
+    x, y, w, h = word["bbox"]
+    return x, y, x + w, y + h
+
+
+def test_intersecting_and_contained_match_brute_force():
+    words = _random_words(0, 500)
+    index = WordIndex.from_words(words)
+    rng = random.Random(1)
+
+    for _ in range(50):
+        page = rng.randint(1, 3)
+        x0, y0 = rng.randint(0, 900), rng.randint(0, 900)
+        bbox = [x0, y0, x0 + rng.randint(0, 200), y0 + rng.randint(0, 200)]
+
+        intersecting = [
+            i
+            for i, w in enumerate(words)
+            if w["page"] == page
+            and _xyxy(w)[0] <= bbox[2]
+            and _xyxy(w)[2] >= bbox[0]
+            and _xyxy(w)[1] <= bbox[3]
+            and _xyxy(w)[3] >= bbox[1]
+        ]
+        contained = [
+            i
+            for i, w in enumerate(words)
+            if w["page"] == page
+            and _xyxy(w)[0] >= bbox[0]
+            and _xyxy(w)[1] >= bbox[1]
+            and _xyxy(w)[2] <= bbox[2]
+            and _xyxy(w)[3] <= bbox[3]
+        ]
+
+        assert index.intersecting_ids(page, bbox) == intersecting
+        assert index.contained_ids(page, bbox) == contained
+
+
+def test_nearest_matches_brute_force():
+    words = _random_words(2, 400)
+    index = WordIndex.from_words(words)
+    rng = random.Random(3)
+
+    for _ in range(50):
+        page = rng.randint(1, 3)
+        px, py = rng.uniform(0, 1000), rng.uniform(0, 1000)
+
+        distances = []
+        for w in words:
+            if w["page"] != page:
+                continue
+            x0, y0, x1, y1 = _xyxy(w)
+            dx = max(x0 - px, 0, px - x1)
+            dy = max(y0 - py, 0, py - y1)
+            distances.append(math.sqrt(dx**2 + dy**2))
+
+        result = index.nearest_ids(page, (px, py), k=5)
+
+        assert [d for d, _ in result] == pytest.approx(sorted(distances)[:5])
+
+
+def test_snap():
+    words = [
+        {"page": 1, "text": "Invoice", "bbox": [100, 100, 80, 20]},
+        {"page": 1, "text": "42", "bbox": [190, 100, 20, 20]},
+        {"page": 1, "text": "Total", "bbox": [100, 300, 50, 20]},
+    ]
+    index = WordIndex.from_words(words)
+
+    assert index.snap(1, [95, 95, 215, 125]) == [100.0, 100.0, 210.0, 120.0]
+    assert index.snap(1, [95, 95, 150, 125]) == [100.0, 100.0, 180.0, 120.0]
+    assert index.snap(1, [500, 500, 600, 600]) is None
+    assert index.snap(2, [95, 95, 215, 125]) is None
+    assert index.words_on_page(1) == words